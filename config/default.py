@@ -74,6 +74,14 @@ ASC_ACAD_YR_CUTOVER = 214
 BOA_RDS_TEST_DATE_PATH = 'Temporary test path'
 BOA_RDS_ZERO_COUNT_ACCEPTABLE = False
 
+# Canvas analytics for the course sites of a term can be generated across this many worker processes, which are handed
+# courses in batches of about this many enrollment and submission rows. With a value of 1, courses are generated serially.
+BOAC_ANALYTICS_MAX_PROCESSES = 1
+BOAC_ANALYTICS_BATCH_ROWS = 100000
+# If true, regenerate Canvas analytics only for course sites whose enrollments, scores, activity or submissions have changed
+# since the previous run.
+BOAC_ANALYTICS_INCREMENTAL = False
+
 BOAC_REFRESHERS = [
     {
         'API_KEY': 'Regents of the University of California',
@@ -105,6 +113,13 @@ CURRENT_TERM = 'Fall 2017'
 FUTURE_TERM = 'Spring 2018'
 LOCH_S3_CANVAS_DATA_PATH_CURRENT_TERM = 'canvas/path/to/current/term'
 
+# Connections to RDS and Redshift are pooled per database. At most MAX_SIZE idle connections are kept per pool; busier
+# moments open overflow connections that are closed on return. A value of 0 disables pooling. Idle connections are closed
+# after MAX_IDLE_SECONDS, and pinged before reuse once idle for HEALTH_CHECK_SECONDS.
+DB_CONNECTION_POOL_MAX_SIZE = 4
+DB_CONNECTION_POOL_MAX_IDLE_SECONDS = 300
+DB_CONNECTION_POOL_HEALTH_CHECK_SECONDS = 30
+
 DEGREE_PROGRESS_API_URL = 'https://secreturl.berkeley.edu/PSFT_CS'
 DEGREE_PROGRESS_API_USERNAME = 'secretuser'
 DEGREE_PROGRESS_API_PASSWORD = 'secretpassword'
@@ -113,8 +128,15 @@ EARLIEST_ACADEMIC_HISTORY_TERM_ID = 2102
 EARLIEST_LEGACY_TERM = 'Fall 2001'
 EARLIEST_TERM = 'Fall 2016'
 
+# EDL feed builders stage source feeds in batches, either as 'columnar' row tuples or as 'pickle'd dicts of rows.
+EDL_SCHEMA_BATCH_FORMAT = 'columnar'
 EDL_SCHEMA_BATCH_SIZE = 50000
+# EDL feed batches are built by a pool of either 'thread' or 'process' workers. Feed building is CPU-bound Python, so
+# processes make use of multiple cores where threads are serialized by the GIL.
+EDL_SCHEMA_EXECUTOR = 'thread'
+EDL_SCHEMA_MAX_PROCESSES = 4
 EDL_SCHEMA_MAX_THREADS = 20
+EDL_SCHEMA_MAX_UPLOAD_THREADS = 4
 
 EMAIL_FEATURE_ENABLED = False
 EMAIL_FROM_ADDRESS = '__NESSIE_SUPPORT__at_berkeley.edu'
@@ -122,9 +144,16 @@ EMAIL_REDIRECT_WHEN_TESTING = ['__EMAIL_REDIRECT_WHEN_TESTING__at_berkeley.edu']
 EMAIL_SYSTEM_ERRORS_TO = ['__NESSIE_at_berkeley.edu']
 EMAIL_TEST_MODE = True
 
+# Row counts verifying a newly created external schema run concurrently, each on its own Redshift connection.
+EXTERNAL_TABLE_VERIFICATION_MAX_THREADS = 8
+
 # Notes imported from History dept do not ship with advisor UID
 HISTORY_DEPT_NOTES_DEFAULT_ADVISOR_UID = 82523
 
+# JSON embedded in TSV feed rows is serialized with orjson if installed, falling back to the standard library. Set to 'stdlib'
+# for output byte-for-byte identical to json.dumps (orjson output is compact, unescaped UTF-8 and writes NaN as null).
+JSON_SERIALIZER = 'orjson'
+
 # True on 'highlands' node, false on 'lowlands' nodes.
 # Override by embedding "highlands" or "lowlands" in the EB_ENVIRONMENT environment variable.
 JOB_SCHEDULING_ENABLED = True
@@ -209,6 +238,31 @@ LOGGING_LEVEL = logging.DEBUG
 LOGGING_PROPAGATION_LEVEL = logging.INFO
 LOGGING_PROPAGATION_TARGETS = ['boto3', 'botocore', 'nose', 'canvasapi', 'rq.worker', 's3transfer', 'werkzeug']
 
+# Merged student profile generation can be sharded by SID range across this many worker processes, in shards of the given
+# size. With a value of 1, profiles are generated serially.
+MERGED_PROFILE_MAX_PROCESSES = 1
+MERGED_PROFILE_SHARD_SIZE = 10000
+# If true, regenerate merged profiles only for students whose source feeds have changed since the previous run.
+MERGED_PROFILE_INCREMENTAL = False
+# Per-term enrollment feeds can be generated in parallel across this many worker processes, with finished terms uploaded
+# and copied into staging while later terms are generated. With a value of 1, terms are generated serially.
+MERGED_TERM_FEED_MAX_PROCESSES = 1
+
+# Canvas sync status and snapshot events are buffered and written to the metadata schema in one transaction once this many
+# events are pending, or this many seconds after the first pending event. With a batch size of 1, every event is written
+# as it occurs. Background job status changes always flush pending events and are written synchronously.
+METADATA_WRITER_BATCH_SIZE = 100
+METADATA_WRITER_FLUSH_SECONDS = 5
+
+# With 'differential', RDS index tables refreshed from Redshift are staged in temporary tables and only the rows of SIDs
+# whose content changed are rewritten, keeping locks on BOAC-facing tables short. With 'full', tables are truncated and
+# reloaded.
+RDS_INDEX_SYNC_MODE = 'differential'
+
+# Bulk inserts into RDS of at least this many rows are sent as a streamed COPY FROM STDIN rather than as INSERT statements.
+# Batches holding values that COPY text format cannot represent, such as lists or bytes, are always inserted.
+RDS_COPY_ROWS_THRESHOLD = 10000
+
 # These RDS schemas are copied from the Redshift schemas below and contain a subset of index tables.
 RDS_SCHEMA_ADVISING_APPOINTMENTS = 'boac_advising_appointments'
 RDS_SCHEMA_ADVISING_NOTES = 'boac_advising_notes'
@@ -235,6 +289,27 @@ REDSHIFT_USER = 'username'
 
 REDSHIFT_IAM_ROLE = 'iam role'
 
+# Staged TSV files are split into this many gzip-compressed parts and loaded with a single manifest COPY. Redshift loads
+# fastest when the number of parts is a multiple of the cluster's slice count. With a value of 0, staged files are uploaded
+# uncompressed as a single part.
+REDSHIFT_COPY_GZIP_PARTS = 4
+
+# Large queries given a sort key are unloaded to S3 in parallel, one part per slice, and merged back into order as they
+# are read. Each part is prefetched by a background thread holding up to this many chunks of parsed rows.
+REDSHIFT_UNLOAD_PREFETCH_CHUNKS = 4
+# If True, a parallel unload of the same query already completed in the same job run is read again rather than repeated.
+REDSHIFT_UNLOAD_RESUME = True
+
+# Rows of queries streamed from a Redshift server-side cursor are fetched in batches sized, from the width of the first rows,
+# to about this many bytes per round trip, within the given bounds on rows per batch. With a value of 0, batches are a
+# fixed 1000 rows.
+REDSHIFT_STREAM_FETCH_BYTES = 4 * 1024 * 1024
+REDSHIFT_STREAM_FETCH_ROWS = (100, 100000)
+
+# Statements in a DDL script that neither create nor read each other's tables run concurrently on up to this many Redshift
+# connections. With a value of 1, statements run serially in script order on one connection.
+REDSHIFT_DDL_MAX_THREADS = 4
+
 # BOA limited access credentials to nessie rds and redshift
 RDS_APP_BOA_USER = 'boa rds username'
 REDSHIFT_APP_BOA_USER = 'boa redshift username'
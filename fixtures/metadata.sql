@@ -67,3 +67,19 @@ CREATE TABLE IF NOT EXISTS metadata.photo_import_status
     status VARCHAR NOT NULL,
     updated_at TIMESTAMP NOT NULL
 );
+
+CREATE TABLE IF NOT EXISTS metadata.canvas_analytics_fingerprints
+(
+    term_id VARCHAR(4) NOT NULL,
+    canvas_course_id VARCHAR NOT NULL,
+    fingerprint VARCHAR NOT NULL,
+    updated_at TIMESTAMP NOT NULL,
+    PRIMARY KEY (term_id, canvas_course_id)
+);
+
+CREATE TABLE IF NOT EXISTS metadata.merged_profile_digests
+(
+    sid VARCHAR NOT NULL PRIMARY KEY,
+    digest VARCHAR NOT NULL,
+    updated_at TIMESTAMP NOT NULL
+);
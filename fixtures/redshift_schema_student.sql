@@ -39,6 +39,14 @@ CREATE TABLE IF NOT EXISTS {redshift_schema_student}.student_demographics
     feed TEXT NOT NULL
 );
 
+CREATE TABLE IF NOT EXISTS {redshift_schema_student}.student_canvas_site_memberships
+(
+    sid VARCHAR NOT NULL,
+    term_id VARCHAR(4) NOT NULL,
+    sis_section_ids VARCHAR,
+    feed TEXT NOT NULL
+);
+
 CREATE TABLE IF NOT EXISTS {redshift_schema_student}.student_enrollment_terms
 (
     sid VARCHAR NOT NULL,
@@ -102,6 +110,19 @@ CREATE TABLE IF NOT EXISTS {redshift_schema_student}_staging.student_profile_ind
     terms_in_attendance INT
 );
 
+CREATE TABLE IF NOT EXISTS {redshift_schema_student}_staging.student_canvas_site_memberships
+(
+    sid VARCHAR NOT NULL,
+    term_id VARCHAR(4) NOT NULL,
+    sis_section_ids VARCHAR,
+    feed TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS {redshift_schema_student}_staging.student_canvas_site_refreshed_courses
+(
+    canvas_course_id VARCHAR NOT NULL
+);
+
 CREATE TABLE IF NOT EXISTS {redshift_schema_student}_staging.student_enrollment_terms
 (
     sid VARCHAR NOT NULL,
@@ -124,8 +145,18 @@ CREATE TABLE IF NOT EXISTS {redshift_schema_student}_staging.student_majors
     PRIMARY KEY (sid, college, major, division)
 );
 
+CREATE TABLE IF NOT EXISTS {redshift_schema_student}_staging.student_profile_refreshed_sids
+(
+    sid VARCHAR NOT NULL
+);
+
 CREATE TABLE IF NOT EXISTS {redshift_schema_student}_staging.student_profiles
 (
     sid VARCHAR NOT NULL,
     profile TEXT NOT NULL
 );
+
+-- Redshift's JSON_EXTRACT_PATH_TEXT takes a JSON string, where Postgres's takes a json value.
+CREATE OR REPLACE FUNCTION public.json_extract_path_text(json_string VARCHAR, path_element VARCHAR) RETURNS VARCHAR AS $$
+    SELECT pg_catalog.json_extract_path_text(json_string::json, path_element)
+$$ LANGUAGE SQL IMMUTABLE;
@@ -30,6 +30,7 @@ import dateutil.parser
 from flask import current_app as app, request
 from nessie.api.auth_helper import auth_required
 from nessie.lib import http, metadata
+from nessie.lib.db import connection_pool_metrics
 from nessie.lib.http import tolerant_jsonify
 
 
@@ -71,6 +72,12 @@ def background_job_status():
     return tolerant_jsonify([to_api_json(row) for row in rows])
 
 
+@app.route('/api/admin/connection_pools')
+@auth_required
+def connection_pools():
+    return tolerant_jsonify(connection_pool_metrics())
+
+
 @app.route('/api/admin/xkcd')
 @auth_required
 def xkcd():
@@ -24,10 +24,14 @@ ENHANCEMENTS, OR MODIFICATIONS.
 """
 
 from contextlib import contextmanager
-from datetime import datetime
+from datetime import date, datetime
+from decimal import Decimal
+import json
+import re
 
 from flask import current_app as app
 from nessie.lib.db import get_psycopg_cursor
+from nessie.lib.instrumentation import record_query
 import psycopg2
 import psycopg2.extras
 
@@ -58,9 +62,16 @@ class Transaction():
     def execute(self, sql, params=None, log_query=True):
         return _execute(sql, self.cursor, params, 'write', log_query)
 
+    def fetch(self, sql, params=None, log_query=True):
+        with self.cursor.connection.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
+            return _execute(sql, cursor, params, 'read', log_query)
+
     def insert_bulk(self, sql, rows):
         return _insert_bulk(sql, self.cursor, rows)
 
+    def copy_rows(self, table, columns, rows):
+        return _copy_rows(table, columns, self.cursor, rows)
+
     def commit(self):
         return self.execute('COMMIT TRANSACTION')
 
@@ -91,6 +102,7 @@ def _execute(sql, cursor, params=None, operation='write', log_query=True):
         cursor.execute(sql, params)
         result = cursor.statusmessage
         query_time = datetime.now().timestamp() - ts
+        record_query('rds', sql, query_time, rows=_rowcount(cursor))
         if log_query:
             app.logger.debug(f'RDS query returned status {result} in {query_time} seconds: \n{sql}\n{params or ""}')
     except psycopg2.Error as e:
@@ -102,16 +114,86 @@ def _execute(sql, cursor, params=None, operation='write', log_query=True):
         return result
 
 
+# Plain 'INSERT INTO table (columns) VALUES %s' statements, which can be run as COPY with no change in meaning.
+_COPYABLE_INSERT = re.compile(r'^\s*INSERT INTO\s+([\w.]+)\s*\(([\w\s,]+)\)\s*VALUES\s+%s\s*;?\s*$', re.IGNORECASE)
+
+
 def _insert_bulk(sql, cursor, rows):
+    copyable = _COPYABLE_INSERT.match(sql)
+    if copyable and len(rows) >= app.config['RDS_COPY_ROWS_THRESHOLD'] and all(_is_copyable_row(row) for row in rows):
+        table, columns = copyable.groups()
+        return _copy_rows(table, [c.strip() for c in columns.split(',')], cursor, rows)
     result = None
     try:
+        ts = datetime.now().timestamp()
         psycopg2.extras.execute_values(cursor, sql, rows, page_size=5000)
         result = cursor.statusmessage
+        record_query('rds', sql, datetime.now().timestamp() - ts, rows=len(rows))
     except psycopg2.Error as e:
         _log_db_error(e, sql)
     return result
 
 
+def _copy_rows(table, columns, cursor, rows):
+    sql = f'COPY {table} ({", ".join(columns)}) FROM STDIN'
+    result = None
+    try:
+        ts = datetime.now().timestamp()
+        cursor.copy_expert(sql, _CopyRowStream(rows))
+        # psycopg2 leaves statusmessage empty after COPY; report the row count as an INSERT would.
+        result = f'COPY {cursor.rowcount}'
+        query_time = datetime.now().timestamp() - ts
+        record_query('rds', sql, query_time, rows=_rowcount(cursor))
+        app.logger.debug(f'RDS query returned status {result} in {query_time} seconds: \n{sql}')
+    except psycopg2.Error as e:
+        _log_db_error(e, sql)
+    return result
+
+
+class _CopyRowStream():
+    """Read-only file object serving rows, pulled from any iterable as needed, in COPY text format."""
+
+    def __init__(self, rows):
+        self.rows = iter(rows)
+        self.buffer = b''
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            row = next(self.rows, None)
+            if row is None:
+                break
+            self.buffer += ('\t'.join(_copy_text_value(v) for v in row) + '\n').encode('utf-8')
+        if size < 0:
+            size = len(self.buffer)
+        chunk, self.buffer = self.buffer[:size], self.buffer[size:]
+        return chunk
+
+
+# Types written to COPY text format by _copy_text_value. Anything else (lists, bytes, tuples) needs psycopg2 adaptation.
+_COPY_TEXT_TYPES = (str, int, float, Decimal, date, dict)
+
+
+def _is_copyable_row(row):
+    return all(v is None or isinstance(v, _COPY_TEXT_TYPES) for v in row)
+
+
+def _copy_text_value(value):
+    if value is None:
+        return '\\N'
+    if not isinstance(value, _COPY_TEXT_TYPES):
+        raise TypeError(f'Cannot write {type(value).__name__} value in COPY text format: {value!r}')
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, dict):
+        value = json.dumps(value)
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def _rowcount(cursor):
+    # Rows returned by a read, or affected by a write; psycopg2 reports -1 where no count applies.
+    return max(cursor.rowcount, 0)
+
+
 def _log_db_error(e, sql):
     error_str = str(e)
     if e.pgcode:
@@ -23,15 +23,22 @@ SOFTWARE AND ACCOMPANYING DOCUMENTATION, IF ANY, PROVIDED HEREUNDER IS PROVIDED
 ENHANCEMENTS, OR MODIFICATIONS.
 """
 
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from contextlib import contextmanager
 from datetime import datetime
+from functools import partial
+import hashlib
 import io
 import re
+import time
 
 from flask import current_app as app
 from nessie.externals import s3
 from nessie.lib.db import get_psycopg_cursor, get_psycopg_cursor_streaming
-from nessie.lib.util import get_s3_sis_daily_path
+from nessie.lib.ddl import ddl_dependencies, parse_ddl_statement, split_ddl_script
+from nessie.lib.instrumentation import current_job_id, record_query, submit_in_context
+from nessie.lib.util import get_s3_sis_daily_path, row_type
 import psycopg2
 import psycopg2.extras
 import psycopg2.sql
@@ -41,6 +48,11 @@ import psycopg2.sql
 # Batch size to use when streaming large result sets.
 CURSOR_ITERSIZE = 1000
 
+# A column in the ORDER BY clause of an unloaded query. NULLs sort as larger than any other value unless nulls_first says
+# otherwise, matching Redshift. A convert function, if given, is applied to each value, NULL included as None, before
+# comparison; it may return None for NULL.
+SortColumn = namedtuple('SortColumn', ['name', 'descending', 'nulls_first', 'convert'], defaults=[False, None, None])
+
 
 def execute(sql, **kwargs):
     """Execute SQL write operation with optional keyword arguments for formatting, returning a status string."""
@@ -59,38 +71,92 @@ def execute_ddl_script(sql):
     * DROP EXTERNAL TABLE and CREATE EXTERNAL TABLE will fail with a 'cannot run inside a transaction block'
       message unless autocommit is enabled.
 
+    * Statements that do not depend on each other, judged by the schema-qualified tables each one creates or modifies
+      and reads, are run concurrently on pooled connections, up to REDSHIFT_DDL_MAX_THREADS at a time. Scripts that
+      depend on session state, such as transaction blocks or temporary tables, are always run serially, on a connection
+      that is closed rather than pooled afterwards.
+
     WARNING: This will break horribly if a semicolon terminated statement is inside a block quote.
     """
-    statements = sql.split(';')
-    # Remove any trailing debris after the last SQL statement.
-    del statements[-1]
-    with _get_cursor() as cursor:
+    statements = [parse_ddl_statement(s) for s in split_ddl_script(sql)]
+    start = time.monotonic()
+    max_threads = app.config['REDSHIFT_DDL_MAX_THREADS']
+    session_bound = any(s.session_bound for s in statements)
+    if max_threads > 1 and len(statements) > 1 and not session_bound:
+        timings = _execute_ddl_statements_concurrently(statements, max_threads)
+    else:
+        # Session state set by a script must not outlive it, so session-bound scripts run on an unpooled connection.
+        timings = _execute_ddl_statements_serially(statements, pooled=not session_bound)
+    if timings is None:
+        return False
+    slowest = sorted(timings.items(), key=lambda t: -t[1])[:3]
+    slowest_summary = ', '.join(f'{index + 1} ({elapsed:.1f}s)' for index, elapsed in slowest)
+    app.logger.info(f'Executed {len(statements)} DDL statements in {time.monotonic() - start:.1f}s; slowest: {slowest_summary}')
+    return True
+
+
+def _execute_ddl_statements_serially(statements, pooled=True):
+    timings = {}
+    with _get_cursor(pooled=pooled) as cursor:
         if not cursor:
             app.logger.error('Failed to get cursor to execute DDL script; aborting.')
-            return False
+            return None
         for index, statement in enumerate(statements):
             app.logger.info(f'Executing DDL script {index + 1} of {len(statements)}')
-            result = _execute(statement, operation='write', cursor=cursor)
+            start = time.monotonic()
+            result = _execute(statement.sql, operation='write', cursor=cursor)
             if not result:
-                app.logger.error(f'Aborting DDL script. Error executing statement: {statement}')
-                return False
-    return True
+                app.logger.error(f'Aborting DDL script. Error executing statement: {statement.sql}')
+                return None
+            timings[index] = time.monotonic() - start
+    return timings
+
+
+def _execute_ddl_statements_concurrently(statements, max_threads):
+    # Statements become ready, and are submitted in script order, once everything they depend on has succeeded. After a
+    # failure nothing more is submitted, and statements already running are allowed to finish.
+    dependencies = ddl_dependencies(statements)
+    app_obj = app._get_current_object()
+    timings = {}
+    pending = list(range(len(statements)))
+    running = {}
+    failed = False
+    with ThreadPoolExecutor(max_workers=max_threads) as executor:
+        while (pending and not failed) or running:
+            if not failed:
+                ready = [i for i in pending if dependencies[i] <= timings.keys()]
+                for index in ready[:max_threads - len(running)]:
+                    pending.remove(index)
+                    future = submit_in_context(executor, _execute_ddl_statement, app_obj, index, len(statements), statements[index])
+                    running[future] = index
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = running.pop(future)
+                elapsed = future.result()
+                if elapsed is None:
+                    app.logger.error(f'Aborting DDL script. Error executing statement: {statements[index].sql}')
+                    failed = True
+                else:
+                    timings[index] = elapsed
+    return None if failed else timings
+
+
+def _execute_ddl_statement(app_obj, index, count, statement):
+    with app_obj.app_context():
+        app.logger.info(f'Executing DDL script {index + 1} of {count}')
+        start = time.monotonic()
+        with _get_cursor() as cursor:
+            if not cursor or not _execute(statement.sql, operation='write', cursor=cursor):
+                return None
+        elapsed = time.monotonic() - start
+        app.logger.debug(f'DDL statement {index + 1} of {count} finished in {elapsed:.1f}s')
+        return elapsed
 
 
 def copy_tsv_from_s3(table, s3_key):
     # In a test environment, retrieve object contents from mock S3 and use Postgres COPY FROM STDIN.
     if app.config['NESSIE_ENV'] == 'test':
-        try:
-            buf = io.StringIO(s3.get_object_text(s3_key))
-            with _get_cursor(operation='read') as cursor:
-                cursor.copy_from(buf, table)
-            return True
-        except psycopg2.Error as e:
-            error_str = str(e)
-            if e.pgcode:
-                error_str += f'{e.pgcode}: {e.pgerror}\n'
-            app.logger.warning(error_str)
-            return False
+        return _copy_from_stdin(table, s3.get_object_text(s3_key))
     # Real Redshift accepts an S3 URL with IAM role.
     else:
         iam_role = app.config['REDSHIFT_IAM_ROLE']
@@ -98,6 +164,42 @@ def copy_tsv_from_s3(table, s3_key):
         return execute(f"COPY {table} FROM '{s3_prefix}{s3_key}' IAM_ROLE '{iam_role}' DELIMITER '\\t';")
 
 
+def copy_tsv_from_s3_manifest(table, manifest_key, gzip=False):
+    # In a test environment, copy each file listed in the manifest from mock S3.
+    if app.config['NESSIE_ENV'] == 'test':
+        manifest = s3.get_object_json(manifest_key)
+        s3_prefix = 's3://' + app.config['LOCH_S3_BUCKET'] + '/'
+        for entry in manifest['entries']:
+            s3_key = entry['url'][len(s3_prefix):]
+            if gzip:
+                text = s3.get_unzipped_object_text(s3_key)
+            else:
+                text = s3.get_object_text(s3_key)
+            if not _copy_from_stdin(table, text):
+                return False
+        return True
+    # Real Redshift loads all files listed in the manifest with a single COPY.
+    else:
+        iam_role = app.config['REDSHIFT_IAM_ROLE']
+        s3_prefix = 's3://' + app.config['LOCH_S3_BUCKET'] + '/'
+        return execute(f"COPY {table} FROM '{s3_prefix}{manifest_key}' IAM_ROLE '{iam_role}' DELIMITER '\\t' MANIFEST{' GZIP' if gzip else ''};")
+
+
+def _copy_from_stdin(table, text):
+    try:
+        buf = io.StringIO(text)
+        with _get_cursor(operation='read') as cursor:
+            # Unlike copy_from, copy_expert accepts a schema-qualified table name.
+            cursor.copy_expert(f'COPY {table} FROM STDIN', buf)
+        return True
+    except psycopg2.Error as e:
+        error_str = str(e)
+        if e.pgcode:
+            error_str += f'{e.pgcode}: {e.pgerror}\n'
+        app.logger.warning(error_str)
+        return False
+
+
 def create_external_schema(external_schema, role):
     query = f"""
         CREATE EXTERNAL SCHEMA {external_schema}
@@ -150,9 +252,12 @@ def drop_external_schema(schema_name):
 def fetch(sql, **kwargs):
     """Execute SQL read operation with optional keyword arguments for formatting."""
     if kwargs.pop('stream_redshift', None):
-        cursor = _get_streaming_cursor()
-        _execute_streaming(sql, cursor, **kwargs)
-        return cursor
+        cursor = _get_streaming_cursor(cursor_factory=None)
+        if not cursor:
+            return None
+        start = time.monotonic()
+        sql_text = _execute_streaming(sql, cursor, **kwargs)
+        return _StreamingRows(cursor, sql_text, time.monotonic() - start)
     # For very large Redshift result sets, AWS recommends unloading to S3 rather than using a server-side cursor.
     elif kwargs.pop('stream_s3', None):
         if app.config['NESSIE_ENV'] == 'test':
@@ -160,13 +265,20 @@ def fetch(sql, **kwargs):
             _execute_streaming(sql, cursor, **kwargs)
             return cursor
         else:
+            # Queries with a sort key are unloaded in parallel and merged back into order as they are read.
+            sort_key = kwargs.pop('unload_sort_key', None)
             with _get_cursor() as cursor:
                 if not cursor:
                     return None
-                s3_prefix = _execute_unload(sql, cursor, **kwargs)
-                if not s3_prefix:
+                s3_location = _execute_unload(sql, cursor, parallel=bool(sort_key), **kwargs)
+                if not s3_location:
                     return None
-                return s3.get_tsv_stream(s3_prefix)
+                if sort_key:
+                    part_keys = s3.get_manifest_keys(s3_location)
+                    if part_keys is None:
+                        return None
+                    return s3.get_merged_tsv_stream(part_keys, sort_key, prefetch_chunks=app.config['REDSHIFT_UNLOAD_PREFETCH_CHUNKS'])
+                return s3.get_tsv_stream(s3_location)
     else:
         # If streaming is not requested, return an array of dictionaries.
         with _get_cursor(operation='read') as cursor:
@@ -179,27 +291,196 @@ def fetch(sql, **kwargs):
                 return copy_for_pandas(rows)
 
 
+def unload_sort_key(*columns):
+    """Return a key function reproducing an ORDER BY clause on unloaded rows, for merging the parts of a parallel unload.
+
+    Columns are given as names or SortColumns. Unloaded values are strings, with NULL unloaded as the empty string.
+    """
+    columns = tuple(c if isinstance(c, SortColumn) else SortColumn(c) for c in columns)
+
+    def _sort_key(row):
+        values = []
+        for column in columns:
+            value = row[column.name]
+            if value == '':
+                value = None
+            if column.convert:
+                value = column.convert(value)
+            values.append(value)
+        return _UnloadSortKey(columns, values)
+    return _sort_key
+
+
+class _UnloadSortKey:
+
+    __slots__ = ('columns', 'values')
+
+    def __init__(self, columns, values):
+        self.columns = columns
+        self.values = values
+
+    def __eq__(self, other):
+        return self.values == other.values
+
+    def __lt__(self, other):
+        for column, value, other_value in zip(self.columns, self.values, other.values):
+            if value == other_value:
+                continue
+            nulls_first = column.descending if column.nulls_first is None else column.nulls_first
+            if value is None:
+                return nulls_first
+            if other_value is None:
+                return not nulls_first
+            return value > other_value if column.descending else value < other_value
+        return False
+
+
+def fetch_iter(sql, chunk_size=CURSOR_ITERSIZE, coerce=False, **kwargs):
+    """Yield rows of a read operation, with optional keyword arguments for formatting, as they arrive from Redshift.
+
+    Rows are fetched chunk_size at a time over a server-side cursor and yielded as tuples that also support lookup by
+    column name. Unlike fetch, the full result set is never held in memory; rows are not copied into dicts, and numeric
+    columns are coerced as in copy_for_pandas only if coerce is set. Errors are logged and re-raised.
+    """
+    with get_psycopg_cursor(operation='write', autocommit=False, **_connection_args()) as cursor:
+        # Server-side cursors must run inside a transaction, which is rolled back when the connection is returned.
+        streaming_cursor = cursor.connection.cursor(name=f'nessie_cursor_{datetime.now().timestamp()}')
+        try:
+            # Query time counts only execution and fetches, not time spent by the consumer between rows.
+            start = time.monotonic()
+            sql_text = _execute_streaming(sql, streaming_cursor, **kwargs)
+            chunk = streaming_cursor.fetchmany(chunk_size)
+            query_time = time.monotonic() - start
+            row_count = 0
+            columns = tuple(column.name for column in streaming_cursor.description)
+            make_row = row_type(columns)
+            coercions = _pandas_coercions(columns) if coerce else None
+            while chunk:
+                row_count += len(chunk)
+                for values in chunk:
+                    if coercions:
+                        values = list(values)
+                        for index, to_number in coercions:
+                            values[index] = to_number(values[index])
+                    yield make_row(values)
+                start = time.monotonic()
+                chunk = streaming_cursor.fetchmany(chunk_size)
+                query_time += time.monotonic() - start
+            record_query('redshift', sql_text, query_time, rows=row_count)
+        except psycopg2.Error as e:
+            _handle_psycopg2_error(e)
+            raise
+        finally:
+            if not streaming_cursor.closed and not streaming_cursor.connection.closed:
+                streaming_cursor.close()
+
+
+class _StreamingRows:
+    """Rows of a server-side cursor, fetched in batches sized to a byte budget per round trip.
+
+    The first batch is CURSOR_ITERSIZE rows. The width of rows in the first few batches then sets the size of later
+    batches, so that each fetch returns about REDSHIFT_STREAM_FETCH_BYTES, within the REDSHIFT_STREAM_FETCH_ROWS bounds.
+    Rows are tuples that also support lookup by column name. Closing the stream closes its connection.
+    """
+
+    # Number of batches measured before the fetch size is settled.
+    sample_batches = 3
+
+    def __init__(self, cursor, sql_text, query_time):
+        self.cursor = cursor
+        self.sql_text = sql_text
+        self.query_time = query_time
+        self.fetch_bytes = app.config['REDSHIFT_STREAM_FETCH_BYTES']
+        self.min_rows, self.max_rows = app.config['REDSHIFT_STREAM_FETCH_ROWS']
+        self.fetch_size = CURSOR_ITERSIZE
+        self.round_trips = 0
+        self.row_count = 0
+        self.recorded = False
+        self._sampled_batches = 0
+        self._sampled_bytes = 0
+        self._sampled_rows = 0
+
+    def __iter__(self):
+        # A server-side cursor describes its columns only once the first batch is fetched.
+        batch = self._fetch_batch()
+        make_row = row_type(tuple(column.name for column in self.cursor.description))
+        while batch:
+            for values in batch:
+                yield make_row(values)
+            batch = self._fetch_batch()
+        self._record()
+
+    def close(self):
+        self._record()
+        connection = self.cursor.connection
+        if not self.cursor.closed and not connection.closed:
+            self.cursor.close()
+        if not connection.closed:
+            connection.close()
+
+    def _fetch_batch(self):
+        start = time.monotonic()
+        batch = self.cursor.fetchmany(self.fetch_size)
+        self.query_time += time.monotonic() - start
+        self.round_trips += 1
+        self.row_count += len(batch)
+        if batch and self.fetch_bytes and self._sampled_batches < self.sample_batches:
+            self._sampled_batches += 1
+            self._sampled_rows += len(batch)
+            self._sampled_bytes += sum(_row_bytes(values) for values in batch)
+            row_bytes = max(self._sampled_bytes / self._sampled_rows, 1)
+            self.fetch_size = max(self.min_rows, min(self.max_rows, int(self.fetch_bytes / row_bytes)))
+        return batch
+
+    def _record(self):
+        if not self.recorded:
+            self.recorded = True
+            record_query('redshift', self.sql_text, self.query_time, rows=self.row_count)
+            app.logger.debug(f'Streamed {self.row_count} rows in {self.round_trips} fetches (final fetch size {self.fetch_size})')
+
+
+def _row_bytes(values):
+    # Approximate the size of a row on the wire by the text length of its values.
+    return sum(len(value) if isinstance(value, str) else len(str(value)) for value in values if value is not None)
+
+
+# For Pandas compatibility, a handful of columns need to be forced to numeric values.
+PANDAS_FLOAT_COLUMNS = {'current_score', 'last_activity_at', 'submissions_turned_in'}
+PANDAS_INT_COLUMNS = {'canvas_course_id', 'canvas_user_id'}
+
+
 def copy_for_pandas(rows):
-    # For Pandas compatibility, copy psycopg's list-like object of dict-like objects to a real list of dicts. A handful of colimns need to be forced
-    # to numeric values.
+    # For Pandas compatibility, copy psycopg's list-like object of dict-like objects to a real list of dicts, with numeric
+    # columns coerced.
     def _transform_row(row):
-        copied = row.copy()
-        for key in {'current_score', 'last_activity_at', 'submissions_turned_in'}:
+        copied = dict(row)
+        for key in PANDAS_FLOAT_COLUMNS:
             if key in copied:
-                try:
-                    copied[key] = float(copied[key])
-                except (TypeError, ValueError):
-                    copied[key] = None
-        for key in {'canvas_course_id', 'canvas_user_id'}:
+                copied[key] = _to_number(float, copied[key])
+        for key in PANDAS_INT_COLUMNS:
             if key in copied:
-                try:
-                    copied[key] = int(copied[key])
-                except (TypeError, ValueError):
-                    copied[key] = None
+                copied[key] = _to_number(int, copied[key])
         return copied
     return [_transform_row(r) for r in rows]
 
 
+def _pandas_coercions(columns):
+    coercions = []
+    for index, column in enumerate(columns):
+        if column in PANDAS_FLOAT_COLUMNS:
+            coercions.append((index, partial(_to_number, float)))
+        elif column in PANDAS_INT_COLUMNS:
+            coercions.append((index, partial(_to_number, int)))
+    return coercions
+
+
+def _to_number(number_type, value):
+    try:
+        return number_type(value)
+    except (TypeError, ValueError):
+        return None
+
+
 class Transaction():
     def __init__(self, cursor):
         self.cursor = cursor
@@ -222,11 +503,12 @@ def transaction():
 
 
 @contextmanager
-def _get_cursor(autocommit=True, operation='write'):
+def _get_cursor(autocommit=True, operation='write', pooled=True):
     try:
         with get_psycopg_cursor(
             operation=operation,
             autocommit=autocommit,
+            pooled=pooled,
             **_connection_args(),
         ) as cursor:
             yield cursor
@@ -235,9 +517,9 @@ def _get_cursor(autocommit=True, operation='write'):
         yield None
 
 
-def _get_streaming_cursor():
+def _get_streaming_cursor(cursor_factory=psycopg2.extras.DictCursor):
     try:
-        cursor = get_psycopg_cursor_streaming(**_connection_args())
+        cursor = get_psycopg_cursor_streaming(cursor_factory=cursor_factory, **_connection_args())
         cursor.itersize = CURSOR_ITERSIZE
         return cursor
     except psycopg2.Error as e:
@@ -282,11 +564,13 @@ def _execute(sql, operation, cursor, **kwargs):
         if operation == 'read':
             result = [row for row in cursor]
             query_time = datetime.now().timestamp() - ts
+            record_query('redshift', _sql_text(sql, cursor), query_time, rows=len(result))
             if not silent:
                 app.logger.debug(f'Redshift query returned {len(result)} rows in {query_time} seconds:\n{sql_for_log}\n{params or ""}')
         else:
             result = cursor.statusmessage
             query_time = datetime.now().timestamp() - ts
+            record_query('redshift', _sql_text(sql, cursor), query_time, rows=max(cursor.rowcount, 0))
             if not silent:
                 app.logger.debug(f'Redshift query returned status {result} in {query_time} seconds:\n{sql_for_log}\n{params or ""}')
     except psycopg2.Error as e:
@@ -307,9 +591,23 @@ def _execute_streaming(sql, cursor, **kwargs):
     sql_for_log = re.sub(r"CREDENTIALS '[^']+'", "CREDENTIALS '<credentials>'", str(sql))
     cursor.execute(sql, params)
     app.logger.debug(f'Redshift query (cursor {cursor.name} streaming results:\n{sql_for_log}\n{params or ""}')
+    return _sql_text(sql, cursor)
 
 
-def _execute_unload(sql, cursor, **kwargs):
+def _sql_text(sql, cursor):
+    # Formatted queries are psycopg2 Composed objects, whose str() is a repr rather than SQL.
+    return sql.as_string(cursor) if isinstance(sql, psycopg2.sql.Composable) else sql
+
+
+def _execute_unload(sql, cursor, parallel=False, **kwargs):
+    """Unload query results to S3 as gzipped TSV.
+
+    A serial unload writes a single, globally sorted file and returns its S3 prefix. A parallel unload writes one sorted
+    part per slice, plus a manifest listing the parts, and returns the manifest key. Parallel unloads land under the job
+    run and a digest of the query, so that a query repeated within one job run can pick up a completed unload rather than
+    repeat it. A later run, which may follow a refresh of upstream data, always unloads afresh, as does a query run outside
+    any job.
+    """
     params = None
     unload_path = None
 
@@ -319,17 +617,35 @@ def _execute_unload(sql, cursor, **kwargs):
         sql = psycopg2.sql.SQL(sql).format(**kwargs).as_string(cursor.connection)
 
     destination_prefix = f'{get_s3_sis_daily_path()}/unloads/{unload_path}/'
+    if parallel:
+        job_id = current_job_id()
+        destination_prefix += f"{job_id or 'no_job'}/{hashlib.md5(f'{sql}{params}'.encode()).hexdigest()}/"
+        manifest_key = f'{destination_prefix}manifest'
+        if job_id and app.config['REDSHIFT_UNLOAD_RESUME'] and s3.object_exists(manifest_key):
+            app.logger.info(f'Resuming from query results already unloaded to {manifest_key}')
+            return manifest_key
     destination_path = f"s3://{app.config['LOCH_S3_BUCKET']}/{destination_prefix}"
     iam_role = app.config['REDSHIFT_IAM_ROLE']
 
+    query_sql = sql
     # Escape SQL for insertion into UNLOAD
     sql = sql.replace('\'', '\\\'')
     sql = f"""UNLOAD ('{sql}') TO '{destination_path}' IAM_ROLE '{iam_role}'
               DELIMITER AS '\\t' NULL AS ''
-              ADDQUOTES ALLOWOVERWRITE ENCRYPTED ESCAPE GZIP HEADER PARALLEL OFF"""
+              ADDQUOTES ALLOWOVERWRITE ENCRYPTED ESCAPE GZIP HEADER {'PARALLEL ON MANIFEST' if parallel else 'PARALLEL OFF'}"""
+    start = time.monotonic()
     cursor.execute(sql, params)
+    query_time = time.monotonic() - start
+    unloaded_objects = s3.get_keys_with_prefix(destination_prefix, full_objects=True) or []
+    record_query(
+        'redshift',
+        # The unloaded query itself is fingerprinted, since as a quoted literal inside UNLOAD it would be normalized away.
+        f'UNLOAD {query_sql}',
+        query_time,
+        bytes_unloaded=sum(o['Size'] for o in unloaded_objects if not o['Key'].endswith('manifest')),
+    )
 
     # Don't log sensitive credentials in the SQL.
     sql_for_log = re.sub(r"CREDENTIALS '[^']+'", "CREDENTIALS '<credentials>'", str(sql))
     app.logger.debug(f'Redshift unloaded query results to {unload_path}: {sql_for_log}')
-    return destination_prefix
+    return manifest_key if parallel else destination_prefix
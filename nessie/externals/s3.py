@@ -24,10 +24,17 @@ ENHANCEMENTS, OR MODIFICATIONS.
 """
 
 import csv
-from gzip import GzipFile
+from gzip import decompress, GzipFile
+import heapq
 import io
+from itertools import islice
 import json
+from operator import itemgetter
+import queue
+import shutil
+import sys
 import tempfile
+from threading import Event, Thread
 from zipfile import ZipFile
 
 import boto3
@@ -177,6 +184,17 @@ def get_object_text(key):
         return None
 
 
+def get_unzipped_object_text(key):
+    client = get_client()
+    bucket = app.config['LOCH_S3_BUCKET']
+    try:
+        _object = client.get_object(Bucket=bucket, Key=key)
+        return decompress(_object['Body'].read()).decode('utf-8')
+    except (BotoClientError, BotoConnectionError, ValueError) as e:
+        app.logger.error(f'Error retrieving S3 object text: bucket={bucket}, key={key}, error={e}')
+        return None
+
+
 def get_unzipped_text_reader(key):
     """Iterate over millions of rows with minimal memory consumption."""
     client = get_client()
@@ -193,12 +211,87 @@ def get_unzipped_text_reader(key):
 
 
 def get_tsv_stream(path, delimiter='\t'):
+    # Unloaded JSON feeds can run well past the csv module's default field size limit of 128KB.
+    csv.field_size_limit(sys.maxsize)
     for key in get_keys_with_prefix(path):
         data = get_unzipped_text_reader(key)
         for row in csv.DictReader(data, delimiter='\t', escapechar='\\', quotechar='"'):
             yield row
 
 
+def get_manifest_keys(manifest_key):
+    manifest = get_object_json(manifest_key)
+    if manifest is None:
+        return None
+    # Manifest entries are full S3 URLs: strip off the 's3://bucket/' part.
+    return [entry['url'].split('/', 3)[3] for entry in manifest['entries']]
+
+
+def get_merged_tsv_stream(keys, sort_key, prefetch_chunks=4, chunk_size=1000):
+    """Stream rows from gzipped TSV parts, each sorted on its own, as a single sequence ordered by sort_key.
+
+    Each part is downloaded, decompressed and parsed by a background thread, which keeps up to prefetch_chunks chunks of
+    parsed rows ready for the merge. A part found out of order raises ValueError, since merging it would silently break
+    the ordering that consumers grouping rows by key rely on.
+    """
+    csv.field_size_limit(sys.maxsize)
+    app_obj = app._get_current_object()
+    stopped = Event()
+    row_queues = [queue.Queue(maxsize=prefetch_chunks) for key in keys]
+    for key, row_queue in zip(keys, row_queues):
+        Thread(target=_prefetch_tsv_rows, args=(app_obj, key, row_queue, stopped, chunk_size), daemon=True).start()
+    try:
+        parts = [_drain_prefetched_rows(key, row_queue, sort_key) for key, row_queue in zip(keys, row_queues)]
+        for row_key, row in heapq.merge(*parts, key=itemgetter(0)):
+            yield row
+    finally:
+        # If the stream is closed early, let prefetch threads give up rather than wait on full queues.
+        stopped.set()
+
+
+def _drain_prefetched_rows(key, row_queue, sort_key):
+    # Yield rows paired with their sort keys, checking that each part is in fact sorted.
+    previous_key = None
+    while True:
+        chunk = row_queue.get()
+        if chunk is None:
+            return
+        if isinstance(chunk, Exception):
+            raise chunk
+        for row in chunk:
+            row_key = sort_key(row)
+            if previous_key is not None and row_key < previous_key:
+                raise ValueError(f'Unloaded TSV part is not sorted: key={key}, row {row_key} follows {previous_key}')
+            previous_key = row_key
+            yield row_key, row
+
+
+def _prefetch_tsv_rows(app_obj, key, row_queue, stopped, chunk_size):
+    with app_obj.app_context():
+        try:
+            data = get_unzipped_text_reader(key)
+            if data is None:
+                raise IOError(f'Failed to read unloaded TSV part: {key}')
+            reader = csv.DictReader(data, delimiter='\t', escapechar='\\', quotechar='"')
+            for chunk in iter(lambda: list(islice(reader, chunk_size)), []):
+                if not _put_unless_stopped(row_queue, chunk, stopped):
+                    return
+            _put_unless_stopped(row_queue, None, stopped)
+        except Exception as e:
+            app_obj.logger.error(f'Error prefetching TSV rows from S3: key={key}, error={e}')
+            _put_unless_stopped(row_queue, e, stopped)
+
+
+def _put_unless_stopped(row_queue, item, stopped):
+    while not stopped.is_set():
+        try:
+            row_queue.put(item, timeout=1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
 def object_exists(key):
     client = get_client()
     bucket = app.config['LOCH_S3_BUCKET']
@@ -234,6 +327,45 @@ def upload_file(file, s3_key, bucket=None):
     return upload_data(file, s3_key, bucket)
 
 
+def upload_gzip_parts(file, s3_key_prefix, part_count):
+    # Distribute lines round-robin across parts, so that parts are of similar size without a prior count of lines.
+    file.seek(0)
+    parts = [tempfile.TemporaryFile() for i in range(part_count)]
+    try:
+        writers = [GzipFile(fileobj=part, mode='wb', compresslevel=6) for part in parts]
+        line_count = 0
+        for line in file:
+            writers[line_count % part_count].write(line)
+            line_count += 1
+        for writer in writers:
+            writer.close()
+        s3_keys = []
+        for index, part in enumerate(parts[:line_count]):
+            s3_key = f'{s3_key_prefix}.part{index}.gz'
+            if not upload_file(part, s3_key):
+                return None
+            s3_keys.append(s3_key)
+        return s3_keys
+    finally:
+        for part in parts:
+            part.close()
+
+
+def upload_gzip_files(files, s3_key_prefix):
+    # Compress each file, such as those written by separate worker processes, as a part of its own.
+    s3_keys = []
+    for index, file in enumerate(files):
+        file.seek(0)
+        with tempfile.TemporaryFile() as part:
+            with GzipFile(fileobj=part, mode='wb', compresslevel=6) as writer:
+                shutil.copyfileobj(file, writer)
+            s3_key = f'{s3_key_prefix}.part{index}.gz'
+            if not upload_file(part, s3_key):
+                return None
+        s3_keys.append(s3_key)
+    return s3_keys
+
+
 def upload_json(obj, s3_key, bucket=None):
     tmpfile = tempfile.NamedTemporaryFile()
     with open(tmpfile.name, mode='wt', encoding='utf-8') as f:
@@ -284,6 +416,12 @@ def upload_from_url(url, s3_key, on_stream_opened=None):
         return upload_from_response(response, s3_key, on_stream_opened)
 
 
+def upload_manifest(s3_keys, manifest_key):
+    # A Redshift COPY manifest, listing files to be loaded by a single COPY.
+    manifest = {'entries': [{'url': build_s3_url(s3_key), 'mandatory': True} for s3_key in s3_keys]}
+    return upload_json(manifest, manifest_key)
+
+
 def upload_tsv_rows(rows, s3_key):
     data = b'\n'.join(rows)
     return upload_data(data, s3_key)
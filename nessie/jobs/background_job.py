@@ -23,6 +23,7 @@ SOFTWARE AND ACCOMPANYING DOCUMENTATION, IF ANY, PROVIDED HEREUNDER IS PROVIDED
 ENHANCEMENTS, OR MODIFICATIONS.
 """
 
+from concurrent.futures import as_completed, ThreadPoolExecutor
 import os
 import re
 from threading import Thread
@@ -33,6 +34,7 @@ from flask import current_app as app
 from nessie.externals import redshift
 from nessie.jobs.queue import get_job_queue
 from nessie.lib.berkeley import send_system_error_email
+from nessie.lib.instrumentation import query_instrumentation, submit_in_context
 from nessie.lib.metadata import create_background_job_status, most_recent_background_job_status, update_background_job_status
 from nessie.models.util import advisory_lock
 
@@ -41,20 +43,47 @@ from nessie.models.util import advisory_lock
 
 def verify_external_schema(schema, resolved_ddl, is_zero_count_acceptable=False):
     pattern = f'CREATE EXTERNAL TABLE ({schema}\.\w+)'
-    external_tables = re.findall(pattern, resolved_ddl)
-    for table in external_tables:
-        # The historical request tables are huge, rarely updated, and due to move to their own bucket:
-        # skip verification on them for now.
-        if 'historical_requests' in table:
-            continue
+    # The historical request tables are huge, rarely updated, and due to move to their own bucket:
+    # skip verification on them for now.
+    external_tables = [t for t in re.findall(pattern, resolved_ddl) if 'historical_requests' not in t]
+    return verify_external_tables(external_tables, is_zero_count_acceptable=is_zero_count_acceptable)
+
+
+def verify_external_tables(tables, is_zero_count_acceptable=False):
+    """Run COUNT(*) verification on external tables, concurrently over a bounded number of Redshift connections.
+
+    Raises BackgroundJobError as soon as any table fails to count or, unless zero counts are acceptable, counts zero rows.
+    Otherwise returns a summary of per-table row counts and query times, suitable for inclusion in a job result.
+    """
+    app_obj = app._get_current_object()
+    start = time.monotonic()
+    results = []
+    executor = ThreadPoolExecutor(max_workers=app.config['EXTERNAL_TABLE_VERIFICATION_MAX_THREADS'])
+    try:
+        futures = [submit_in_context(executor, _count_external_table, app_obj, table) for table in tables]
+        for future in as_completed(futures):
+            table, count, elapsed = future.result()
+            verified = count is not None and (is_zero_count_acceptable or count)
+            description = f'external table {table} with {count} rows (zero_count_acceptable: {is_zero_count_acceptable}).'
+            if not verified:
+                raise BackgroundJobError(f'Failed to verify {description}')
+            app.logger.info(f'Verified {description} ({elapsed:.1f}s)')
+            results.append((table, count, elapsed))
+    finally:
+        # Counts still queued after a failure are abandoned; any already running finish on their own threads.
+        executor.shutdown(wait=False, cancel_futures=True)
+    table_summaries = [f'{table} {count} rows ({elapsed:.1f}s)' for table, count, elapsed in sorted(results)]
+    summary = f"Verified {len(results)} external tables in {time.monotonic() - start:.1f}s: {', '.join(table_summaries)}."
+    app.logger.info(summary)
+    return summary
+
+
+def _count_external_table(app_obj, table):
+    with app_obj.app_context():
+        start = time.monotonic()
         result = redshift.fetch(f'SELECT COUNT(*) FROM {table}')
         count = result and result[0] and result[0]['count']
-        verified = count is not None and (is_zero_count_acceptable or count)
-        description = f'external table {table} with {count} rows (zero_count_acceptable: {is_zero_count_acceptable}).'
-        if verified:
-            app.logger.info(f'Verified {description}')
-        else:
-            raise BackgroundJobError(f'Failed to verify {description}')
+        return table, count, time.monotonic() - start
 
 
 class BackgroundJob(object):
@@ -105,17 +134,21 @@ class BackgroundJob(object):
                 if self.condemn_stalled_jobs_to_failure:
                     check_for_stalled_job(type(self).__name__)
                 create_background_job_status(self.job_id)
-            try:
-                error = None
-                result = self.run(**kwargs)
-            except BackgroundJobError as e:
-                app.logger.error(e)
-                result = None
-                error = f'{str(e)}\n\n<pre>{traceback.format_exc()}</pre>'
-            except Exception as e:
-                app.logger.exception(e)
-                result = None
-                error = f'{str(e)}\n\n<pre>{traceback.format_exc()}</pre>'
+            with query_instrumentation(job_id=self.job_id) as queries:
+                try:
+                    error = None
+                    result = self.run(**kwargs)
+                except BackgroundJobError as e:
+                    app.logger.error(e)
+                    result = None
+                    error = f'{str(e)}\n\n<pre>{traceback.format_exc()}</pre>'
+                except Exception as e:
+                    app.logger.exception(e)
+                    result = None
+                    error = f'{str(e)}\n\n<pre>{traceback.format_exc()}</pre>'
+            query_summary = queries.summary()
+            if query_summary:
+                app.logger.info(f'{type(self).__name__} {query_summary}')
             if self.status_logging_enabled:
                 if result:
                     status = 'succeeded'
@@ -137,6 +170,8 @@ class BackgroundJob(object):
                         """,
                         subject=f'Job failure: {type(self).__name__}',
                     )
+                # Query statistics follow the job's own details, so that truncation of long details drops them first.
+                details = '\n\n'.join(filter(None, [details, query_summary])) or None
                 update_background_job_status(self.job_id, status, details=details)
             return result
 
@@ -59,7 +59,7 @@ class CreateCanvasSchema(BackgroundJob):
             loch_s3_canvas_data_path_current_term=s3_canvas_data_path_current_term,
         )
         if redshift.execute_ddl_script(resolved_ddl):
-            verify_external_schema(external_schema, resolved_ddl)
-            return 'Canvas schema creation job completed.'
+            verification = verify_external_schema(external_schema, resolved_ddl)
+            return f'Canvas schema creation job completed. {verification}'
         else:
             raise BackgroundJobError('Canvas schema creation job failed.')
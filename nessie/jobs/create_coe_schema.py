@@ -24,13 +24,13 @@ ENHANCEMENTS, OR MODIFICATIONS.
 """
 
 from itertools import groupby
-import json
 import operator
 
 from flask import current_app as app
 from nessie.externals import rds, redshift, s3
 from nessie.jobs.background_job import BackgroundJob, BackgroundJobError, verify_external_schema
-from nessie.lib.util import encoded_tsv_row, get_s3_coe_daily_path, resolve_sql_template, resolve_sql_template_string
+from nessie.lib.util import encoded_tsv_row, get_s3_coe_daily_path, json_dumpb, resolve_sql_template, resolve_sql_template_string
+from nessie.models.rds_index_sync import differential_sync_enabled, sync_rds_tables
 import psycopg2
 
 
@@ -43,6 +43,13 @@ internal_schema_identifier = psycopg2.sql.Identifier(internal_schema)
 rds_schema = app.config['RDS_SCHEMA_COE']
 rds_dblink_to_redshift = app.config['REDSHIFT_DATABASE'] + '_redshift'
 
+RDS_INDEX_COLUMNS = [
+    'sid', 'advisor_ldap_uid', 'gender', 'ethnicity', 'minority',
+    'did_prep', 'prep_eligible', 'did_tprep', 'tprep_eligible',
+    'sat1read', 'sat1math', 'sat2math', 'in_met', 'grad_term', 'grad_year',
+    'probation', 'status',
+]
+
 
 class CreateCoeSchema(BackgroundJob):
 
@@ -58,17 +65,20 @@ class CreateCoeSchema(BackgroundJob):
             verify_external_schema(external_schema, resolved_ddl)
         else:
             raise BackgroundJobError('COE external schema creation failed.')
-        coe_rows = redshift.fetch(
+        coe_rows = redshift.fetch_iter(
             'SELECT * FROM {schema}.students ORDER by sid',
             schema=internal_schema_identifier,
         )
 
         profile_rows = []
+        index_rows = []
         index = 1
         for sid, rows_for_student in groupby(coe_rows, operator.itemgetter('sid')):
-            app.logger.info(f'Generating COE profile for SID {sid} ({index} of {len(coe_rows)})')
+            app.logger.info(f'Generating COE profile for SID {sid} ({index})')
             index += 1
-            row_for_student = list(rows_for_student)[0]
+            rows_for_student = list(rows_for_student)
+            index_rows.extend(tuple(r[c] for c in RDS_INDEX_COLUMNS) for r in rows_for_student)
+            row_for_student = rows_for_student[0]
             coe_profile = {
                 'advisorUid': row_for_student.get('advisor_ldap_uid'),
                 'gender': row_for_student.get('gender'),
@@ -87,7 +97,7 @@ class CreateCoeSchema(BackgroundJob):
                 'probation': row_for_student.get('probation'),
                 'status': row_for_student.get('status'),
             }
-            profile_rows.append(encoded_tsv_row([sid, json.dumps(coe_profile)]))
+            profile_rows.append(encoded_tsv_row([sid, json_dumpb(coe_profile)]))
 
         s3_key = f'{get_s3_coe_daily_path()}/coe_profiles.tsv'
         app.logger.info(f'Will stash {len(profile_rows)} feeds in S3: {s3_key}')
@@ -106,37 +116,40 @@ class CreateCoeSchema(BackgroundJob):
         if not redshift.execute(query):
             raise BackgroundJobError('Error on Redshift copy: aborting job.')
 
-        with rds.transaction() as transaction:
-            if self.refresh_rds_indexes(coe_rows, transaction):
-                transaction.commit()
-                app.logger.info('Refreshed RDS indexes.')
-            else:
-                transaction.rollback()
-                raise BackgroundJobError('Error refreshing RDS indexes.')
-
-        return 'COE internal schema created.'
-
-    def refresh_rds_indexes(self, coe_rows, transaction):
-        if len(coe_rows):
-            if not transaction.execute(f'TRUNCATE {rds_schema}.students'):
+        rds_sync_summary = None
+        if differential_sync_enabled():
+            if len(index_rows):
+                rds_sync_summary = sync_rds_tables(
+                    rds_schema,
+                    ['students', 'student_profiles'],
+                    stage_rows=lambda transaction: self.refresh_rds_indexes(index_rows, transaction, schema='pg_temp'),
+                )
+        else:
+            with rds.transaction() as transaction:
+                if self.refresh_rds_indexes(index_rows, transaction):
+                    transaction.commit()
+                    app.logger.info('Refreshed RDS indexes.')
+                else:
+                    transaction.rollback()
+                    raise BackgroundJobError('Error refreshing RDS indexes.')
+
+        return ' '.join(filter(None, ['COE internal schema created.', rds_sync_summary]))
+
+    def refresh_rds_indexes(self, index_rows, transaction, schema=rds_schema):
+        if len(index_rows):
+            if not transaction.execute(f'TRUNCATE {schema}.students'):
                 return False
-            columns = [
-                'sid', 'advisor_ldap_uid', 'gender', 'ethnicity', 'minority',
-                'did_prep', 'prep_eligible', 'did_tprep', 'tprep_eligible',
-                'sat1read', 'sat1math', 'sat2math', 'in_met', 'grad_term', 'grad_year',
-                'probation', 'status',
-            ]
             result = transaction.insert_bulk(
-                f'INSERT INTO {rds_schema}.students ({", ".join(columns)}) VALUES %s',
-                [tuple([r[c] for c in columns]) for r in coe_rows],
+                f'INSERT INTO {schema}.students ({", ".join(RDS_INDEX_COLUMNS)}) VALUES %s',
+                index_rows,
             )
             if not result:
                 return False
 
-            if not transaction.execute(f'TRUNCATE {rds_schema}.student_profiles'):
+            if not transaction.execute(f'TRUNCATE {schema}.student_profiles'):
                 return False
             result = transaction.execute(
-                f"""INSERT INTO {rds_schema}.student_profiles (
+                f"""INSERT INTO {schema}.student_profiles (
                 SELECT *
                     FROM dblink('{rds_dblink_to_redshift}',$REDSHIFT$
                         SELECT sid, profile
@@ -27,11 +27,12 @@ from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
 from datetime import datetime
 from decimal import Decimal
-from itertools import groupby, islice, repeat
-import json
+from functools import partial
+from itertools import count, groupby, islice
 from operator import itemgetter
+import os
 import pickle
-from tempfile import TemporaryFile
+from tempfile import NamedTemporaryFile, TemporaryFile
 from threading import current_thread
 
 from flask import current_app as app
@@ -40,7 +41,7 @@ from nessie.jobs.background_job import BackgroundJob, BackgroundJobError
 from nessie.lib.berkeley import career_code_to_name, current_term_id, term_info_for_sis_term_id, term_name_for_sis_id
 from nessie.lib.queries import stream_edl_degrees, stream_edl_demographics, stream_edl_holds, stream_edl_plans,\
     stream_edl_profile_terms, stream_edl_profiles, stream_edl_registrations
-from nessie.lib.util import get_s3_edl_daily_path, resolve_sql_template, write_to_tsv_file
+from nessie.lib.util import get_s3_edl_daily_path, json_dumpb, process_pool_executor, resolve_sql_template, row_type, write_to_tsv_file
 from nessie.merged.student_demographics import GENDER_CODE_MAP, merge_from_details, UNDERREPRESENTED_GROUPS
 
 """Logic for EDL SIS schema creation job."""
@@ -78,7 +79,7 @@ class CreateEdlSchema(BackgroundJob):
 
     def generate_degree_progress_feeds(self):
         app.logger.info('Staging degree progress feeds...')
-        rows = redshift.fetch(f'SELECT * FROM {self.internal_schema}.student_degree_progress_index ORDER by sid')
+        rows = redshift.fetch_iter(f'SELECT * FROM {self.internal_schema}.student_degree_progress_index ORDER by sid')
         with TemporaryFile() as feeds:
             for sid, rows_for_student in groupby(rows, itemgetter('sid')):
                 rows_for_student = list(rows_for_student)
@@ -91,38 +92,90 @@ class CreateEdlSchema(BackgroundJob):
                         } for row in rows_for_student
                     },
                 }
-                write_to_tsv_file(feeds, [sid, json.dumps(feed)])
+                write_to_tsv_file(feeds, [sid, json_dumpb(feed)])
             _upload_file_to_staging('student_degree_progress', feeds)
 
 
 class ConcurrentFeedBuilder(object):
 
+    batch_format = app.config['EDL_SCHEMA_BATCH_FORMAT']
     batch_size = app.config['EDL_SCHEMA_BATCH_SIZE']
+    executor_type = app.config['EDL_SCHEMA_EXECUTOR']
+    max_processes = app.config['EDL_SCHEMA_MAX_PROCESSES']
     max_threads = app.config['EDL_SCHEMA_MAX_THREADS']
+    max_upload_threads = app.config['EDL_SCHEMA_MAX_UPLOAD_THREADS']
 
     # Subclasses implement.
     filename = None
 
+    # Set in worker processes, whose target files must be reopened by name in the parent process.
+    named_target_files = False
+
     def build(self):
-        source_files = []
-        with self.fetch_source_feeds() as source_feed_generator:
-            while True:
-                results = False
-                source_file = TemporaryFile()
-                for source_feed in islice(source_feed_generator, self.batch_size):
-                    pickle.dump(source_feed, source_file)
-                    results = True
-                if not results:
-                    break
-                source_files.append(source_file)
-
-        target_files = []
-        with ThreadPoolExecutor(max_workers=self.max_threads) as executor:
-            app_obj = app._get_current_object()
-            for result in executor.map(self.build_target_feeds, repeat(app_obj), source_files):
-                _upload_file_to_staging(self.filename, result)
-                target_files.append(result)
-        app.logger.info(f'Uploaded {len(target_files)} TSV batches to Redshift table {self.filename})')
+        app_obj = app._get_current_object()
+        batch_prefix = f"staging_{self.filename}_{datetime.utcnow().strftime('%H%M%s')}"
+        upload_futures = []
+        # Each batch is handed to a worker as soon as it is read from the source stream, and uploaded to S3 as soon as its
+        # target feeds are built. A single manifest COPY then loads all batches into Redshift.
+        with ThreadPoolExecutor(max_workers=self.max_upload_threads) as uploader:
+            def _upload_when_built(build_future, tsv_filename):
+                upload_futures.append(uploader.submit(self.upload_target_feeds, app_obj, build_future, tsv_filename))
+
+            with self.worker_pool() as executor, self.fetch_source_feeds() as source_feed_generator:
+                for batch_index in count():
+                    build_future = self.submit_batch(executor, app_obj, islice(source_feed_generator, self.batch_size))
+                    if not build_future:
+                        break
+                    build_future.add_done_callback(partial(_upload_when_built, tsv_filename=f'{batch_prefix}_{batch_index}.tsv'))
+        s3_keys = [s3_key for upload_future in upload_futures for s3_key in upload_future.result()]
+        if s3_keys:
+            _copy_s3_files_to_staging(self.filename, s3_keys, f'{batch_prefix}.manifest')
+        app.logger.info(f'Uploaded {len(upload_futures)} TSV batches to Redshift table {self.filename})')
+
+    def worker_pool(self):
+        if self.executor_type == 'process':
+            return process_pool_executor(self.max_processes)
+        else:
+            return ThreadPoolExecutor(max_workers=self.max_threads)
+
+    def submit_batch(self, executor, app_obj, source_feeds):
+        # Batches are passed to worker processes by file name, since file objects cannot be pickled.
+        source_file = NamedTemporaryFile() if self.executor_type == 'process' else TemporaryFile()
+        if not self.write_source_feeds(source_feeds, source_file):
+            source_file.close()
+            return None
+        if self.executor_type == 'process':
+            source_file.flush()
+            # Submit work through a fresh instance, so that no state on this one is pickled.
+            build_future = executor.submit(type(self)().build_target_feeds_in_process, source_file.name)
+        else:
+            build_future = executor.submit(self.build_target_feeds, app_obj, source_file)
+        build_future.add_done_callback(lambda f: source_file.close())
+        return build_future
+
+    def build_target_feeds_in_process(self, source_path):
+        # Runs in a worker process, inside the copy of the app context set up by process_pool_executor.
+        self.named_target_files = True
+        with open(source_path, 'rb') as source_file:
+            target_file = self.build_target_feeds(app._get_current_object(), source_file)
+        target_file.close()
+        return target_file.name
+
+    def upload_target_feeds(self, app_obj, build_future, tsv_filename):
+        with app_obj.app_context():
+            target = build_future.result()
+            if self.executor_type == 'process':
+                try:
+                    with open(target, 'rb') as target_file:
+                        return _upload_file_to_s3(self.filename, target_file, tsv_filename)
+                finally:
+                    os.remove(target)
+            else:
+                with target:
+                    return _upload_file_to_s3(self.filename, target, tsv_filename)
+
+    def open_target_file(self):
+        return NamedTemporaryFile(delete=False) if self.named_target_files else TemporaryFile()
 
     # Subclasses implement.
     @contextmanager
@@ -133,18 +186,85 @@ class ConcurrentFeedBuilder(object):
     def build_target_feeds(self, app_arg, source_file):
         pass
 
+    def write_source_feeds(self, source_feeds, f):
+        if self.batch_format == 'columnar':
+            return write_columnar_batch(source_feeds, f)
+        results = False
+        for source_feed in source_feeds:
+            pickle.dump(source_feed, f)
+            results = True
+        return results
+
+    def get_source_feeds(self, f):
+        if self.batch_format == 'columnar':
+            feeds = read_columnar_batch(f)
+        else:
+            feeds = self.get_pickled_feeds(f)
+        for index, (sid, feed) in enumerate(feeds):
+            yield [sid, feed, index]
+
     def get_pickled_feeds(self, f):
         f.seek(0)
-        index = 0
         while True:
             try:
                 feed = pickle.load(f)
-                yield [feed['sid'], feed['feed'], index]
-                index += 1
+                yield feed['sid'], feed['feed']
             except EOFError:
                 break
 
 
+# In a columnar batch, each source feed is pickled as a (sid, rows) pair, where rows is a list of row tuples or, for feeds
+# combining several result sets, a dict of lists of row tuples. The column names for each result set are pickled once per
+# batch, in a (component, columns, None) header record preceding the first feed that uses them.
+
+
+def write_columnar_batch(source_feeds, f):
+    columns = {}
+
+    def _encode(component, rows):
+        if not rows:
+            return rows
+        if component not in columns:
+            columns[component] = tuple(rows[0].keys())
+            pickle.dump((component, columns[component], None), f, protocol=pickle.HIGHEST_PROTOCOL)
+        return [tuple(row.values()) for row in rows]
+
+    results = False
+    for source_feed in source_feeds:
+        feed = source_feed['feed']
+        if isinstance(feed, dict):
+            encoded = {component: _encode(component, rows) for component, rows in feed.items()}
+        else:
+            encoded = _encode(None, feed)
+        pickle.dump((source_feed['sid'], encoded), f, protocol=pickle.HIGHEST_PROTOCOL)
+        results = True
+    return results
+
+
+def read_columnar_batch(f):
+    row_types = {}
+
+    def _decode(component, rows):
+        component_row_type = row_types.get(component)
+        return [component_row_type(row) for row in rows] if rows else rows
+
+    f.seek(0)
+    while True:
+        try:
+            record = pickle.load(f)
+        except EOFError:
+            break
+        if len(record) == 3:
+            component, columns, _ = record
+            row_types[component] = row_type(columns)
+            continue
+        sid, encoded = record
+        if isinstance(encoded, dict):
+            yield sid, {component: _decode(component, rows) for component, rows in encoded.items()}
+        else:
+            yield sid, _decode(None, encoded)
+
+
 class DemographicsFeedBuilder(ConcurrentFeedBuilder):
 
     filename = 'student_demographics'
@@ -164,10 +284,10 @@ class DemographicsFeedBuilder(ConcurrentFeedBuilder):
     def build_target_feeds(self, app_arg, source_file):
         with app_arg.app_context():
             app_arg.logger.debug(f'{current_thread().name} will process demographics feeds chunk')
-            target_file = TemporaryFile()
+            target_file = self.open_target_file()
             index = None
 
-            for sid, rows, index in self.get_pickled_feeds(source_file):
+            for sid, rows, index in self.get_source_feeds(source_file):
                 gender = None
                 visa = None
                 nationalities = set()
@@ -189,7 +309,7 @@ class DemographicsFeedBuilder(ConcurrentFeedBuilder):
                     'underrepresented': not UNDERREPRESENTED_GROUPS.isdisjoint(ethnic_map.keys()),
                     'visa': visa,
                 }
-                write_to_tsv_file(target_file, [sid, json.dumps(feed)])
+                write_to_tsv_file(target_file, [sid, json_dumpb(feed)])
 
             if index is None:
                 app_arg.logger.warn(f'{current_thread().name} wrote no demographics feeds, returning empty tempfile')
@@ -256,10 +376,10 @@ class ProfileFeedBuilder(ConcurrentFeedBuilder):
     def build_target_feeds(self, app_arg, source_file):
         with app_arg.app_context():
             app_arg.logger.debug(f'{current_thread().name} will process profile feeds chunk')
-            target_file = TemporaryFile()
+            target_file = self.open_target_file()
             index = None
 
-            for sid, feed_components, index in self.get_pickled_feeds(source_file):
+            for sid, feed_components, index in self.get_source_feeds(source_file):
                 # We may see results from multiple academic careers. We prefer the UGRD or GRAD career with the most recent entering term,
                 # falling back to UCBX if no UGRD or GRAD is available.
                 plans = feed_components.get('plans', [])
@@ -292,7 +412,7 @@ class ProfileFeedBuilder(ConcurrentFeedBuilder):
                 self._merge_plans(feed, plans, career_code)
                 self._merge_degrees(feed, feed_components.get('degrees'))
 
-                write_to_tsv_file(target_file, [sid, json.dumps(feed)])
+                write_to_tsv_file(target_file, [sid, json_dumpb(feed)])
 
             if index is None:
                 app_arg.logger.warn(f'{current_thread().name} wrote no profile feeds, returning empty tempfile')
@@ -612,14 +732,14 @@ class RegistrationsFeedBuilder(ConcurrentFeedBuilder):
     def build_target_feeds(self, app_arg, source_file):
         with app_arg.app_context():
             app_arg.logger.debug(f'{current_thread().name} will process registration feeds chunk')
-            target_file = TemporaryFile()
+            target_file = self.open_target_file()
             index = None
 
-            for sid, rows, index in self.get_pickled_feeds(source_file):
+            for sid, rows, index in self.get_source_feeds(source_file):
                 last_registration = self._find_last_registration(rows)
                 if last_registration:
                     feed = self._generate_feed(last_registration)
-                    write_to_tsv_file(target_file, [sid, json.dumps(feed)])
+                    write_to_tsv_file(target_file, [sid, json_dumpb(feed)])
 
             if index is None:
                 app_arg.logger.warn(f'{current_thread().name} wrote no registration feeds, returning empty tempfile')
@@ -765,12 +885,30 @@ def _str(v):
 
 def _upload_file_to_staging(table, _file):
     tsv_filename = f"staging_{table}_{datetime.utcnow().strftime('%H%M%s')}.tsv"
+    s3_keys = _upload_file_to_s3(table, _file, tsv_filename)
+    _copy_s3_files_to_staging(table, s3_keys, f'{tsv_filename}.manifest')
+
+
+def _upload_file_to_s3(table, _file, tsv_filename):
     s3_key = f'{get_s3_edl_daily_path()}/{tsv_filename}'
+    part_count = app.config['REDSHIFT_COPY_GZIP_PARTS']
+    if part_count:
+        app.logger.info(f'Will stash {table} feeds in S3 as {part_count} gzipped parts: {s3_key}')
+        s3_keys = s3.upload_gzip_parts(_file, s3_key, part_count)
+    else:
+        app.logger.info(f'Will stash {table} feeds in S3: {s3_key}')
+        s3_keys = [s3_key] if s3.upload_file(_file, s3_key) else None
+    if s3_keys is None:
+        raise BackgroundJobError('Error on S3 upload: aborting job.')
+    return s3_keys
+
 
-    app.logger.info(f'Will stash {table} feeds in S3: {s3_key}')
-    if not s3.upload_file(_file, s3_key):
+def _copy_s3_files_to_staging(table, s3_keys, manifest_filename):
+    manifest_key = f'{get_s3_edl_daily_path()}/{manifest_filename}'
+    if not s3.upload_manifest(s3_keys, manifest_key):
         raise BackgroundJobError('Error on S3 upload: aborting job.')
 
-    app.logger.info('Will copy S3 feeds into Redshift...')
-    if not redshift.copy_tsv_from_s3(f"{app.config['REDSHIFT_SCHEMA_EDL']}.{table}", s3_key):
+    app.logger.info(f'Will copy {len(s3_keys)} S3 feed files into Redshift...')
+    gzip = bool(app.config['REDSHIFT_COPY_GZIP_PARTS'])
+    if not redshift.copy_tsv_from_s3_manifest(f"{app.config['REDSHIFT_SCHEMA_EDL']}.{table}", manifest_key, gzip=gzip):
         raise BackgroundJobError('Error on Redshift copy: aborting job.')
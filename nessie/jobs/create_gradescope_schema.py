@@ -42,7 +42,7 @@ class CreateGradescopeSchema(BackgroundJob):
         redshift.drop_external_schema(external_schema)
         resolved_ddl = resolve_sql_template('create_gradescope_schema_template.sql')
         if redshift.execute_ddl_script(resolved_ddl):
-            verify_external_schema(external_schema, resolved_ddl)
-            return 'Gradescope schema creation job completed.'
+            verification = verify_external_schema(external_schema, resolved_ddl)
+            return f'Gradescope schema creation job completed. {verification}'
         else:
             raise BackgroundJobError('Gradescope schema creation job failed.')
@@ -56,10 +56,10 @@ class CreateOUASchema(BackgroundJob):
             redshift.drop_external_schema(external_schema)
             resolved_ddl = resolve_sql_template('create_oua_schema_template.sql')
             if redshift.execute_ddl_script(resolved_ddl):
-                verify_external_schema(external_schema, resolved_ddl)
+                verification = verify_external_schema(external_schema, resolved_ddl)
                 self.create_rds_tables_and_indexes()
                 app.logger.info('OUA Slate RDS indexes created.')
-                return 'OUA schema creation job completed.'
+                return f'OUA schema creation job completed. {verification}'
 
             else:
                 raise BackgroundJobError('OUA Slate schema creation job failed.')
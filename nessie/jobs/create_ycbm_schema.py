@@ -42,7 +42,7 @@ class CreateYcbmSchema(BackgroundJob):
         resolved_ddl = resolve_sql_template('create_ycbm_schema.template.sql')
 
         if redshift.execute_ddl_script(resolved_ddl):
-            verify_external_schema(external_schema, resolved_ddl)
-            return 'YCBM schema creation job completed.'
+            verification = verify_external_schema(external_schema, resolved_ddl)
+            return f'YCBM schema creation job completed. {verification}'
         else:
             raise BackgroundJobError('YCBM schema creation job failed.')
@@ -25,13 +25,13 @@ ENHANCEMENTS, OR MODIFICATIONS.
 
 from functools import reduce
 from itertools import groupby
-import json
 import operator
 
 from flask import current_app as app
 from nessie.externals import rds, redshift, s3
 from nessie.jobs.background_job import BackgroundJob, BackgroundJobError
-from nessie.lib.util import encoded_tsv_row, get_s3_asc_daily_path, resolve_sql_template_string
+from nessie.lib.util import encoded_tsv_row, get_s3_asc_daily_path, json_dumpb, resolve_sql_template_string
+from nessie.models.rds_index_sync import differential_sync_enabled, sync_rds_tables
 import psycopg2
 
 """Logic for ASC profile generation job."""
@@ -42,21 +42,25 @@ asc_schema_identifier = psycopg2.sql.Identifier(asc_schema)
 rds_schema = app.config['RDS_SCHEMA_ASC']
 rds_dblink_to_redshift = app.config['REDSHIFT_DATABASE'] + '_redshift'
 
+RDS_INDEX_COLUMNS = ['sid', 'active', 'intensive', 'status_asc', 'group_code', 'group_name', 'team_code', 'team_name']
+
 
 class GenerateAscProfiles(BackgroundJob):
 
     def run(self):
         app.logger.info('Starting ASC profile generation job...')
-        asc_rows = redshift.fetch(
+        asc_rows = redshift.fetch_iter(
             'SELECT * FROM {schema}.students ORDER by sid, UPPER(team_name)',
             schema=asc_schema_identifier,
         )
 
         profile_rows = []
+        index_rows = []
         sids_for_inactive_deletion = []
 
         for sid, rows_for_student in groupby(asc_rows, operator.itemgetter('sid')):
             rows_for_student = list(rows_for_student)
+            index_rows.extend(tuple(r[c] for c in RDS_INDEX_COLUMNS) for r in rows_for_student)
             # Since BOAC believes (falsely) that isActiveAsc and statusAsc are attributes of a student, not
             # a team membership, a bit of brutal simplification is needed. Students who are active in at least
             # one sport have inactive team memberships dropped.
@@ -79,7 +83,7 @@ class GenerateAscProfiles(BackgroundJob):
                     'teamName': row['team_name'],
                 })
 
-            profile_rows.append(encoded_tsv_row([sid, json.dumps(athletics_profile)]))
+            profile_rows.append(encoded_tsv_row([sid, json_dumpb(athletics_profile)]))
 
         s3_key = f'{get_s3_asc_daily_path()}/athletics_profiles.tsv'
         app.logger.info(f'Will stash {len(profile_rows)} feeds in S3: {s3_key}')
@@ -100,13 +104,22 @@ class GenerateAscProfiles(BackgroundJob):
             app.logger.error('Error on Redshift copy: aborting job.')
             return False
 
-        with rds.transaction() as transaction:
-            if self.refresh_rds_indexes(asc_rows, transaction):
-                transaction.commit()
-                app.logger.info('Refreshed RDS indexes.')
-            else:
-                transaction.rollback()
-                raise BackgroundJobError('Error refreshing RDS indexes.')
+        rds_sync_summary = None
+        if differential_sync_enabled():
+            if len(index_rows):
+                rds_sync_summary = sync_rds_tables(
+                    rds_schema,
+                    ['students', 'student_profiles'],
+                    stage_rows=lambda transaction: self.refresh_rds_indexes(index_rows, transaction, schema='pg_temp'),
+                )
+        else:
+            with rds.transaction() as transaction:
+                if self.refresh_rds_indexes(index_rows, transaction):
+                    transaction.commit()
+                    app.logger.info('Refreshed RDS indexes.')
+                else:
+                    transaction.rollback()
+                    raise BackgroundJobError('Error refreshing RDS indexes.')
 
         if sids_for_inactive_deletion:
             redshift.execute(
@@ -118,24 +131,23 @@ class GenerateAscProfiles(BackgroundJob):
                 params=(sids_for_inactive_deletion,),
             )
 
-        return 'ASC profile generation complete.'
+        return ' '.join(filter(None, ['ASC profile generation complete.', rds_sync_summary]))
 
-    def refresh_rds_indexes(self, asc_rows, transaction):
-        if len(asc_rows):
-            if not transaction.execute(f'TRUNCATE {rds_schema}.students'):
+    def refresh_rds_indexes(self, index_rows, transaction, schema=rds_schema):
+        if len(index_rows):
+            if not transaction.execute(f'TRUNCATE {schema}.students'):
                 return False
-            columns = ['sid', 'active', 'intensive', 'status_asc', 'group_code', 'group_name', 'team_code', 'team_name']
             result = transaction.insert_bulk(
-                f'INSERT INTO {rds_schema}.students ({", ".join(columns)}) VALUES %s',
-                [tuple([r[c] for c in columns]) for r in asc_rows],
+                f'INSERT INTO {schema}.students ({", ".join(RDS_INDEX_COLUMNS)}) VALUES %s',
+                index_rows,
             )
             if not result:
                 return False
 
-            if not transaction.execute(f'TRUNCATE {rds_schema}.student_profiles'):
+            if not transaction.execute(f'TRUNCATE {schema}.student_profiles'):
                 return False
             result = transaction.execute(
-                f"""INSERT INTO {rds_schema}.student_profiles (
+                f"""INSERT INTO {schema}.student_profiles (
                 SELECT *
                     FROM dblink('{rds_dblink_to_redshift}',$REDSHIFT$
                         SELECT sid, profile
@@ -23,23 +23,27 @@ SOFTWARE AND ACCOMPANYING DOCUMENTATION, IF ANY, PROVIDED HEREUNDER IS PROVIDED
 ENHANCEMENTS, OR MODIFICATIONS.
 """
 
+from concurrent.futures import FIRST_COMPLETED, wait
 from itertools import groupby
+import os
 import tempfile
 
 from flask import current_app as app
 from nessie.externals import rds, redshift
 from nessie.jobs.background_job import BackgroundJob, BackgroundJobError
 from nessie.lib import queries
-from nessie.lib.analytics import generate_analytics_feeds_for_course
+from nessie.lib.analytics import course_site_fingerprint, generate_analytics_feeds_for_course
 from nessie.lib.berkeley import reverse_term_ids
-from nessie.lib.util import hashed_datestamp, resolve_sql_template
-from nessie.models.student_schema_manager import refresh_from_staging, truncate_staging_table, write_file_to_staging
+from nessie.lib.metadata import get_canvas_analytics_fingerprints, update_canvas_analytics_fingerprints
+from nessie.lib.util import hashed_datestamp, process_pool_executor, resolve_sql_template, write_to_tsv_file
+from nessie.models.student_schema_manager import refresh_from_staging, truncate_staging_table, write_file_to_staging, write_files_to_staging
 
 """Logic for BOAC analytics job."""
 
 
 class GenerateBoacAnalytics(BackgroundJob):
     s3_boa_path = f"s3://{app.config['LOCH_S3_BUCKET']}/" + app.config['LOCH_S3_BOAC_ANALYTICS_DATA_PATH']
+    refreshed_course_ids_table = 'student_canvas_site_refreshed_courses'
 
     def run(self, term_id=None):
         app.logger.info('Starting BOAC analytics job...')
@@ -65,58 +69,176 @@ class GenerateBoacAnalytics(BackgroundJob):
             term_id = all_canvas_terms[0]
         self.generate_analytics_feeds(term_id)
 
-        return 'BOAC analytics creation job completed.'
+        result = 'BOAC analytics creation job completed'
+        if app.config['BOAC_ANALYTICS_INCREMENTAL']:
+            result += (
+                f' ({len(self.course_fingerprints)} course sites changed, {self.skipped_count} unchanged,'
+                f' {len(self.deleted_course_ids)} deleted)'
+            )
+        return result + '.'
 
     def generate_analytics_feeds(self, term_id):
+        self.course_fingerprints = {}
+        self.skipped_count = 0
+        self.deleted_course_ids = []
+        max_processes = app.config['BOAC_ANALYTICS_MAX_PROCESSES']
+        if max_processes > 1:
+            return self.generate_parallel_analytics_feeds(term_id, max_processes)
+
         with tempfile.TemporaryFile() as output_file:
+            membership_count = 0
+            for canvas_site_row, site_enrollments_stream, site_submissions_stream in self.course_sites_to_generate(term_id):
+                app.logger.info(f"Generating analytics: course site {canvas_site_row['canvas_course_id']}")
+                membership_count += generate_analytics_feeds_for_course(
+                    output_file,
+                    term_id,
+                    canvas_site_row,
+                    site_enrollments_stream,
+                    site_submissions_stream,
+                )
+            self.stage_analytics_feeds(term_id, write_file_to_staging, output_file, membership_count)
+
+    def generate_parallel_analytics_feeds(self, term_id, max_processes):
+        batch_rows = app.config['BOAC_ANALYTICS_BATCH_ROWS']
+        app.logger.info(f'Generating analytics for term {term_id} across {max_processes} worker processes.')
+        membership_count = 0
+        part_paths = set()
+        with tempfile.TemporaryDirectory() as parts_dir:
+            # Course sites are read from the merged streams here and handed to workers in batches. To bound memory, no more
+            # than two batches per worker are outstanding at a time.
+            with process_pool_executor(max_processes) as executor:
+                # Submit work through a fresh instance, so that state accumulated on this one is not pickled.
+                analytics_worker = type(self)()
+                running = set()
+                batch = []
+                batch_row_count = 0
+
+                def _collect(futures):
+                    count = 0
+                    for future in futures:
+                        part_path, part_count = future.result()
+                        part_paths.add(part_path)
+                        count += part_count
+                    return count
+
+                for canvas_site_row, site_enrollments_stream, site_submissions_stream in self.course_sites_to_generate(term_id):
+                    course_site = (canvas_site_row, list(site_enrollments_stream), list(site_submissions_stream))
+                    batch.append(course_site)
+                    batch_row_count += len(course_site[1]) + len(course_site[2])
+                    if batch_row_count >= batch_rows:
+                        if len(running) >= 2 * max_processes:
+                            done, running = wait(running, return_when=FIRST_COMPLETED)
+                            membership_count += _collect(done)
+                        running.add(executor.submit(analytics_worker.write_analytics_feeds, parts_dir, term_id, batch))
+                        batch = []
+                        batch_row_count = 0
+                if batch:
+                    running.add(executor.submit(analytics_worker.write_analytics_feeds, parts_dir, term_id, batch))
+                membership_count += _collect(wait(running).done)
+
+            part_files = [open(part_path, 'rb') for part_path in sorted(part_paths)]
             try:
-                canvas_sites_stream = queries.stream_canvas_sites(term_id)
-                canvas_enrollments_stream = queries.stream_canvas_enrollments(term_id)
-                assignment_submissions_stream = queries.stream_canvas_assignment_submissions(term_id)
-
-                enrollments_by_course_id = groupby(canvas_enrollments_stream, lambda r: int(r['canvas_course_id']))
-                submissions_by_course_id = groupby(assignment_submissions_stream, lambda r: int(r['canvas_course_id']))
-                enr_tracker = {'course_id': 0, 'stream': []}
-                sub_tracker = {'course_id': 0, 'stream': []}
-
-                membership_count = 0
-
-                for canvas_site_row in canvas_sites_stream:
-                    course_site_id = int(canvas_site_row['canvas_course_id'])
-                    app.logger.info(f'Generating analytics: course site {course_site_id}')
-
-                    while enr_tracker['course_id'] < course_site_id:
-                        enr_tracker['course_id'], enr_tracker['stream'] = next(enrollments_by_course_id, (course_site_id, []))
-                    if enr_tracker['course_id'] == course_site_id:
-                        site_enrollments_stream = enr_tracker['stream']
-                    else:
-                        site_enrollments_stream = []
-
-                    while sub_tracker['course_id'] < course_site_id:
-                        sub_tracker['course_id'], sub_tracker['stream'] = next(submissions_by_course_id, (course_site_id, []))
-                    if sub_tracker['course_id'] == course_site_id:
-                        site_submissions_stream = sub_tracker['stream']
-                    else:
-                        site_submissions_stream = []
-
-                    membership_count += generate_analytics_feeds_for_course(
-                        output_file,
-                        term_id,
-                        canvas_site_row,
-                        site_enrollments_stream,
-                        site_submissions_stream,
-                    )
-
+                self.stage_analytics_feeds(term_id, write_files_to_staging, part_files, membership_count)
             finally:
-                canvas_sites_stream.close()
-                canvas_enrollments_stream.close()
-                assignment_submissions_stream.close()
-
-            table_name = 'student_canvas_site_memberships'
+                for part_file in part_files:
+                    part_file.close()
+
+    def write_analytics_feeds(self, parts_dir, term_id, course_sites):
+        # Runs in a worker process, appending feeds for a batch of course sites to a part file of its own.
+        part_path = os.path.join(parts_dir, f'part-{os.getpid()}.tsv')
+        membership_count = 0
+        with open(part_path, 'ab') as part_file:
+            for canvas_site_row, site_enrollments, site_submissions in course_sites:
+                app.logger.info(f"Generating analytics: course site {canvas_site_row['canvas_course_id']}")
+                membership_count += generate_analytics_feeds_for_course(part_file, term_id, canvas_site_row, site_enrollments, site_submissions)
+        return part_path, membership_count
+
+    def course_sites_to_generate(self, term_id):
+        course_sites = self.stream_course_sites(term_id)
+        if app.config['BOAC_ANALYTICS_INCREMENTAL']:
+            course_sites = self.filter_changed_course_sites(term_id, course_sites)
+        return course_sites
+
+    def filter_changed_course_sites(self, term_id, course_sites):
+        previous_fingerprints = get_canvas_analytics_fingerprints(term_id)
+        for canvas_site_row, site_enrollments_stream, site_submissions_stream in course_sites:
+            canvas_course_id = str(int(canvas_site_row['canvas_course_id']))
+            site_enrollments = list(site_enrollments_stream)
+            site_submissions = list(site_submissions_stream)
+            fingerprint = course_site_fingerprint(canvas_site_row, site_enrollments, site_submissions)
+            if previous_fingerprints.pop(canvas_course_id, None) == fingerprint:
+                self.skipped_count += 1
+            else:
+                self.course_fingerprints[canvas_course_id] = fingerprint
+                yield canvas_site_row, site_enrollments, site_submissions
+        # Any course sites left over have dropped out of the term since the previous run.
+        self.deleted_course_ids = list(previous_fingerprints.keys())
+        app.logger.info(
+            f'{len(self.course_fingerprints)} course sites changed, {self.skipped_count} unchanged, {len(self.deleted_course_ids)} deleted.',
+        )
 
-            with redshift.transaction() as transaction:
-                truncate_staging_table(table_name)
-                write_file_to_staging(table_name, output_file, membership_count, term_id)
+    def stream_course_sites(self, term_id):
+        # Yield each course site of the term with its own enrollments and submissions, merged from three sorted streams.
+        canvas_sites_stream = queries.stream_canvas_sites(term_id)
+        canvas_enrollments_stream = queries.stream_canvas_enrollments(term_id)
+        assignment_submissions_stream = queries.stream_canvas_assignment_submissions(term_id)
+        try:
+            enrollments_by_course_id = groupby(canvas_enrollments_stream, lambda r: int(r['canvas_course_id']))
+            submissions_by_course_id = groupby(assignment_submissions_stream, lambda r: int(r['canvas_course_id']))
+            enr_tracker = {'course_id': 0, 'stream': []}
+            sub_tracker = {'course_id': 0, 'stream': []}
+
+            for canvas_site_row in canvas_sites_stream:
+                course_site_id = int(canvas_site_row['canvas_course_id'])
+
+                while enr_tracker['course_id'] < course_site_id:
+                    enr_tracker['course_id'], enr_tracker['stream'] = next(enrollments_by_course_id, (course_site_id, []))
+                if enr_tracker['course_id'] == course_site_id:
+                    site_enrollments_stream = enr_tracker['stream']
+                else:
+                    site_enrollments_stream = []
+
+                while sub_tracker['course_id'] < course_site_id:
+                    sub_tracker['course_id'], sub_tracker['stream'] = next(submissions_by_course_id, (course_site_id, []))
+                if sub_tracker['course_id'] == course_site_id:
+                    site_submissions_stream = sub_tracker['stream']
+                else:
+                    site_submissions_stream = []
+
+                yield canvas_site_row, site_enrollments_stream, site_submissions_stream
+
+        finally:
+            canvas_sites_stream.close()
+            canvas_enrollments_stream.close()
+            assignment_submissions_stream.close()
+
+    def stage_analytics_feeds(self, term_id, write_to_staging, feed_files, membership_count):
+        table_name = 'student_canvas_site_memberships'
+        incremental = app.config['BOAC_ANALYTICS_INCREMENTAL']
+        if incremental:
+            refreshed_course_ids = list(self.course_fingerprints.keys()) + self.deleted_course_ids
+            if not refreshed_course_ids:
+                app.logger.info('No course sites changed; nothing to refresh.')
+                return
+
+        with redshift.transaction() as transaction:
+            truncate_staging_table(table_name)
+            # An incremental run may legitimately generate no feeds, if the only changes are deleted course sites.
+            if membership_count or not incremental:
+                write_to_staging(table_name, feed_files, membership_count, term_id)
+            if incremental:
+                self.stage_refreshed_course_ids(refreshed_course_ids)
+                refresh_from_staging(table_name, term_id, transaction, course_ids_table=self.refreshed_course_ids_table)
+            else:
                 refresh_from_staging(table_name, term_id, transaction)
-                if not transaction.commit():
-                    raise BackgroundJobError(f'Final transaction commit failed on site membership refresh (term_id={term_id}).')
+            if not transaction.commit():
+                raise BackgroundJobError(f'Final transaction commit failed on site membership refresh (term_id={term_id}).')
+        if incremental:
+            update_canvas_analytics_fingerprints(term_id, self.course_fingerprints, self.deleted_course_ids)
+
+    def stage_refreshed_course_ids(self, refreshed_course_ids):
+        truncate_staging_table(self.refreshed_course_ids_table)
+        with tempfile.TemporaryFile() as course_ids_file:
+            for canvas_course_id in refreshed_course_ids:
+                write_to_tsv_file(course_ids_file, [canvas_course_id])
+            write_file_to_staging(self.refreshed_course_ids_table, course_ids_file, len(refreshed_course_ids))
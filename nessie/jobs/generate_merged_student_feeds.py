@@ -23,24 +23,35 @@ SOFTWARE AND ACCOMPANYING DOCUMENTATION, IF ANY, PROVIDED HEREUNDER IS PROVIDED
 ENHANCEMENTS, OR MODIFICATIONS.
 """
 
+from collections import deque
+from concurrent.futures import as_completed
 from contextlib import ExitStack
-from itertools import groupby
+import hashlib
+from itertools import groupby, islice
 import json
 import operator
+import os
+import shutil
 import tempfile
 
 from flask import current_app as app
 from nessie.externals import rds, redshift
 from nessie.jobs.background_job import BackgroundJob, BackgroundJobError
 from nessie.lib import berkeley, queries
-from nessie.lib.util import encoded_tsv_row, resolve_sql_template, to_boolean, write_to_tsv_file
+from nessie.lib.metadata import get_merged_profile_digests, update_merged_profile_digests
+from nessie.lib.util import encoded_tsv_row, json_dumpb, process_pool_executor, resolve_sql_template, to_boolean, write_to_tsv_file
 from nessie.merged.sis_profile import parse_merged_sis_profile
 from nessie.merged.student_demographics import add_demographics_rows
 from nessie.merged.student_terms import append_drops, append_term_gpa, empty_term_feed, merge_canvas_site_memberships, merge_enrollment
+from nessie.models.rds_index_sync import differential_sync_enabled, strip_transaction_control, sync_rds_tables
 from nessie.models.student_schema_manager import refresh_all_from_staging, truncate_staging_table, write_file_to_staging
 
 """Logic for merged student profile and term generation."""
 
+# Folded into every merged profile digest. Bump it whenever profile feed logic changes, so that an incremental run
+# regenerates profiles whose source rows have not changed.
+MERGED_PROFILE_DIGEST_VERSION = 1
+
 
 class GenerateMergedStudentFeeds(BackgroundJob):
 
@@ -48,6 +59,12 @@ class GenerateMergedStudentFeeds(BackgroundJob):
     rds_dblink_to_redshift = app.config['REDSHIFT_DATABASE'] + '_redshift'
     student_schema = queries.student_schema()
     redshift_edl_schema = queries.edl_external_schema()
+    refreshed_sids_table = 'student_profile_refreshed_sids'
+    # RDS tables refreshed by the update_rds_indexes_student_profiles template.
+    rds_profile_index_tables = [
+        'student_profiles', 'student_profile_index', 'academic_standing', 'demographics', 'ethnicities', 'intended_majors',
+        'minors', 'student_academic_programs', 'student_degrees', 'student_holds', 'student_majors', 'student_names', 'visas',
+    ]
 
     def run(self):
         app.logger.info('Starting merged profile generation job.')
@@ -66,18 +83,33 @@ class GenerateMergedStudentFeeds(BackgroundJob):
     def generate_feeds(self):
         self.successes = []
         self.failures = []
+        incremental = app.config['MERGED_PROFILE_INCREMENTAL']
 
-        all_student_profile_elements = queries.get_all_student_profile_elements()
-        profile_tables = self.generate_student_profile_tables(all_student_profile_elements)
+        all_student_profile_elements = queries.stream_all_student_profile_elements()
+        try:
+            profile_tables = self.generate_student_profile_tables(all_student_profile_elements)
+        finally:
+            # The stream is None if the unload failed, in which case no profile tables were generated.
+            if all_student_profile_elements is not None:
+                all_student_profile_elements.close()
         if not profile_tables:
             raise BackgroundJobError('Failed to generate student profile tables.')
-        refresh_all_from_staging(profile_tables)
+        if incremental:
+            refresh_all_from_staging(profile_tables, sids_table=self.refreshed_sids_table)
+            update_merged_profile_digests(self.profile_digests, self.deleted_sids)
+        else:
+            refresh_all_from_staging(profile_tables)
 
         self.update_redshift_academic_standing()
         self.update_redshift_student_academic_programs()
-        self.update_rds_profile_indexes()
+        rds_sync_summary = self.update_rds_profile_indexes()
 
-        result = f'Generated merged profiles ({len(self.successes)} successes, {len(self.failures)} failures).'
+        result = f'Generated merged profiles ({len(self.successes)} successes, {len(self.failures)} failures'
+        if incremental:
+            result += f'; {self.skipped_count} unchanged profiles skipped, {len(self.deleted_sids)} deleted'
+        result += ').'
+        if rds_sync_summary:
+            result += f' {rds_sync_summary}'
 
         app.logger.info('Profile generation complete; will generate enrollment terms.')
         row_count = self.generate_student_enrollments_table()
@@ -96,37 +128,167 @@ class GenerateMergedStudentFeeds(BackgroundJob):
             'student_profiles', 'student_profile_index', 'student_majors', 'student_holds',
             'demographics', 'ethnicities', 'intended_majors', 'minors', 'visas',
         ]
+        incremental = app.config['MERGED_PROFILE_INCREMENTAL']
+        self.profile_digests = {}
+        self.skipped_count = 0
+        self.deleted_sids = []
         for table in tables:
             truncate_staging_table(table)
+        if incremental:
+            truncate_staging_table(self.refreshed_sids_table)
 
         all_student_advisor_mappings = self.map_advisors_to_students()
-        if not all_student_feed_elements:
+        if all_student_feed_elements is None:
             app.logger.error('No profile feeds returned, aborting job.')
             return False
-        count = len(all_student_feed_elements)
-        app.logger.info(f'Will generate feeds for {count} students.')
+        app.logger.info('Will generate feeds for all students.')
         with ExitStack() as stack:
             feed_files = {table: stack.enter_context(tempfile.TemporaryFile()) for table in tables}
             feed_counts = {table: 0 for table in tables}
             major_divisions = self.get_majors_divisions()
+            if incremental:
+                all_student_feed_elements = self.filter_changed_profile_elements(
+                    all_student_feed_elements,
+                    all_student_advisor_mappings,
+                    major_divisions,
+                )
 
-            for index, feed_elements in enumerate(all_student_feed_elements):
-                sid = feed_elements['sid']
-                if self.generate_student_profile_feed(
-                    feed_elements,
-                    all_student_advisor_mappings.get(sid, []),
+            max_processes = app.config['MERGED_PROFILE_MAX_PROCESSES']
+            if max_processes > 1:
+                self.generate_sharded_student_profile_feeds(
+                    all_student_feed_elements,
+                    all_student_advisor_mappings,
                     feed_files,
                     feed_counts,
                     major_divisions,
-                ):
-                    self.successes.append(sid)
-                else:
-                    self.failures.append(sid)
+                    max_processes,
+                )
+            else:
+                self.generate_student_profile_feeds(
+                    all_student_feed_elements,
+                    all_student_advisor_mappings,
+                    feed_files,
+                    feed_counts,
+                    major_divisions,
+                )
+            count = len(self.successes) + len(self.failures)
+            if not (count or self.skipped_count):
+                app.logger.error('No profile feeds returned, aborting job.')
+                return False
+            app.logger.info(f'Generated feeds for {count} students.')
             for table in tables:
-                if feed_files[table]:
+                # An incremental run may legitimately leave some staging tables empty.
+                if feed_counts[table] or not incremental:
                     write_file_to_staging(table, feed_files[table], feed_counts[table])
+            if incremental:
+                self.stage_refreshed_sids()
         return tables
 
+    def filter_changed_profile_elements(self, all_student_feed_elements, all_student_advisor_mappings, major_divisions):
+        previous_digests = get_merged_profile_digests()
+        # Inputs shared across students are folded into every digest, so that a change to any of them regenerates all profiles.
+        shared_inputs = [MERGED_PROFILE_DIGEST_VERSION, berkeley.current_term_id(), sorted((str(k), str(v)) for k, v in major_divisions.items())]
+        for feed_elements in all_student_feed_elements:
+            sid = feed_elements['sid']
+            digest = hashlib.md5(json.dumps(
+                [self.normalize_profile_elements(feed_elements), all_student_advisor_mappings.get(sid, []), shared_inputs],
+                sort_keys=True,
+                default=str,
+            ).encode()).hexdigest()
+            if previous_digests.pop(sid, None) == digest:
+                self.skipped_count += 1
+            else:
+                self.profile_digests[sid] = digest
+                yield feed_elements
+        # Any SIDs left over have dropped out of the student population since the previous run.
+        self.deleted_sids = list(previous_digests.keys())
+        app.logger.info(
+            f'{len(self.profile_digests)} student profiles changed, {self.skipped_count} unchanged, {len(self.deleted_sids)} deleted.',
+        )
+
+    def stage_refreshed_sids(self):
+        refreshed_sids = list(self.profile_digests.keys()) + self.deleted_sids
+        if not refreshed_sids:
+            app.logger.info('No student profiles changed; nothing to refresh.')
+            return
+        with tempfile.TemporaryFile() as sids_file:
+            for sid in refreshed_sids:
+                write_to_tsv_file(sids_file, [sid])
+            write_file_to_staging(self.refreshed_sids_table, sids_file, len(refreshed_sids))
+
+    def generate_student_profile_feeds(self, all_student_feed_elements, all_student_advisor_mappings, feed_files, feed_counts, major_divisions):
+        for feed_elements in all_student_feed_elements:
+            feed_elements = self.normalize_profile_elements(feed_elements)
+            sid = feed_elements['sid']
+            if self.generate_student_profile_feed(
+                feed_elements,
+                all_student_advisor_mappings.get(sid, []),
+                feed_files,
+                feed_counts,
+                major_divisions,
+            ):
+                self.successes.append(sid)
+            else:
+                self.failures.append(sid)
+
+    def generate_sharded_student_profile_feeds(
+        self,
+        all_student_feed_elements,
+        all_student_advisor_mappings,
+        feed_files,
+        feed_counts,
+        major_divisions,
+        max_processes,
+    ):
+        # Profile elements arrive sorted by SID, so consecutive slices give each worker its own SID range. Worker output is
+        # appended to the combined feed files in shard order, matching the output of the serial path. To keep memory use flat,
+        # no more than one shard per worker is held in reserve while earlier shards are running.
+        shard_size = app.config['MERGED_PROFILE_SHARD_SIZE']
+        app.logger.info(f'Will generate profile feeds in shards of up to {shard_size} students.')
+        all_student_feed_elements = iter(all_student_feed_elements)
+        # Hand workers a fresh job instance, so that accumulated successes and failures are not pickled along with each shard.
+        shard_worker = type(self)()
+        with process_pool_executor(max_processes) as executor:
+            pending = deque()
+            for shard in iter(lambda: list(islice(all_student_feed_elements, shard_size)), []):
+                shard_advisor_mappings = {r['sid']: all_student_advisor_mappings[r['sid']] for r in shard if r['sid'] in all_student_advisor_mappings}
+                pending.append(executor.submit(
+                    shard_worker.generate_student_profile_shard,
+                    shard,
+                    shard_advisor_mappings,
+                    major_divisions,
+                    list(feed_files.keys()),
+                ))
+                if len(pending) > max_processes:
+                    self.collect_student_profile_shard(pending.popleft().result(), feed_files, feed_counts)
+            while pending:
+                self.collect_student_profile_shard(pending.popleft().result(), feed_files, feed_counts)
+
+    def collect_student_profile_shard(self, shard_result, feed_files, feed_counts):
+        shard_successes, shard_failures, shard_paths, shard_counts = shard_result
+        self.successes += shard_successes
+        self.failures += shard_failures
+        for table, path in shard_paths.items():
+            with open(path, 'rb') as shard_file:
+                shutil.copyfileobj(shard_file, feed_files[table])
+            os.remove(path)
+            feed_counts[table] += shard_counts[table]
+
+    def generate_student_profile_shard(self, shard, advisor_mappings, major_divisions, tables):
+        # Runs in a worker process. Shard output goes to named tempfiles so that the parent process can collect it.
+        self.successes = []
+        self.failures = []
+        shard_paths = {}
+        with ExitStack() as stack:
+            feed_files = {}
+            for table in tables:
+                fd, shard_paths[table] = tempfile.mkstemp(prefix=f'{table}_', suffix='.tsv')
+                feed_files[table] = stack.enter_context(os.fdopen(fd, 'wb'))
+            feed_counts = {table: 0 for table in tables}
+            self.generate_student_profile_feeds(shard, advisor_mappings, feed_files, feed_counts, major_divisions)
+        app.logger.debug(f'Worker {os.getpid()} generated {len(self.successes)} profile feeds ({len(self.failures)} failures).')
+        return self.successes, self.failures, shard_paths, feed_counts
+
     def generate_student_profile_feed(self, feed_elements, advisors, feed_files, feed_counts, major_divisions):
         sid = feed_elements['sid']
         uid = feed_elements['ldap_uid']
@@ -174,7 +336,7 @@ class GenerateMergedStudentFeeds(BackgroundJob):
         }
         feed_counts['student_profiles'] += write_to_tsv_file(
             feed_files['student_profiles'],
-            [sid, json.dumps(merged_profile), json.dumps(profile_summary)],
+            [sid, json_dumpb(merged_profile), json_dumpb(profile_summary)],
         )
 
         if sis_profile:
@@ -201,7 +363,7 @@ class GenerateMergedStudentFeeds(BackgroundJob):
                         [sid, plan.get('program', None), plan_description, major_divisions.get(plan_description, None)],
                     )
             for hold in sis_profile.get('holds', []):
-                feed_counts['student_holds'] += write_to_tsv_file(feed_files['student_holds'], [sid, json.dumps(hold)])
+                feed_counts['student_holds'] += write_to_tsv_file(feed_files['student_holds'], [sid, json_dumpb(hold)])
             for intended_major in (sis_profile.get('intendedMajors') or []):
                 feed_counts['intended_majors'] += write_to_tsv_file(feed_files['intended_majors'], [sid, intended_major.get('description', None)])
             for plan in sis_profile.get('plansMinor', []):
@@ -210,6 +372,14 @@ class GenerateMergedStudentFeeds(BackgroundJob):
 
         return True
 
+    @staticmethod
+    def normalize_profile_elements(feed_elements):
+        # Rows streamed from an S3 unload arrive as strings, with empty strings standing in for nulls.
+        normalized = {k: (None if v == '' else v) for k, v in feed_elements.items()}
+        if normalized.get('canvas_user_id') is not None:
+            normalized['canvas_user_id'] = int(normalized['canvas_user_id'])
+        return normalized
+
     def summarize_sis_profile(self, sis_profile):
         if not sis_profile:
             return {}
@@ -296,6 +466,16 @@ class GenerateMergedStudentFeeds(BackgroundJob):
         )
 
     def update_rds_profile_indexes(self):
+        if differential_sync_enabled():
+            # The full refresh template, pointed at temporary tables, stages the refreshed rows.
+            staging_sql = strip_transaction_control(
+                resolve_sql_template('update_rds_indexes_student_profiles.template.sql', rds_schema_student='pg_temp'),
+            )
+            return sync_rds_tables(
+                self.rds_schema,
+                self.rds_profile_index_tables,
+                stage_rows=lambda transaction: transaction.execute(staging_sql),
+            )
         resolved_ddl_rds = resolve_sql_template('update_rds_indexes_student_profiles.template.sql')
         if rds.execute(resolved_ddl_rds):
             app.logger.info('RDS student profile indexes updated.')
@@ -315,6 +495,10 @@ class GenerateMergedStudentFeeds(BackgroundJob):
         return row_count
 
     def generate_term_feeds(self, table_name_terms, table_name_incompletes):
+        max_processes = app.config['MERGED_TERM_FEED_MAX_PROCESSES']
+        if max_processes > 1:
+            return self.generate_parallel_term_feeds(table_name_terms, table_name_incompletes, max_processes)
+
         enrollment_stream = queries.stream_sis_enrollments()
         term_gpa_stream = queries.stream_term_gpas()
         canvas_site_stream = queries.stream_canvas_memberships()
@@ -330,40 +514,24 @@ class GenerateMergedStudentFeeds(BackgroundJob):
 
             for term_id, term_enrollments_grp in groupby(enrollment_stream, operator.itemgetter('sis_term_id')):
                 term_id = str(term_id)
-                term_name = berkeley.term_name_for_sis_id(term_id)
-
                 app.logger.info(f'Generating enrollment feeds for term {term_id}...')
-                term_row_count = 0
-                incompletes_row_count = 0
 
                 with tempfile.TemporaryFile() as term_feed_file, tempfile.TemporaryFile() as incompletes_feed_file:
-                    for sid, enrollments_grp in groupby(term_enrollments_grp, operator.itemgetter('sid')):
-                        term_feed, term_incompletes_count_for_sid = self.generate_term_feed_for_sid(
-                            sid, term_id, term_name, enrollments_grp, incompletes_feed_file)
-
-                        while term_gpa_tracker['term_id'] > term_id or (term_gpa_tracker['term_id'] == term_id and term_gpa_tracker['sid'] < sid):
-                            (term_gpa_tracker['term_id'], term_gpa_tracker['sid']), term_gpa_tracker['term_gpas'] =\
-                                next(term_gpa_results, ((term_id, sid), []))
-                        if term_gpa_tracker['term_id'] == term_id and term_gpa_tracker['sid'] == sid:
-                            append_term_gpa(term_feed, term_gpa_tracker['term_gpas'])
-
-                        while canvas_site_tracker['term_id'] > term_id or\
-                                (canvas_site_tracker['term_id'] == term_id and canvas_site_tracker['sid'] < sid):
-                            (canvas_site_tracker['term_id'], canvas_site_tracker['sid']), canvas_site_tracker['sites'] =\
-                                next(canvas_site_results, ((term_id, sid), []))
-                        if canvas_site_tracker['term_id'] == term_id and canvas_site_tracker['sid'] == sid:
-                            merge_canvas_site_memberships(term_feed, canvas_site_tracker['sites'])
-
-                        term_feed_file.write(encoded_tsv_row([sid, term_id, json.dumps(term_feed)]) + b'\n')
-                        term_row_count += 1
-                        incompletes_row_count += term_incompletes_count_for_sid
-
-                    if term_row_count:
-                        write_file_to_staging(table_name_terms, term_feed_file, term_row_count, term_id=term_id)
-                        row_count += term_row_count
-                    if incompletes_row_count:
-                        write_file_to_staging(table_name_incompletes, incompletes_feed_file, incompletes_row_count, term_id=term_id)
-                        row_count += term_row_count
+                    term_row_count, incompletes_row_count = self.write_term_feeds(
+                        term_id,
+                        term_enrollments_grp,
+                        term_gpa_results,
+                        term_gpa_tracker,
+                        canvas_site_results,
+                        canvas_site_tracker,
+                        term_feed_file,
+                        incompletes_feed_file,
+                    )
+                    row_count += self.stage_term_feeds(
+                        term_id,
+                        (table_name_terms, term_feed_file, term_row_count),
+                        (table_name_incompletes, incompletes_feed_file, incompletes_row_count),
+                    )
 
         finally:
             enrollment_stream.close()
@@ -371,6 +539,118 @@ class GenerateMergedStudentFeeds(BackgroundJob):
 
         return row_count
 
+    def generate_parallel_term_feeds(self, table_name_terms, table_name_incompletes, max_processes):
+        term_ids = queries.get_enrollment_term_ids()
+        app.logger.info(f'Generating enrollment feeds for {len(term_ids)} terms across {max_processes} worker processes.')
+        row_count = 0
+        # Terms are generated independently in worker processes. As each term finishes, its feeds are uploaded and copied
+        # into staging while later terms are still being generated.
+        with process_pool_executor(max_processes) as executor:
+            # Submit work through a fresh instance, so that state accumulated on this one is not pickled.
+            term_worker = type(self)()
+            futures = [executor.submit(term_worker.generate_term_feed_files, term_id) for term_id in term_ids]
+            try:
+                for future in as_completed(futures):
+                    term_id, term_path, term_row_count, incompletes_path, incompletes_row_count = future.result()
+                    try:
+                        with open(term_path, 'rb') as term_feed_file, open(incompletes_path, 'rb') as incompletes_feed_file:
+                            row_count += self.stage_term_feeds(
+                                term_id,
+                                (table_name_terms, term_feed_file, term_row_count),
+                                (table_name_incompletes, incompletes_feed_file, incompletes_row_count),
+                            )
+                    finally:
+                        os.remove(term_path)
+                        os.remove(incompletes_path)
+            except Exception:
+                # Cancel terms not yet started, and clean up after any that finished but were never staged.
+                for future in futures:
+                    if not future.cancel() and not future.exception():
+                        _, term_path, _, incompletes_path, _ = future.result()
+                        for path in (term_path, incompletes_path):
+                            if os.path.exists(path):
+                                os.remove(path)
+                raise
+        return row_count
+
+    def generate_term_feed_files(self, term_id):
+        # Runs in a worker process, writing feeds for a single term to temporary files that the parent process will stage.
+        app.logger.info(f'Generating enrollment feeds for term {term_id}...')
+        enrollment_stream = queries.stream_sis_enrollments(term_id=term_id)
+        term_gpa_stream = queries.stream_term_gpas(term_id=term_id)
+        canvas_site_stream = queries.stream_canvas_memberships(term_id=term_id)
+        term_fd, term_path = tempfile.mkstemp()
+        incompletes_fd, incompletes_path = tempfile.mkstemp()
+        try:
+            with os.fdopen(term_fd, 'wb') as term_feed_file, os.fdopen(incompletes_fd, 'wb') as incompletes_feed_file:
+                term_row_count, incompletes_row_count = self.write_term_feeds(
+                    term_id,
+                    enrollment_stream,
+                    groupby(term_gpa_stream, lambda r: (str(r['term_id']), r['sid'])),
+                    {'term_id': '9999', 'sid': '', 'term_gpas': []},
+                    groupby(canvas_site_stream, lambda r: (str(r['term_id']), r['sid'])),
+                    {'term_id': '9999', 'sid': '', 'sites': []},
+                    term_feed_file,
+                    incompletes_feed_file,
+                )
+        except Exception:
+            os.remove(term_path)
+            os.remove(incompletes_path)
+            raise
+        finally:
+            enrollment_stream.close()
+            term_gpa_stream.close()
+            canvas_site_stream.close()
+        return term_id, term_path, term_row_count, incompletes_path, incompletes_row_count
+
+    def write_term_feeds(
+        self,
+        term_id,
+        term_enrollments,
+        term_gpa_results,
+        term_gpa_tracker,
+        canvas_site_results,
+        canvas_site_tracker,
+        term_feed_file,
+        incompletes_feed_file,
+    ):
+        term_name = berkeley.term_name_for_sis_id(term_id)
+        term_row_count = 0
+        incompletes_row_count = 0
+        for sid, enrollments_grp in groupby(term_enrollments, operator.itemgetter('sid')):
+            term_feed, term_incompletes_count_for_sid = self.generate_term_feed_for_sid(
+                sid, term_id, term_name, enrollments_grp, incompletes_feed_file)
+
+            while term_gpa_tracker['term_id'] > term_id or (term_gpa_tracker['term_id'] == term_id and term_gpa_tracker['sid'] < sid):
+                (term_gpa_tracker['term_id'], term_gpa_tracker['sid']), term_gpa_tracker['term_gpas'] =\
+                    next(term_gpa_results, ((term_id, sid), []))
+            if term_gpa_tracker['term_id'] == term_id and term_gpa_tracker['sid'] == sid:
+                append_term_gpa(term_feed, term_gpa_tracker['term_gpas'])
+
+            while canvas_site_tracker['term_id'] > term_id or\
+                    (canvas_site_tracker['term_id'] == term_id and canvas_site_tracker['sid'] < sid):
+                (canvas_site_tracker['term_id'], canvas_site_tracker['sid']), canvas_site_tracker['sites'] =\
+                    next(canvas_site_results, ((term_id, sid), []))
+            if canvas_site_tracker['term_id'] == term_id and canvas_site_tracker['sid'] == sid:
+                merge_canvas_site_memberships(term_feed, canvas_site_tracker['sites'])
+
+            term_feed_file.write(encoded_tsv_row([sid, term_id, json_dumpb(term_feed)]) + b'\n')
+            term_row_count += 1
+            incompletes_row_count += term_incompletes_count_for_sid
+        return term_row_count, incompletes_row_count
+
+    def stage_term_feeds(self, term_id, terms_feed, incompletes_feed):
+        row_count = 0
+        table_name_terms, term_feed_file, term_row_count = terms_feed
+        table_name_incompletes, incompletes_feed_file, incompletes_row_count = incompletes_feed
+        if term_row_count:
+            write_file_to_staging(table_name_terms, term_feed_file, term_row_count, term_id=term_id)
+            row_count += term_row_count
+        if incompletes_row_count:
+            write_file_to_staging(table_name_incompletes, incompletes_feed_file, incompletes_row_count, term_id=term_id)
+            row_count += term_row_count
+        return row_count
+
     def generate_term_feed_for_sid(self, sid, term_id, term_name, enrollments_grp, incompletes_feed_file):
         term_feed = None
         incompletes_row_count = 0
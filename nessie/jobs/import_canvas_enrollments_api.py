@@ -23,14 +23,13 @@ SOFTWARE AND ACCOMPANYING DOCUMENTATION, IF ANY, PROVIDED HEREUNDER IS PROVIDED
 ENHANCEMENTS, OR MODIFICATIONS.
 """
 
-import json
 
 from flask import current_app as app
 from nessie.externals import canvas_api, redshift, s3
 from nessie.jobs.background_job import BackgroundJob, BackgroundJobError
 from nessie.lib.berkeley import current_term_id
 from nessie.lib.queries import get_enrolled_canvas_sites_for_term
-from nessie.lib.util import encoded_tsv_row, get_s3_sis_api_daily_path, resolve_sql_template_string
+from nessie.lib.util import encoded_tsv_row, get_s3_sis_api_daily_path, json_dumpb, resolve_sql_template_string
 
 """Logic for Canvas enrollments API import job."""
 
@@ -56,7 +55,7 @@ class ImportCanvasEnrollmentsApi(BackgroundJob):
                 for enrollment in feed:
                     user_id = enrollment.get('user_id')
                     last_activity_at = enrollment.get('last_activity_at') or ''
-                    rows.append(encoded_tsv_row([course_id, user_id, term_id, last_activity_at, json.dumps(enrollment)]))
+                    rows.append(encoded_tsv_row([course_id, user_id, term_id, last_activity_at, json_dumpb(enrollment)]))
             else:
                 failure_count += 1
                 app.logger.error(f'Canvas enrollments API import failed for course id {course_id}.')
@@ -54,14 +54,14 @@ class RefreshCanvasData2Schema(BackgroundJob):
         resolved_ddl = resolve_sql_template(sql_filename, cd2_data_path=s3_path)
         if not redshift.execute_ddl_script(resolved_ddl):
             raise BackgroundJobError(f'Redshift execute_ddl_script failed on {sql_filename}')
-        verify_external_schema(
+        verification = verify_external_schema(
             self.external_schema,
             resolved_ddl,
             is_zero_count_acceptable=app.config['CD2_ZERO_COUNT_ACCEPTABLE'],
         )
         app.logger.info('Redshift schema created.')
 
-        return True
+        return f'Redshift schema created. {verification}'
 
 
 def _get_yesterdays_cd2_data():
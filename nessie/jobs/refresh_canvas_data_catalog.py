@@ -28,7 +28,7 @@ from datetime import datetime, timedelta
 
 from flask import current_app as app
 from nessie.externals import canvas_data, redshift, s3
-from nessie.jobs.background_job import BackgroundJob, BackgroundJobError
+from nessie.jobs.background_job import BackgroundJob, BackgroundJobError, verify_external_tables
 from nessie.lib import berkeley
 from nessie.lib.util import get_s3_canvas_daily_path
 import pandas as pd
@@ -102,8 +102,8 @@ class RefreshCanvasDataCatalog(BackgroundJob):
             app.logger.error('Canvas schema creation job failed.')
             raise BackgroundJobError('Canvas schema creation job failed.')
 
-        self.verify_external_data_catalog()
-        return 'Canvas external schema created and verified.'
+        verification = self.verify_external_data_catalog()
+        return f'Canvas external schema created and verified. {verification}'
 
     def generate_external_catalog(self, external_schema, schema_df):
         canvas_path = self.generate_canvas_path()
@@ -180,15 +180,9 @@ class RefreshCanvasDataCatalog(BackgroundJob):
                 raise BackgroundJobError(f'No data in S3 for external table {required_table}: aborting job.')
 
         app.logger.info(f'Tables to be verified : {tables}')
-        for table in tables:
-            result = redshift.fetch(f'SELECT COUNT(*) FROM {external_schema}.{table}')
-            if result and result[0] and result[0]['count']:
-                count = result[0]['count']
-                app.logger.info(f'Verified external table {table} ({count} rows).')
-            else:
-                raise BackgroundJobError(f'Failed to verify external table {table}: aborting job.')
+        verification = verify_external_tables([f'{external_schema}.{table}' for table in tables])
         app.logger.info(f'Canvas verification job completed successfully for {len(tables)} tables')
-        return True
+        return verification
 
     def generate_canvas_path(self):
         canvas_path = get_s3_canvas_daily_path()
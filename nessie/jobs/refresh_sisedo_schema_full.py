@@ -54,7 +54,7 @@ class RefreshSisedoSchemaFull(BackgroundJob):
         resolved_ddl = resolve_sql_template(sql_filename, sisedo_data_path=s3_path)
         if not redshift.execute_ddl_script(resolved_ddl):
             raise BackgroundJobError(f'Redshift execute_ddl_script failed on {sql_filename}')
-        verify_external_schema(
+        verification = verify_external_schema(
             self.external_schema,
             resolved_ddl,
             is_zero_count_acceptable=app.config['SISEDO_ZERO_COUNT_ACCEPTABLE'],
@@ -66,7 +66,7 @@ class RefreshSisedoSchemaFull(BackgroundJob):
             raise BackgroundJobError('Failed to update RDS indexes for full SISEDO refresh.')
         app.logger.info('RDS indexes updated.')
 
-        return True
+        return f'Redshift schema created and RDS indexes updated. {verification}'
 
 
 def _get_yesterdays_sis_data():
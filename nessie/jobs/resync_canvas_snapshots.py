@@ -67,7 +67,10 @@ class ResyncCanvasSnapshots(BackgroundJob):
                 # TODO Add logic to fetch a new signed URL from the Canvas Data API for older jobs.
                 source_url=failure['source_url'],
             )
+        # Workers update these status rows, so they must be written before any resync is dispatched.
+        metadata.flush_metadata_writes()
 
+        for failure in md['failures']:
             # Regenerate the S3 key, since the failed job may not have progressed far enough to store a destination URL in its metadata.
             if failure['canvas_table'] == 'requests':
                 key_components = [berkeley.s3_canvas_data_path_current_term(), failure['canvas_table'], failure['filename']]
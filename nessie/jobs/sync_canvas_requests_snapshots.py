@@ -65,7 +65,10 @@ class SyncCanvasRequestsSnapshots(BackgroundJob):
                 canvas_table=snapshot['table'],
                 source_url=snapshot['url'],
             )
+        # Workers update these status rows, so they must be written before any sync is dispatched.
+        metadata.flush_metadata_writes()
 
+        for snapshot in snapshots_to_sync:
             key_components = [app.config['LOCH_S3_CANVAS_DATA_PATH_HISTORICAL'], snapshot['table'], snapshot['filename']]
 
             key = '/'.join(key_components)
@@ -72,6 +72,10 @@ class SyncCanvasSnapshots(BackgroundJob):
                 canvas_table=snapshot['table'],
                 source_url=snapshot['url'],
             )
+        # Workers update these status rows, so they must be written before any sync is dispatched.
+        metadata.flush_metadata_writes()
+
+        for snapshot in snapshots_to_sync:
             if snapshot['table'] == 'requests':
                 key_components = [berkeley.s3_canvas_data_path_current_term(), snapshot['table'], snapshot['filename']]
             else:
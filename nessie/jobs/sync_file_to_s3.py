@@ -27,7 +27,7 @@ from botocore.exceptions import ClientError as BotoClientError, ConnectionError
 from flask import current_app as app
 from nessie.externals import s3
 from nessie.jobs.background_job import BackgroundJob
-from nessie.lib.metadata import create_canvas_snapshot, update_canvas_sync_status
+from nessie.lib.metadata import create_canvas_snapshot, flush_metadata_writes, update_canvas_sync_status
 
 """Logic for file sync to S3."""
 
@@ -38,27 +38,32 @@ class SyncFileToS3(BackgroundJob):
     status_logging_enabled = False
 
     def run(self, url, key, canvas_sync_job_id=None):
-        if canvas_sync_job_id:
-            update_canvas_sync_status(canvas_sync_job_id, key, 'started')
-        if s3.object_exists(key):
-            app.logger.info(f'Key {key} exists, skipping upload')
+        try:
             if canvas_sync_job_id:
-                update_canvas_sync_status(canvas_sync_job_id, key, 'duplicate')
-            return False
-        else:
-            app.logger.info(f'Key {key} does not exist, starting upload')
-            try:
-
-                def update_streaming_status(headers):
-                    update_canvas_sync_status(canvas_sync_job_id, key, 'streaming', source_size=headers.get('Content-Length'))
-
-                response = s3.upload_from_url(url, key, on_stream_opened=update_streaming_status)
-                if response and canvas_sync_job_id:
-                    destination_size = response.get('ContentLength')
-                    update_canvas_sync_status(canvas_sync_job_id, key, 'complete', destination_size=destination_size)
-                    create_canvas_snapshot(key, size=destination_size)
-                return True
-            except (BotoClientError, BotoConnectionError, ValueError) as e:
+                update_canvas_sync_status(canvas_sync_job_id, key, 'started')
+            if s3.object_exists(key):
+                app.logger.info(f'Key {key} exists, skipping upload')
                 if canvas_sync_job_id:
-                    update_canvas_sync_status(canvas_sync_job_id, key, 'error', details=str(e))
+                    update_canvas_sync_status(canvas_sync_job_id, key, 'duplicate')
                 return False
+            else:
+                app.logger.info(f'Key {key} does not exist, starting upload')
+                try:
+
+                    def update_streaming_status(headers):
+                        update_canvas_sync_status(canvas_sync_job_id, key, 'streaming', source_size=headers.get('Content-Length'))
+
+                    response = s3.upload_from_url(url, key, on_stream_opened=update_streaming_status)
+                    if response and canvas_sync_job_id:
+                        destination_size = response.get('ContentLength')
+                        update_canvas_sync_status(canvas_sync_job_id, key, 'complete', destination_size=destination_size)
+                        create_canvas_snapshot(key, size=destination_size)
+                    return True
+                except (BotoClientError, BotoConnectionError, ValueError) as e:
+                    if canvas_sync_job_id:
+                        update_canvas_sync_status(canvas_sync_job_id, key, 'error', details=str(e))
+                    return False
+        finally:
+            # Status logging is disabled for this job, so its buffered status and snapshot events are written here, before
+            # the worker can exit.
+            flush_metadata_writes()
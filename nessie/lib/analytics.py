@@ -23,16 +23,21 @@ SOFTWARE AND ACCOMPANYING DOCUMENTATION, IF ANY, PROVIDED HEREUNDER IS PROVIDED
 ENHANCEMENTS, OR MODIFICATIONS.
 """
 
-from itertools import groupby
+import hashlib
 import json
 import math
 
 from flask import current_app as app
 from nessie.externals.redshift import copy_for_pandas
-from nessie.lib.util import write_to_tsv_file
+from nessie.lib.stats import SortedColumn
+from nessie.lib.util import json_dumpb, to_float, write_to_tsv_file
+import numpy
 from numpy import nan
 import pandas
-from scipy.stats import percentileofscore
+
+# Part of every course site fingerprint. Bump it whenever analytics feed logic changes, so that incremental generation
+# regenerates course sites whose inputs have not changed.
+ANALYTICS_FEED_VERSION = 1
 
 
 def generate_analytics_feeds_for_course(output_file, term_id, canvas_site_row, site_enrollments_stream, site_submissions_stream):
@@ -54,22 +59,25 @@ def generate_analytics_feeds_for_course(output_file, term_id, canvas_site_row, s
     course_distributions = get_distributions_for_metric(df, metrics)
     course_analytics = {metric: analytics_for_course(course_distributions, metric) for metric in metrics}
 
-    submissions_by_user_id = groupby(site_submissions_stream, lambda r: int(r['reference_user_id']))
-    submission_tracker = {'user_id': 0, 'submissions': []}
+    student_analytics = {metric: analytics_for_students(metric, course_analytics, course_distributions) for metric in metrics}
+    # A student listed more than once takes analytics from the first listing.
+    student_positions = {}
+    for position, enrollment in enumerate(enrollments):
+        student_positions.setdefault(int(enrollment['canvas_user_id']), position)
+
+    submission_analytics = analytics_for_submissions(course_id, site_submissions_stream)
 
     for enrollment in enrollments:
         user_id = int(enrollment['canvas_user_id'])
-        df_enrollment = df.loc[df['canvas_user_id'].values == user_id]
-
-        analytics_feed = _generate_analytics_feed(df_enrollment, course_analytics, course_distributions, len(enrollments))
+        position = student_positions[user_id]
 
-        while submission_tracker['user_id'] < user_id:
-            submission_tracker['user_id'], submission_tracker['submissions'] = next(submissions_by_user_id, (user_id, []))
-        if submission_tracker['user_id'] == user_id:
-            submission_rows = submission_tracker['submissions']
-        else:
-            submission_rows = []
-        analytics_feed['assignmentsSubmitted'] = _generate_submission_analytics(course_id, user_id, submission_rows)
+        analytics_feed = {
+            'currentScore': student_analytics['current_score'][position],
+            'lastActivity': student_analytics['last_activity_at'][position],
+            'courseEnrollmentCount': len(enrollments),
+        }
+        # Students with no assignment submissions to compare get the no-data placeholder.
+        analytics_feed['assignmentsSubmitted'] = submission_analytics.get(user_id) or _no_data_analytics()
 
         canvas_site_feed = {
             'canvasCourseId': course_id,
@@ -89,7 +97,7 @@ def generate_analytics_feeds_for_course(output_file, term_id, canvas_site_row, s
                 enrollment['sid'],
                 term_id,
                 enrolled_sections,
-                json.dumps(canvas_site_feed),
+                json_dumpb(canvas_site_feed),
             ],
         )
         count += 1
@@ -97,53 +105,75 @@ def generate_analytics_feeds_for_course(output_file, term_id, canvas_site_row, s
     return count
 
 
-def _generate_analytics_feed(student_row, course_analytics, course_distributions, enrollment_count):
-    return {
-        'currentScore': analytics_for_student(
-            student_row,
-            'current_score',
-            course_analytics,
-            course_distributions,
-        ),
-        'lastActivity': analytics_for_student(
-            student_row,
-            'last_activity_at',
-            course_analytics,
-            course_distributions,
-        ),
-        'courseEnrollmentCount': enrollment_count,
-    }
+def course_site_fingerprint(canvas_site_row, site_enrollments, site_submissions):
+    """Return a digest of the inputs from which a course site's analytics feeds are generated.
 
-
-def _generate_submission_analytics(canvas_course_id, canvas_user_id, submission_rows):
-    submissions = copy_for_pandas(submission_rows)
-    df = pandas.DataFrame(submissions, columns=['canvas_user_id', 'submissions_turned_in'])
-    student_row = df.loc[df['canvas_user_id'].values == int(canvas_user_id)]
-    if submissions and student_row.empty:
-        app.logger.warn(f'Canvas user id {canvas_user_id}, course id {canvas_course_id} not found in Data Loch assignments; will assume 0 score')
-        df, student_row = append_missing_row(
-            df,
-            canvas_user_id,
-            pandas.DataFrame({
-                'canvas_user_id': [int(canvas_user_id)],
-                'submissions_turned_in': [0],
-            }),
-        )
-    course_distributions = get_distributions_for_metric(df, ['submissions_turned_in'])
-    course_analytics = {'submissions_turned_in': analytics_for_course(course_distributions, 'submissions_turned_in')}
-    return analytics_for_student(
-        student_row,
-        'submissions_turned_in',
-        course_analytics,
-        course_distributions,
-    )
-
-
-def append_missing_row(df, canvas_user_id, student_row):
-    df = df.append(student_row, ignore_index=True)
-    # Fetch newly appended row, mostly for the sake of its properly set-up index.
-    student_row = df.loc[df['canvas_user_id'].values == int(canvas_user_id)]
-    return df, student_row
+    The digest covers the analytics feed version, the site's description, the enrollment count, a checksum of every
+    enrollment's scores and activity, and a checksum of submission counts. Since each student's percentiles depend on the
+    whole course distribution, activity is checksummed per student rather than summarized by its latest value.
+    """
+    enrollments_checksum = hashlib.md5()
+    for row in site_enrollments:
+        values = [row.get(key) for key in ('canvas_user_id', 'sid', 'current_score', 'last_activity_at', 'sis_section_ids')]
+        enrollments_checksum.update(repr(values).encode())
+    submissions_checksum = hashlib.md5()
+    for row in site_submissions:
+        values = [row.get(key) for key in ('reference_user_id', 'canvas_user_id', 'submissions_turned_in')]
+        submissions_checksum.update(repr(values).encode())
+    site = [canvas_site_row.get(key) for key in ('canvas_course_name', 'canvas_course_code', 'canvas_course_term', 'sis_section_ids')]
+    return hashlib.md5(json.dumps(
+        [ANALYTICS_FEED_VERSION, site, len(site_enrollments), enrollments_checksum.hexdigest(), submissions_checksum.hexdigest()],
+        default=str,
+    ).encode()).hexdigest()
+
+
+def analytics_for_submissions(canvas_course_id, site_submissions_stream):
+    """Return submissions_turned_in analytics, keyed by Canvas user id, for every reference user in a course.
+
+    Each reference user is compared with the students who share their assignments, so students with the same assignments
+    share a distribution. The course's comparison rows are read into arrays once, and analytics are computed once per
+    distinct distribution, for all of its reference users at once.
+    """
+    reference_user_ids = []
+    canvas_user_ids = []
+    submissions_turned_in = []
+    for row in site_submissions_stream:
+        reference_user_ids.append(int(row['reference_user_id']))
+        canvas_user_ids.append(_to_int(row['canvas_user_id']))
+        submissions_turned_in.append(to_float(row['submissions_turned_in']))
+    if not reference_user_ids:
+        return {}
+    reference_user_ids = numpy.array(reference_user_ids)
+    is_own_row = numpy.array(canvas_user_ids, dtype=object) == reference_user_ids
+    # Non-numbers are set to zero, as in get_distributions_for_metric.
+    values = numpy.nan_to_num(numpy.array(submissions_turned_in, dtype=float), nan=0.0)
+
+    # Rows arrive sorted by reference user; each run of rows is one reference user's distribution.
+    boundaries = numpy.flatnonzero(numpy.diff(reference_user_ids)) + 1
+    distributions_by_values = {}
+    for start, end in zip([0, *boundaries.tolist()], [*boundaries.tolist(), len(values)]):
+        user_id = reference_user_ids[start].item()
+        distribution = values[start:end]
+        own_rows = numpy.flatnonzero(is_own_row[start:end])
+        if len(own_rows):
+            user_value = distribution[own_rows[0]]
+        else:
+            app.logger.warn(f'Canvas user id {user_id}, course id {canvas_course_id} not found in Data Loch assignments; will assume 0 score')
+            distribution = numpy.append(distribution, 0.0)
+            user_value = 0.0
+        key = distribution.tobytes()
+        if key not in distributions_by_values:
+            distributions_by_values[key] = (distribution, {})
+        distributions_by_values[key][1].setdefault(user_id, user_value)
+
+    analytics_by_user_id = {}
+    metric = 'submissions_turned_in'
+    for distribution, user_values in distributions_by_values.values():
+        course_distributions = get_distributions_for_metric(pandas.DataFrame({metric: distribution}), [metric])
+        course_analytics = {metric: analytics_for_course(course_distributions, metric)}
+        student_analytics = analytics_for_students(metric, course_analytics, course_distributions, numpy.array(list(user_values.values())))
+        analytics_by_user_id.update(zip(user_values.keys(), student_analytics))
+    return analytics_by_user_id
 
 
 def get_distributions_for_metric(df, metrics):
@@ -158,6 +188,9 @@ def get_distributions_for_metric(df, metrics):
         # Setting non-numbers to zero works acceptably for most current analyzed feeds, apart from lastActivity (see below).
         distributions[metric]['dfcol'].fillna(0, inplace=True)
         distributions[metric]['unique_scores'] = distributions[metric]['dfcol'].unique().tolist()
+        # Percentile and decile queries are answered from columns sorted once per distribution.
+        distributions[metric]['sorted'] = SortedColumn(distributions[metric]['dfcol'].to_numpy())
+        distributions[metric]['sorted_unique_scores'] = SortedColumn(distributions[metric]['unique_scores'])
         # When calculating z-scores and means for lastActivity, zeroed-out "no activity" values must be dropped, since zeros
         # and Unix timestamps don't play well in the same distribution. We retain the original dataset for intuitive-percentile
         # calculation: the course mean's intuitive percentile must match that of any real student who happens to have the same
@@ -172,35 +205,24 @@ def get_distributions_for_metric(df, metrics):
 def analytics_for_course(distributions, metric):
     dfcol = distributions[metric]['dfcol']
     dfcol_normalized = distributions[metric]['dfcol_normalized']
-    unique_scores = distributions[metric]['unique_scores']
 
     nunique = dfcol.nunique()
     if nunique == 0 or (nunique == 1 and dfcol.max() == 0.0):
-        return {
-            'boxPlottable': False,
-            'student': {
-                'percentile': None,
-                'raw': None,
-                'roundedUpPercentile': None,
-            },
-            'courseDeciles': None,
-            'courseMean': None,
-            'displayPercentile': None,
-        }
+        return _no_data_analytics()
 
     # If only ten or fewer values are shared across the student population, the 'universal' percentile figure and the
     # box-and-whisker graph will usually look odd. With such sparse data sets, a text summary and an (optional)
     # histogram are more readable.
     box_plottable = (nunique > 10)
 
-    column_quantiles = quantiles(dfcol, 10)
+    column_quantiles = quantiles(distributions[metric]['sorted'], 10)
 
     course_mean = dfcol_normalized.mean()
     if course_mean and not math.isnan(course_mean):
         # Spoiler: this will be '50.0'.
         comparative_percentile_of_mean = zptile(zscore(dfcol_normalized, course_mean))
-        intuitive_percentile_of_mean = int(percentileofscore(dfcol.tolist(), course_mean, kind='weak'))
-        matrixy_comparative_percentile_of_mean = percentileofscore(unique_scores, course_mean, kind='strict')
+        intuitive_percentile_of_mean = int(distributions[metric]['sorted'].percentile_of_score(course_mean, kind='weak'))
+        matrixy_comparative_percentile_of_mean = distributions[metric]['sorted_unique_scores'].percentile_of_score(course_mean, kind='strict')
     else:
         comparative_percentile_of_mean = None
         matrixy_comparative_percentile_of_mean = None
@@ -218,42 +240,72 @@ def analytics_for_course(distributions, metric):
     }
 
 
-def analytics_for_student(student_row, metric, course_analytics, distributions):
-    # If the course had no salient data, we've already filled in a placeholder student element and are done.
-    if course_analytics[metric].get('student'):
-        return course_analytics[metric]
+def analytics_for_students(metric, course_analytics, distributions, values=None):
+    """Return analytics for many students at once.
 
+    Values are the students' own values, each of which must appear in the distribution; by default, every student in the
+    distribution, in order. The distribution is sorted once and all students' percentiles are found by binary search.
+    """
     dfcol = distributions[metric]['dfcol']
+    if values is None:
+        values = dfcol.to_numpy()
+    count = len(values)
+    # If the course had no salient data, every student gets the placeholder student element.
+    if course_analytics[metric].get('student'):
+        return [course_analytics[metric]] * count
+
     dfcol_normalized = distributions[metric]['dfcol_normalized']
-    unique_scores = distributions[metric]['unique_scores']
 
-    student_row = student_row.fillna(0)
-    intuitive_percentile = rounded_up_percentile(dfcol, student_row)
-    # The intuitive percentile is our best option for display, whether or not the distribution is boxplottable.
-    # Note, however, that if all students have the same score, then all students are in the "100th percentile."
-    display_percentile = ordinal(intuitive_percentile)
+    # The intuitive, rounded-up percentile is the share of students with the same or a lower value. Z-score percentile is
+    # useful in a scatterplot to spot outliers in the overall population across contexts. (If 90% of the course's students
+    # received a score of '5', then one student with a '5' is not called out.) Rounded-up matches what non-statisticians
+    # would expect when viewing one particular student in one particular course context. (If only 10% of the course's
+    # students did better than '5', then this student with a '5' is in the 90th percentile.)
+    intuitive_percentiles = (distributions[metric]['sorted'].rank_pct(values) * 100).astype(int).tolist()
 
-    column_value = student_row[metric].values[0]
-    raw_value = round(column_value.item())
+    std = dfcol_normalized.std(ddof=0)
+    if std == 0:
+        comparative_percentiles = [None] * count
+    else:
+        comparative_percentiles = [zptile(z) for z in ((values - dfcol_normalized.mean()) / std).tolist()]
 
-    column_zscore = zscore(dfcol_normalized, column_value)
-    comparative_percentile = zptile(column_zscore)
     # For purposes of matrix plotting, improve visual spread by calculating percentile against a range of unique scores.
-    matrixy_comparative_percentile = percentileofscore(unique_scores, column_value, kind='strict')
+    matrixy_percentiles = distributions[metric]['sorted_unique_scores'].percentile_of_score(values, kind='strict').tolist()
+
+    student_analytics = []
+    for value, intuitive_percentile, comparative_percentile, matrixy_percentile in zip(
+        values.tolist(),
+        intuitive_percentiles,
+        comparative_percentiles,
+        matrixy_percentiles,
+    ):
+        analytics = {
+            'student': {
+                'matrixyPercentile': matrixy_percentile,
+                'percentile': comparative_percentile,
+                'raw': round(value),
+                'roundedUpPercentile': intuitive_percentile,
+            },
+            'displayPercentile': ordinal(intuitive_percentile),
+        }
+        analytics.update(course_analytics[metric])
+        student_analytics.append(analytics)
+    return student_analytics
+
 
-    student_analytics = {
+def _no_data_analytics():
+    return {
+        'boxPlottable': False,
         'student': {
-            'matrixyPercentile': matrixy_comparative_percentile,
-            'percentile': comparative_percentile,
-            'raw': raw_value,
-            'roundedUpPercentile': intuitive_percentile,
+            'percentile': None,
+            'raw': None,
+            'roundedUpPercentile': None,
         },
-        'displayPercentile': display_percentile,
+        'courseDeciles': None,
+        'courseMean': None,
+        'displayPercentile': None,
     }
 
-    student_analytics.update(course_analytics[metric])
-    return student_analytics
-
 
 def ordinal(nbr):
     rounded = round(nbr)
@@ -269,23 +321,16 @@ def ordinal(nbr):
     return f'{rounded}{suffix}'
 
 
-def quantiles(series, count):
-    """Return a given number of evenly spaced quantiles for a given series."""
-    return [round(series.quantile(n / count)) for n in range(0, count + 1)]
-
+def quantiles(sorted_column, count):
+    """Return a given number of evenly spaced quantiles for a given sorted column."""
+    return [round(quantile) for quantile in sorted_column.quantiles(count).tolist()]
 
-def rounded_up_percentile(dataframe, student_row):
-    """Given a dataframe and an individual student row, return a more easily understood meaning of percentile.
 
-    Z-score percentile is useful in a scatterplot to spot outliers in the overall population across contexts.
-    (If 90% of the course's students received a score of '5', then one student with a '5' is not called out.)
-    Rounded-up matches what non-statisticians would expect when viewing one particular student in one
-    particular course context. (If only 10% of the course's students did better than '5', then this student
-    with a '5' is in the 90th percentile.)
-    """
-    percentile = dataframe.rank(pct=True, method='max')[student_row.index].values[0]
-    percentile = int(percentile * 100)
-    return percentile
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
 
 
 def zptile(z_score):
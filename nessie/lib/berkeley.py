@@ -23,6 +23,7 @@ SOFTWARE AND ACCOMPANYING DOCUMENTATION, IF ANY, PROVIDED HEREUNDER IS PROVIDED
 ENHANCEMENTS, OR MODIFICATIONS.
 """
 
+from functools import lru_cache
 import re
 import threading
 
@@ -201,6 +202,9 @@ ACADEMIC_PLAN_TO_DEGREE_PROGRAM_PAGE = {
     'Urban Studies': 'urban-studies',
 }
 
+_DEGREE_PROGRAM_PAGE_ORDER = {plan: index for index, plan in enumerate(ACADEMIC_PLAN_TO_DEGREE_PROGRAM_PAGE.keys())}
+_DEGREE_PROGRAM_SUFFIX = re.compile(r' (BA|BS|UG)')
+
 
 cache_thread = threading.local()
 
@@ -303,11 +307,12 @@ def term_name_for_sis_id(sis_id=None):
         return f'{season} {year}'
 
 
+@lru_cache(maxsize=4096)
 def degree_program_url_for_major(plan_description):
-    matched = next(
-        (k for k in ACADEMIC_PLAN_TO_DEGREE_PROGRAM_PAGE.keys() if re.match(r'^' + re.escape(k) + r' (BA|BS|UG)', plan_description)),
-        None,
-    )
+    # A plan matches any mapped name followed by a degree suffix, so the candidates are the prefixes of the description
+    # preceding each suffix. If more than one candidate is mapped, the first in mapping order wins.
+    candidates = [plan_description[:m.start()] for m in _DEGREE_PROGRAM_SUFFIX.finditer(plan_description)]
+    matched = min((c for c in candidates if c in _DEGREE_PROGRAM_PAGE_ORDER), key=_DEGREE_PROGRAM_PAGE_ORDER.get, default=None)
     if matched:
         return f'http://guide.berkeley.edu/undergraduate/degree-programs/{ACADEMIC_PLAN_TO_DEGREE_PROGRAM_PAGE[matched]}/'
     else:
@@ -23,46 +23,239 @@ SOFTWARE AND ACCOMPANYING DOCUMENTATION, IF ANY, PROVIDED HEREUNDER IS PROVIDED
 ENHANCEMENTS, OR MODIFICATIONS.
 """
 
+from collections import deque
 from contextlib import contextmanager
 from datetime import datetime
+import os
+import threading
+import time
+from urllib.parse import urlparse
 
+from flask import current_app as app
 import psycopg2
+import psycopg2.extensions
 import psycopg2.extras
 import psycopg2.sql
 
 
+class ConnectionPool:
+    """Thread-safe pool of psycopg2 connections to a single database.
+
+    At most max_size idle connections are retained. Checkouts beyond that limit never block; they open a new connection,
+    which is closed rather than pooled when returned. Idle connections are closed after max_idle_seconds, and a connection
+    idle for longer than health_check_seconds is pinged before reuse.
+    """
+
+    def __init__(self, name, connect_args, max_size, max_idle_seconds, health_check_seconds):
+        self.name = name
+        self.connect_args = connect_args
+        self.max_size = max_size
+        self.max_idle_seconds = max_idle_seconds
+        self.health_check_seconds = health_check_seconds
+        self.counts = {
+            'created': 0,
+            'reused': 0,
+            'evicted': 0,
+            'discarded': 0,
+            'failed_health_checks': 0,
+        }
+        self._checked_out = 0
+        # Idle connections with the monotonic time they were returned, most recently returned last.
+        self._idle = deque()
+        # Connections inherited across a fork still share a socket with the parent process and must never be closed, even by
+        # garbage collection, in the child.
+        self._abandoned = []
+        self._lock = threading.Lock()
+
+    def checkout(self, autocommit):
+        while True:
+            with self._lock:
+                self._evict_expired()
+                if not self._idle:
+                    break
+                connection, returned_at = self._idle.pop()
+            if self._is_healthy(connection, returned_at):
+                connection.autocommit = autocommit
+                with self._lock:
+                    self.counts['reused'] += 1
+                    self._checked_out += 1
+                return connection
+            with self._lock:
+                self.counts['failed_health_checks'] += 1
+            _close_quietly(connection)
+        connection = _connect(self.connect_args)
+        connection.autocommit = autocommit
+        with self._lock:
+            self.counts['created'] += 1
+            self._checked_out += 1
+        return connection
+
+    def release(self, connection):
+        reusable = not connection.closed
+        # Leave no open or failed transaction behind for the next borrower. A transaction committed with SQL rather than
+        # connection.commit() is closed on the server but still open as far as psycopg2 is concerned.
+        if reusable and (connection.status != psycopg2.extensions.STATUS_READY or _in_transaction(connection)):
+            try:
+                connection.rollback()
+            except psycopg2.Error:
+                reusable = False
+        with self._lock:
+            self._checked_out = max(self._checked_out - 1, 0)
+            if reusable and len(self._idle) < self.max_size:
+                self._idle.append((connection, time.monotonic()))
+                return
+            self.counts['discarded'] += 1
+        _close_quietly(connection)
+
+    def close_all(self):
+        with self._lock:
+            idle = [connection for connection, returned_at in self._idle]
+            self._idle.clear()
+        for connection in idle:
+            _close_quietly(connection)
+
+    def metrics(self):
+        with self._lock:
+            return {
+                **self.counts,
+                'checked_out': self._checked_out,
+                'idle': len(self._idle),
+                'max_size': self.max_size,
+            }
+
+    def reset_after_fork(self):
+        self._lock = threading.Lock()
+        self._abandoned.extend(connection for connection, returned_at in self._idle)
+        self._idle.clear()
+        self._checked_out = 0
+
+    def _evict_expired(self):
+        cutoff = time.monotonic() - self.max_idle_seconds
+        # The oldest idle connections sit at the left end of the deque.
+        while self._idle and self._idle[0][1] < cutoff:
+            connection, returned_at = self._idle.popleft()
+            self.counts['evicted'] += 1
+            _close_quietly(connection)
+
+    def _is_healthy(self, connection, returned_at):
+        if connection.closed:
+            return False
+        if time.monotonic() - returned_at < self.health_check_seconds:
+            return True
+        try:
+            connection.autocommit = True
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            return True
+        except psycopg2.Error:
+            return False
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_connection_pool(**kwargs):
+    key = tuple(sorted(kwargs.items()))
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = ConnectionPool(
+                name=_pool_name(kwargs),
+                connect_args=kwargs,
+                max_size=app.config['DB_CONNECTION_POOL_MAX_SIZE'],
+                max_idle_seconds=app.config['DB_CONNECTION_POOL_MAX_IDLE_SECONDS'],
+                health_check_seconds=app.config['DB_CONNECTION_POOL_HEALTH_CHECK_SECONDS'],
+            )
+            _pools[key] = pool
+        return pool
+
+
+def connection_pool_metrics():
+    with _pools_lock:
+        pools = list(_pools.values())
+    return {pool.name: pool.metrics() for pool in pools}
+
+
+def close_connection_pools():
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close_all()
+
+
+def _reset_pools_after_fork():
+    global _pools_lock
+    _pools_lock = threading.Lock()
+    for pool in _pools.values():
+        pool.reset_after_fork()
+
+
+os.register_at_fork(after_in_child=_reset_pools_after_fork)
+
+
 @contextmanager
-def get_psycopg_cursor(operation='read', autocommit=True, **kwargs):
+def get_psycopg_cursor(operation='read', autocommit=True, pooled=True, **kwargs):
     connection = None
     cursor = None
     if operation == 'write':
         cursor_factory = None
     else:
         cursor_factory = psycopg2.extras.DictCursor
+    # Callers that change session state ask for an unpooled connection, so that the state is not handed to a later borrower.
+    pool = get_connection_pool(**kwargs) if pooled and app.config['DB_CONNECTION_POOL_MAX_SIZE'] else None
     try:
-        if kwargs.get('uri'):
-            connection = psycopg2.connect(kwargs['uri'])
-        else:
-            connection = psycopg2.connect(**kwargs)
         # Autocommit is required for EXTERNAL TABLE creation and deletion.
-        if autocommit:
-            connection.autocommit = True
+        if pool:
+            connection = pool.checkout(autocommit=autocommit)
+        else:
+            connection = _connect(kwargs)
+            if autocommit:
+                connection.autocommit = True
         cursor_args = {'cursor_factory': cursor_factory}
-        yield connection.cursor(**cursor_args)
+        cursor = connection.cursor(**cursor_args)
+        yield cursor
     finally:
-        if cursor is not None:
+        if cursor is not None and not cursor.closed:
             cursor.close()
         if connection is not None:
-            connection.close()
+            if pool:
+                pool.release(connection)
+            else:
+                connection.close()
 
 
-def get_psycopg_cursor_streaming(**kwargs):
-    if kwargs.get('uri'):
-        connection = psycopg2.connect(kwargs['uri'])
-    else:
-        connection = psycopg2.connect(**kwargs)
+def get_psycopg_cursor_streaming(cursor_factory=psycopg2.extras.DictCursor, **kwargs):
+    connection = _connect(kwargs)
     # Result streaming requires a server-side cursor with a name.
     return connection.cursor(
-        cursor_factory=psycopg2.extras.DictCursor,
+        cursor_factory=cursor_factory,
         name=f'nessie_cursor_{datetime.now().timestamp()}',
     )
+
+
+def _close_quietly(connection):
+    try:
+        connection.close()
+    except psycopg2.Error:
+        pass
+
+
+def _in_transaction(connection):
+    return connection.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+
+def _connect(connect_args):
+    if connect_args.get('uri'):
+        return psycopg2.connect(connect_args['uri'])
+    else:
+        return psycopg2.connect(**connect_args)
+
+
+def _pool_name(connect_args):
+    if connect_args.get('uri'):
+        parsed = urlparse(connect_args['uri'])
+        return f'{parsed.hostname}:{parsed.port}{parsed.path}'
+    else:
+        return f"{connect_args.get('host')}:{connect_args.get('port')}/{connect_args.get('dbname')}"
@@ -0,0 +1,135 @@
+"""
+Copyright ©2024. The Regents of the University of California (Regents). All Rights Reserved.
+
+Permission to use, copy, modify, and distribute this software and its documentation
+for educational, research, and not-for-profit purposes, without fee and without a
+signed licensing agreement, is hereby granted, provided that the above copyright
+notice, this paragraph and the following two paragraphs appear in all copies,
+modifications, and distributions.
+
+Contact The Office of Technology Licensing, UC Berkeley, 2150 Shattuck Avenue,
+Suite 510, Berkeley, CA 94720-1620, (510) 643-7201, otl@berkeley.edu,
+http://ipira.berkeley.edu/industry-info for commercial licensing opportunities.
+
+IN NO EVENT SHALL REGENTS BE LIABLE TO ANY PARTY FOR DIRECT, INDIRECT, SPECIAL,
+INCIDENTAL, OR CONSEQUENTIAL DAMAGES, INCLUDING LOST PROFITS, ARISING OUT OF
+THE USE OF THIS SOFTWARE AND ITS DOCUMENTATION, EVEN IF REGENTS HAS BEEN ADVISED
+OF THE POSSIBILITY OF SUCH DAMAGE.
+
+REGENTS SPECIFICALLY DISCLAIMS ANY WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE. THE
+SOFTWARE AND ACCOMPANYING DOCUMENTATION, IF ANY, PROVIDED HEREUNDER IS PROVIDED
+"AS IS". REGENTS HAS NO OBLIGATION TO PROVIDE MAINTENANCE, SUPPORT, UPDATES,
+ENHANCEMENTS, OR MODIFICATIONS.
+"""
+
+from collections import defaultdict, namedtuple
+import re
+
+"""Dependency analysis of multi-statement DDL scripts."""
+
+
+DdlStatement = namedtuple('DdlStatement', ['sql', 'writes', 'reads', 'session_bound'])
+
+# Comments and string literals are stripped before names are extracted, so that dotted words inside them
+# ('skip.header.line.count', S3 locations) are not taken for table names.
+_COMMENTS_AND_LITERALS = re.compile(r"/\*.*?\*/|--[^\n]*|'(?:[^']|'')*'", re.DOTALL)
+
+_IDENTIFIER = r'(?:"[^"]+"|[A-Za-z_][\w$]*)'
+_QUALIFIED_NAME = re.compile(rf'({_IDENTIFIER})\s*\.\s*({_IDENTIFIER})')
+
+# Statements that modify a single named table, and where that table's name is found.
+_WRITE_TARGET = re.compile(
+    rf"""^\s*(?:
+        CREATE\s+(?:OR\s+REPLACE\s+)?(?:EXTERNAL\s+)?(?:TABLE|VIEW)(?:\s+IF\s+NOT\s+EXISTS)?
+        |INSERT\s+INTO
+        |DELETE\s+FROM
+        |UPDATE
+        |TRUNCATE(?:\s+TABLE)?
+        |COPY
+        |(?:GRANT|REVOKE)\s.*?\sON(?:\s+TABLE)?
+        |COMMENT\s+ON\s+(?:TABLE|VIEW|COLUMN)
+    )\s+({_IDENTIFIER}\s*\.\s*{_IDENTIFIER})""",
+    re.IGNORECASE | re.VERBOSE | re.DOTALL,
+)
+
+# Dropped tables and views are all written, however many are named.
+_DROP = re.compile(r'^\s*DROP\s+(?:EXTERNAL\s+)?(?:TABLE|VIEW)\s', re.IGNORECASE)
+
+# Transaction control, session settings and temporary tables only work if later statements share a connection.
+_SESSION_BOUND = re.compile(
+    r'^\s*(?:BEGIN|START\s+TRANSACTION|COMMIT|END|ROLLBACK|ABORT|SET|RESET|CREATE\s+(?:LOCAL\s+)?TEMP(?:ORARY)?)\b',
+    re.IGNORECASE,
+)
+
+# Renames create a table whose name is unqualified, so they cannot be analyzed.
+_RENAME = re.compile(r'\bRENAME\b', re.IGNORECASE)
+
+
+def split_ddl_script(sql):
+    statements = sql.split(';')
+    # Remove any trailing debris after the last SQL statement.
+    del statements[-1]
+    return statements
+
+
+def parse_ddl_statement(sql):
+    """Return a DdlStatement with the qualified names of tables that a statement writes and reads.
+
+    A statement that writes no table found by name, such as CREATE SCHEMA or GRANT ... ON ALL TABLES IN SCHEMA,
+    has writes of None and acts as a barrier: it runs after all earlier statements and before all later ones.
+    Unqualified table names are not recognized, so statements writing them are barriers too. Statements such as BEGIN,
+    SET or CREATE TEMP TABLE are flagged session_bound, since any later statement may rely on running in the same session.
+    """
+    stripped = _COMMENTS_AND_LITERALS.sub('', sql)
+    names = {_normalize_name(*m) for m in _QUALIFIED_NAME.findall(stripped)}
+    session_bound = bool(_SESSION_BOUND.match(stripped))
+    if _RENAME.search(stripped) or session_bound:
+        return DdlStatement(sql, None, names, session_bound)
+    if _DROP.match(stripped):
+        return DdlStatement(sql, names or None, set(), False)
+    target = _WRITE_TARGET.match(stripped)
+    if not target:
+        return DdlStatement(sql, None, names, False)
+    writes = {_normalize_name(*_QUALIFIED_NAME.match(target.group(1)).groups())}
+    return DdlStatement(sql, writes, names - writes, False)
+
+
+def ddl_dependencies(statements):
+    """Given parsed DdlStatements in script order, return for each the set of indexes of earlier statements it must follow.
+
+    A statement follows the last earlier statement to write any table it reads or writes, every earlier statement since
+    that write which reads a table it writes, and the last earlier barrier. A barrier follows every earlier statement back
+    to and including the previous barrier.
+    """
+    dependencies = []
+    last_barrier = None
+    since_barrier = []
+    last_writer = {}
+    readers_since_write = defaultdict(list)
+    for index, statement in enumerate(statements):
+        if statement.writes is None:
+            depends_on = set(since_barrier)
+            if last_barrier is not None:
+                depends_on.add(last_barrier)
+            last_barrier = index
+            since_barrier = []
+            last_writer = {}
+            readers_since_write = defaultdict(list)
+        else:
+            depends_on = {last_writer[name] for name in statement.writes | statement.reads if name in last_writer}
+            for name in statement.writes:
+                depends_on.update(readers_since_write.pop(name, []))
+            if last_barrier is not None:
+                depends_on.add(last_barrier)
+            for name in statement.writes:
+                last_writer[name] = index
+            for name in statement.reads:
+                readers_since_write[name].append(index)
+            since_barrier.append(index)
+        dependencies.append(depends_on)
+    return dependencies
+
+
+def _normalize_name(schema, table):
+    return f'{schema.strip(chr(34)).lower()}.{table.strip(chr(34)).lower()}'
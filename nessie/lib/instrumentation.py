@@ -0,0 +1,133 @@
+"""
+Copyright ©2024. The Regents of the University of California (Regents). All Rights Reserved.
+
+Permission to use, copy, modify, and distribute this software and its documentation
+for educational, research, and not-for-profit purposes, without fee and without a
+signed licensing agreement, is hereby granted, provided that the above copyright
+notice, this paragraph and the following two paragraphs appear in all copies,
+modifications, and distributions.
+
+Contact The Office of Technology Licensing, UC Berkeley, 2150 Shattuck Avenue,
+Suite 510, Berkeley, CA 94720-1620, (510) 643-7201, otl@berkeley.edu,
+http://ipira.berkeley.edu/industry-info for commercial licensing opportunities.
+
+IN NO EVENT SHALL REGENTS BE LIABLE TO ANY PARTY FOR DIRECT, INDIRECT, SPECIAL,
+INCIDENTAL, OR CONSEQUENTIAL DAMAGES, INCLUDING LOST PROFITS, ARISING OUT OF
+THE USE OF THIS SOFTWARE AND ITS DOCUMENTATION, EVEN IF REGENTS HAS BEEN ADVISED
+OF THE POSSIBILITY OF SUCH DAMAGE.
+
+REGENTS SPECIFICALLY DISCLAIMS ANY WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE. THE
+SOFTWARE AND ACCOMPANYING DOCUMENTATION, IF ANY, PROVIDED HEREUNDER IS PROVIDED
+"AS IS". REGENTS HAS NO OBLIGATION TO PROVIDE MAINTENANCE, SUPPORT, UPDATES,
+ENHANCEMENTS, OR MODIFICATIONS.
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+import re
+from threading import Lock
+
+"""Per-job registry of query timings and row counts for Redshift and RDS."""
+
+
+# Registries of the jobs running in the current context, innermost last. A chained job's registry also receives the
+# queries of each of its steps.
+_registries = ContextVar('query_registries', default=())
+
+_COMMENTS = re.compile(r'/\*.*?\*/|--[^\n]*', re.DOTALL)
+_STRING_LITERALS = re.compile(r"'(?:[^']|'')*'")
+_NUMBERS = re.compile(r'\b\d+(?:\.\d+)?\b')
+_VALUE_LISTS = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+
+# Length of the fingerprint shown for each query in summaries.
+SUMMARY_FINGERPRINT_LENGTH = 100
+
+
+class QueryStats:
+
+    def __init__(self, client, fingerprint):
+        self.client = client
+        self.fingerprint = fingerprint
+        self.calls = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.rows = 0
+        self.bytes_unloaded = 0
+
+
+class QueryRegistry:
+    """Aggregate query statistics by client and fingerprint. Safe to share between threads."""
+
+    def __init__(self, job_id=None):
+        self.job_id = job_id
+        self.lock = Lock()
+        self.stats = {}
+
+    def record(self, client, fingerprint, seconds, rows=None, bytes_unloaded=None):
+        with self.lock:
+            stats = self.stats.get((client, fingerprint))
+            if not stats:
+                stats = self.stats[(client, fingerprint)] = QueryStats(client, fingerprint)
+            stats.calls += 1
+            stats.total_seconds += seconds
+            stats.max_seconds = max(stats.max_seconds, seconds)
+            stats.rows += rows or 0
+            stats.bytes_unloaded += bytes_unloaded or 0
+
+    def top(self, limit=None):
+        with self.lock:
+            return sorted(self.stats.values(), key=lambda s: -s.total_seconds)[:limit]
+
+    def summary(self, limit=5):
+        top = self.top(limit)
+        if not top:
+            return None
+        with self.lock:
+            calls = sum(s.calls for s in self.stats.values())
+            seconds = sum(s.total_seconds for s in self.stats.values())
+        lines = [f'{calls} queries in {seconds:.1f}s. Top queries by total time:']
+        for s in top:
+            description = f'[{s.client}] {s.calls} calls, {s.total_seconds:.1f}s total, {s.max_seconds:.1f}s max, {s.rows} rows'
+            if s.bytes_unloaded:
+                description += f', {s.bytes_unloaded} bytes unloaded'
+            lines.append(f'{description}: {s.fingerprint[:SUMMARY_FINGERPRINT_LENGTH]}')
+        return '\n'.join(lines)
+
+
+@contextmanager
+def query_instrumentation(job_id=None):
+    """Collect statistics for all queries run in this context, including by threads started with submit_in_context."""
+    registry = QueryRegistry(job_id)
+    token = _registries.set(_registries.get() + (registry,))
+    try:
+        yield registry
+    finally:
+        _registries.reset(token)
+
+
+def current_job_id():
+    """Return the id of the innermost job running in this context, if any."""
+    return next((r.job_id for r in reversed(_registries.get()) if r.job_id), None)
+
+
+def record_query(client, sql, seconds, rows=None, bytes_unloaded=None):
+    registries = _registries.get()
+    if registries:
+        fingerprint = query_fingerprint(sql)
+        for registry in registries:
+            registry.record(client, fingerprint, seconds, rows=rows, bytes_unloaded=bytes_unloaded)
+
+
+def query_fingerprint(sql):
+    """Normalize SQL so that queries differing only in literal values, comments or whitespace share a fingerprint."""
+    sql = _COMMENTS.sub(' ', sql)
+    sql = _STRING_LITERALS.sub('?', sql)
+    sql = _NUMBERS.sub('?', sql)
+    sql = _VALUE_LISTS.sub('(?)', sql)
+    return ' '.join(sql.split())
+
+
+def submit_in_context(executor, fn, *args, **kwargs):
+    # Executor threads do not inherit context variables, so run the task in a copy of the submitting context.
+    return executor.submit(copy_context().run, fn, *args, **kwargs)
@@ -25,23 +25,97 @@ ENHANCEMENTS, OR MODIFICATIONS.
 
 from datetime import datetime
 import os
+from threading import RLock, Timer
 
 from flask import current_app as app
 from nessie.externals import rds, s3
 
 
+class MetadataWriter:
+    """Buffer Canvas sync status and snapshot events in memory and write them to RDS in batches.
+
+    Successive events for the same sync job and file are merged, so that a file's progress from creation to completion
+    usually reaches RDS as a single row. A flush writes all pending events in one transaction: one multi-row upsert for
+    status rows created since the last flush, one multi-row update for the rest, and one multi-row insert of snapshots.
+    """
+
+    def __init__(self):
+        self.lock = RLock()
+        self.canvas_sync_statuses = {}
+        self.canvas_snapshots = []
+        self.event_count = 0
+        self.timer = None
+
+    def add_canvas_sync_status(self, job_id, filename, **columns):
+        with self.lock:
+            status = self.canvas_sync_statuses.setdefault((job_id, filename), {})
+            status.update({k: v for k, v in columns.items() if v is not None})
+            return self._event_added()
+
+    def add_canvas_snapshot(self, filename, canvas_table, url, size):
+        with self.lock:
+            self.canvas_snapshots.append((filename, canvas_table, url, size, datetime.utcnow()))
+            return self._event_added()
+
+    def flush(self):
+        with self.lock:
+            if self.timer:
+                self.timer.cancel()
+                self.timer = None
+            if not self.event_count:
+                return True
+            statuses, snapshots = self.canvas_sync_statuses, self.canvas_snapshots
+            # Hold the lock through the write, so that a later flush cannot overtake this one. Events are cleared only once
+            # committed; after a failed write they stay buffered for the next flush.
+            with rds.transaction() as transaction:
+                if _write_canvas_sync_statuses(transaction, statuses) and _write_canvas_snapshots(transaction, snapshots):
+                    result = transaction.commit()
+                    if result:
+                        self.canvas_sync_statuses, self.canvas_snapshots, self.event_count = {}, [], 0
+                        return result
+                else:
+                    transaction.rollback()
+                app.logger.error(f'Failed to write {len(statuses)} Canvas sync statuses and {len(snapshots)} snapshots to RDS.')
+                return None
+
+    def _event_added(self):
+        self.event_count += 1
+        if self.event_count >= app.config['METADATA_WRITER_BATCH_SIZE']:
+            return self.flush()
+        if not self.timer:
+            self.timer = Timer(app.config['METADATA_WRITER_FLUSH_SECONDS'], self._flush_in_app_context, args=[app._get_current_object()])
+            self.timer.daemon = True
+            self.timer.start()
+        return True
+
+    def _flush_in_app_context(self, app_arg):
+        with app_arg.app_context():
+            self.flush()
+
+
+metadata_writer = MetadataWriter()
+
+
+def flush_metadata_writes():
+    return metadata_writer.flush()
+
+
 def create_canvas_sync_status(job_id, filename, canvas_table, source_url):
-    sql = f"""INSERT INTO {_rds_schema()}.canvas_sync_job_status
-               (job_id, filename, canvas_table, source_url, status, instance_id, created_at, updated_at)
-               VALUES (%s, %s, %s, %s, 'created', %s, current_timestamp, current_timestamp)
-               """
-    return rds.execute(
-        sql,
-        params=(job_id, filename, canvas_table, source_url, _instance_id()),
+    now = datetime.utcnow()
+    return metadata_writer.add_canvas_sync_status(
+        job_id,
+        filename,
+        canvas_table=canvas_table,
+        source_url=source_url,
+        status='created',
+        instance_id=_instance_id(),
+        created_at=now,
+        updated_at=now,
     )
 
 
 def get_failures_from_last_sync():
+    flush_metadata_writes()
     last_job_id = None
     failures = []
 
@@ -61,37 +135,26 @@ def get_failures_from_last_sync():
 
 def update_canvas_sync_status(job_id, key, status, **kwargs):
     filename = key.split('/')[-1]
-    destination_url = s3.build_s3_url(key)
-
-    sql = f"""UPDATE {_rds_schema()}.canvas_sync_job_status
-             SET destination_url=%s, status=%s, updated_at=current_timestamp"""
-    params = [destination_url, status]
-    for key in ['details', 'source_size', 'destination_size']:
+    columns = {
+        'destination_url': s3.build_s3_url(key),
+        'status': status,
+        'updated_at': datetime.utcnow(),
+    }
+    if kwargs.get('details'):
+        columns['details'] = kwargs['details']
+    for key in ['source_size', 'destination_size']:
         if kwargs.get(key):
-            sql += f', {key}=%s'
-            params.append(kwargs[key])
-    sql += ' WHERE job_id=%s AND filename=%s'
-    params += [job_id, filename]
-
-    return rds.execute(
-        sql,
-        params=tuple(params),
-    )
+            columns[key] = int(kwargs[key])
+    return metadata_writer.add_canvas_sync_status(job_id, filename, **columns)
 
 
 def create_canvas_snapshot(key, size):
     canvas_table, filename = key.split('/')[-2:]
-    url = s3.build_s3_url(key)
-    sql = f"""INSERT INTO {_rds_schema()}.canvas_synced_snapshots
-             (filename, canvas_table, url, size, created_at)
-             VALUES (%s, %s, %s, %s, current_timestamp)"""
-    return rds.execute(
-        sql,
-        params=(filename, canvas_table, url, size),
-    )
+    return metadata_writer.add_canvas_snapshot(filename, canvas_table, s3.build_s3_url(key), size)
 
 
 def delete_canvas_snapshots(keys):
+    flush_metadata_writes()
     filenames = [key.split('/')[-1] for key in keys]
     sql = f'UPDATE {_rds_schema()}.canvas_synced_snapshots SET deleted_at=current_timestamp WHERE filename IN %s'
     return rds.execute(sql, params=[tuple(filenames)])
@@ -121,6 +184,7 @@ def most_recent_background_job_status(job_id_prefix, status=None):
 
 
 def create_background_job_status(job_id):
+    flush_metadata_writes()
     sql = f"""INSERT INTO {_rds_schema()}.background_job_status
                (job_id, status, instance_id, created_at, updated_at)
                VALUES (%s, 'started', %s, current_timestamp, current_timestamp)
@@ -132,6 +196,7 @@ def create_background_job_status(job_id):
 
 
 def update_background_job_status(job_id, status, details=None):
+    flush_metadata_writes()
     if details:
         details = details[:4096]
     sql = f"""UPDATE {_rds_schema()}.background_job_status
@@ -143,6 +208,67 @@ def update_background_job_status(job_id, status, details=None):
     )
 
 
+def get_canvas_analytics_fingerprints(term_id):
+    rows = rds.fetch(
+        f'SELECT canvas_course_id, fingerprint FROM {_rds_schema()}.canvas_analytics_fingerprints WHERE term_id = %s',
+        params=(term_id, ),
+    )
+    return {r['canvas_course_id']: r['fingerprint'] for r in (rows or [])}
+
+
+def update_canvas_analytics_fingerprints(term_id, fingerprints, deleted_course_ids):
+    rds.execute(
+        f'DELETE FROM {_rds_schema()}.canvas_analytics_fingerprints WHERE term_id = %s AND canvas_course_id = ANY(%s)',
+        params=(term_id, list(fingerprints.keys()) + deleted_course_ids),
+    )
+    if not fingerprints:
+        return
+    now = datetime.utcnow().isoformat()
+    rows = [tuple([term_id, canvas_course_id, fingerprint, now]) for canvas_course_id, fingerprint in fingerprints.items()]
+    with rds.transaction() as transaction:
+        result = transaction.insert_bulk(
+            f"""INSERT INTO {_rds_schema()}.canvas_analytics_fingerprints
+                (term_id, canvas_course_id, fingerprint, updated_at)
+                VALUES %s
+            """,
+            rows,
+        )
+        if result:
+            transaction.commit()
+        else:
+            transaction.rollback()
+            app.logger.error('Error saving Canvas analytics fingerprints to RDS.')
+
+
+def get_merged_profile_digests():
+    rows = rds.fetch(f'SELECT sid, digest FROM {_rds_schema()}.merged_profile_digests')
+    return {r['sid']: r['digest'] for r in (rows or [])}
+
+
+def update_merged_profile_digests(digests, deleted_sids):
+    rds.execute(
+        f'DELETE FROM {_rds_schema()}.merged_profile_digests WHERE sid = ANY(%s)',
+        params=(list(digests.keys()) + deleted_sids, ),
+    )
+    if not digests:
+        return
+    now = datetime.utcnow().isoformat()
+    rows = [tuple([sid, digest, now]) for sid, digest in digests.items()]
+    with rds.transaction() as transaction:
+        result = transaction.insert_bulk(
+            f"""INSERT INTO {_rds_schema()}.merged_profile_digests
+                (sid, digest, updated_at)
+                VALUES %s
+            """,
+            rows,
+        )
+        if result:
+            transaction.commit()
+        else:
+            transaction.rollback()
+            app.logger.error('Error saving merged profile digests to RDS.')
+
+
 def update_registration_import_status(successes, failures):
     rds.execute(
         f'DELETE FROM {_rds_schema()}.registration_import_status WHERE sid = ANY(%s)',
@@ -192,6 +318,57 @@ def update_photo_import_status(successes, failures, photo_not_found):
             app.logger.error('Error saving photo import status updates to RDS.')
 
 
+def _write_canvas_sync_statuses(transaction, statuses):
+    # Rows created since the last flush are upserted whole; others exist already and need only their changed columns.
+    created = [(*key, *[s.get(c) for c in _CANVAS_SYNC_STATUS_COLUMNS]) for key, s in statuses.items() if 'created_at' in s]
+    updated = [(*key, *[s.get(c) for c in _CANVAS_SYNC_STATUS_UPDATE_COLUMNS]) for key, s in statuses.items() if 'created_at' not in s]
+    if created:
+        result = transaction.insert_bulk(
+            f"""INSERT INTO {_rds_schema()}.canvas_sync_job_status
+                (job_id, filename, {', '.join(_CANVAS_SYNC_STATUS_COLUMNS)})
+                VALUES %s
+                ON CONFLICT (job_id, filename) DO UPDATE SET
+                {', '.join(f'{c}=EXCLUDED.{c}' for c in _CANVAS_SYNC_STATUS_COLUMNS)}
+            """,
+            created,
+        )
+        if not result:
+            return False
+    if updated:
+        result = transaction.insert_bulk(
+            f"""UPDATE {_rds_schema()}.canvas_sync_job_status t SET
+                destination_url=COALESCE(v.destination_url, t.destination_url),
+                status=v.status,
+                details=COALESCE(v.details, t.details),
+                source_size=COALESCE(v.source_size::BIGINT, t.source_size),
+                destination_size=COALESCE(v.destination_size::BIGINT, t.destination_size),
+                updated_at=v.updated_at::TIMESTAMP
+                FROM (VALUES %s) AS v (job_id, filename, {', '.join(_CANVAS_SYNC_STATUS_UPDATE_COLUMNS)})
+                WHERE t.job_id = v.job_id AND t.filename = v.filename
+            """,
+            updated,
+        )
+        if not result:
+            return False
+    return True
+
+
+def _write_canvas_snapshots(transaction, snapshots):
+    if not snapshots:
+        return True
+    return transaction.insert_bulk(
+        f'INSERT INTO {_rds_schema()}.canvas_synced_snapshots (filename, canvas_table, url, size, created_at) VALUES %s',
+        snapshots,
+    )
+
+
+_CANVAS_SYNC_STATUS_COLUMNS = [
+    'canvas_table', 'source_url', 'source_size', 'destination_url', 'destination_size', 'status', 'details', 'instance_id',
+    'created_at', 'updated_at',
+]
+_CANVAS_SYNC_STATUS_UPDATE_COLUMNS = ['destination_url', 'status', 'details', 'source_size', 'destination_size', 'updated_at']
+
+
 def _instance_id():
     return os.environ.get('EC2_INSTANCE_ID')
 
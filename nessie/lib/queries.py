@@ -27,6 +27,7 @@ from flask import current_app as app
 from nessie.externals import rds, redshift
 from nessie.lib.berkeley import term_name_for_sis_id
 from nessie.lib.mockingdata import fixture
+from nessie.lib.util import to_float
 
 
 def advisor_schema():
@@ -118,11 +119,11 @@ def get_advisee_advisor_mappings():
           ON advs.advisor_sid = aa.csid
         ORDER BY advs.student_sid, advs.advisor_type, advs.academic_plan, aa.first_name, aa.last_name
         """
-    return redshift.fetch(sql)
+    return redshift.fetch_iter(sql)
 
 
 @fixture('query_all_student_profile_feeds.csv')
-def get_all_student_profile_elements():
+def stream_all_student_profile_elements():
     sql = f"""SELECT DISTINCT attrs.sid, attrs.ldap_uid,
             us.canvas_id AS canvas_user_id, us.name AS canvas_user_name,
             sis.feed AS sis_profile_feed,
@@ -167,7 +168,7 @@ def get_all_student_profile_elements():
             ON reg.sid = attrs.sid
         ORDER BY attrs.sid
         """
-    return redshift.fetch(sql)
+    return redshift.fetch(sql, stream_s3=True, unload_path='student_profile_elements')
 
 
 def get_sids_with_photos():
@@ -296,36 +297,52 @@ def stream_edl_holds():
 
 
 def stream_edl_plans():
-    sql = f"""SELECT
-        DISTINCT sapd.student_id AS sid,
-        attrs.affiliations AS ldap_affiliations,
-        sapd.academic_career_cd,
-        sapd.academic_plan_type_cd,
-        sapd.academic_plan_nm,
-        sapd.academic_program_cd,
-        sapd.academic_program_effective_dt,
-        sapd.academic_program_nm,
-        sapd.academic_program_shrt_nm,
-        sapd.academic_program_status_desc,
-        sapd.academic_subplan_nm,
-        sapd.current_admit_term,
-        sapd.degree_expected_year_term_cd,
-        sapd.transfer_student,
-        sapd.matriculation_term_cd
+    # Plans are distinct on the selected columns, as before career_program_sequence_nbr was selected; each plan carries its
+    # lowest sequence number so that merged unload parts can be put in the same order.
+    sql = f"""SELECT * FROM (
+        SELECT
+          sapd.student_id AS sid,
+          attrs.affiliations AS ldap_affiliations,
+          sapd.academic_career_cd,
+          sapd.academic_plan_type_cd,
+          sapd.academic_plan_nm,
+          sapd.academic_program_cd,
+          sapd.academic_program_effective_dt,
+          sapd.academic_program_nm,
+          sapd.academic_program_shrt_nm,
+          sapd.academic_program_status_desc,
+          sapd.academic_subplan_nm,
+          sapd.current_admit_term,
+          sapd.degree_expected_year_term_cd,
+          sapd.transfer_student,
+          sapd.matriculation_term_cd,
+          MIN(sapd.career_program_sequence_nbr) AS career_program_sequence_nbr
         FROM {edl_external_schema()}.student_academic_plan_data sapd
         LEFT OUTER JOIN {edl_schema()}.basic_attributes attrs
           ON sapd.student_id = attrs.sid
+        GROUP BY
+          sapd.student_id, attrs.affiliations, sapd.academic_career_cd, sapd.academic_plan_type_cd, sapd.academic_plan_nm,
+          sapd.academic_program_cd, sapd.academic_program_effective_dt, sapd.academic_program_nm, sapd.academic_program_shrt_nm,
+          sapd.academic_program_status_desc, sapd.academic_subplan_nm, sapd.current_admit_term, sapd.degree_expected_year_term_cd,
+          sapd.transfer_student, sapd.matriculation_term_cd
+        ) plans
         ORDER BY
-          sapd.student_id,
-          CASE sapd.academic_career_cd
+          sid,
+          CASE academic_career_cd
             WHEN 'UGRD' THEN 1
             WHEN 'GRAD' THEN 2
             WHEN 'UCBX' THEN 3
             ELSE 4
           END,
-          sapd.career_program_sequence_nbr,
-          sapd.academic_program_cd"""
-    return redshift.fetch(sql, stream_s3=True, unload_path='edl_plans')
+          career_program_sequence_nbr,
+          academic_program_cd"""
+    sort_key = redshift.unload_sort_key(
+        'sid',
+        redshift.SortColumn('academic_career_cd', convert=lambda c: {'UGRD': 1, 'GRAD': 2, 'UCBX': 3}.get(c, 4)),
+        redshift.SortColumn('career_program_sequence_nbr', convert=to_float),
+        'academic_program_cd',
+    )
+    return redshift.fetch(sql, stream_s3=True, unload_path='edl_plans', unload_sort_key=sort_key)
 
 
 def stream_edl_profiles():
@@ -446,8 +463,16 @@ def get_enrolled_primary_sections(term_id=None):
     return redshift.fetch(sql)
 
 
+def get_enrollment_term_ids():
+    sql = f"""SELECT sis_term_id FROM {intermediate_schema()}.sis_enrollments
+              UNION
+              SELECT sis_term_id FROM {intermediate_schema()}.sis_dropped_classes
+              ORDER BY sis_term_id DESC"""
+    return [str(r['sis_term_id']) for r in (redshift.fetch(sql) or [])]
+
+
 @fixture('query_advisee_sis_enrollments.csv')
-def stream_sis_enrollments(sids=None):
+def stream_sis_enrollments(sids=None, term_id=None):
     sql = f"""SELECT
                 enr.grade,
                 enr.grade_midterm,
@@ -482,7 +507,7 @@ def stream_sis_enrollments(sids=None):
                   ON s.sis_term_id = enr.sis_term_id AND s.sis_section_id = enr.sis_section_id
               LEFT JOIN {edl_external_schema()}.student_registration_term_data r
                   ON enr.sis_term_id = r.semester_year_term_cd AND enr.sid = r.student_id
-              {'WHERE enr.sid = ANY(%s)' if sids else ''}
+              {_filter_by_sids_and_term('enr.sid', sids, 'enr.sis_term_id', term_id)}
               UNION
               SELECT
                 dr.grade,
@@ -522,29 +547,57 @@ def stream_sis_enrollments(sids=None):
                 ON dr.ldap_uid = e.ldap_uid
                 AND dr.sis_term_id = e.term_id
                 AND dr.sis_section_id = e.section_id
-              {'WHERE dr.sid = ANY(%s)' if sids else ''}
+              {_filter_by_sids_and_term('dr.sid', sids, 'dr.sis_term_id', term_id)}
               ORDER BY sis_term_id DESC, sid, dropped NULLS FIRST, sis_course_name, sis_primary DESC, sis_instruction_format, sis_section_num
         """
     params = (sids, sids) if sids else None
-    return redshift.fetch(sql, params=params, stream_s3=True, unload_path='sis_enrollments')
-
-
-def stream_term_gpas(sids=None):
-    if sids:
-        sid_filter = 'WHERE gp.sid = ANY(%s)'
-    else:
-        sid_filter = ''
+    sort_key = redshift.unload_sort_key(
+        redshift.SortColumn('sis_term_id', descending=True),
+        'sid',
+        redshift.SortColumn('dropped', nulls_first=True),
+        'sis_course_name',
+        redshift.SortColumn('sis_primary', descending=True),
+        'sis_instruction_format',
+        'sis_section_num',
+    )
+    return redshift.fetch(
+        sql,
+        params=params,
+        stream_s3=True,
+        unload_path=_unload_path_for_term('sis_enrollments', term_id),
+        unload_sort_key=sort_key,
+    )
+
+
+def stream_term_gpas(sids=None, term_id=None):
     sql = f"""SELECT gp.sid, gp.term_id, gp.gpa, gp.units_taken_for_gpa
               FROM {edl_schema()}.term_gpa gp
-              {sid_filter}
+              {_filter_by_sids_and_term('gp.sid', sids, 'gp.term_id', term_id)}
               ORDER BY gp.term_id DESC, gp.sid, CASE gp.career WHEN 'UGRD' THEN 1 ELSE 0 END
         """
     params = (sids,) if sids else None
-    return redshift.fetch(sql, params=params, stream_s3=True, unload_path='term_gpas')
+    return redshift.fetch(sql, params=params, stream_s3=True, unload_path=_unload_path_for_term('term_gpas', term_id))
 
 
-def stream_canvas_memberships():
+def stream_canvas_memberships(term_id=None):
     sql = f"""SELECT term_id, sid, sis_section_ids, feed
         FROM {student_schema()}.student_canvas_site_memberships
+        {_filter_by_sids_and_term(None, None, 'term_id', term_id)}
         ORDER BY term_id DESC, sid"""
-    return redshift.fetch(sql, stream_s3=True, unload_path='canvas_memberships')
+    return redshift.fetch(sql, stream_s3=True, unload_path=_unload_path_for_term('canvas_memberships', term_id))
+
+
+def _filter_by_sids_and_term(sid_column, sids, term_id_column, term_id):
+    conditions = []
+    if sids:
+        conditions.append(f'{sid_column} = ANY(%s)')
+    # The term id is written into the SQL as a literal, rather than passed as a parameter, so that it survives the quote
+    # escaping applied to UNLOAD statements.
+    if term_id:
+        conditions.append(f"{term_id_column} = '{int(term_id)}'")
+    return f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+
+def _unload_path_for_term(unload_path, term_id):
+    # Per-term unloads get their own S3 prefix, so that concurrent unloads do not overwrite one another.
+    return f'{unload_path}_{term_id}' if term_id else unload_path
@@ -0,0 +1,64 @@
+"""
+Copyright ©2024. The Regents of the University of California (Regents). All Rights Reserved.
+
+Permission to use, copy, modify, and distribute this software and its documentation
+for educational, research, and not-for-profit purposes, without fee and without a
+signed licensing agreement, is hereby granted, provided that the above copyright
+notice, this paragraph and the following two paragraphs appear in all copies,
+modifications, and distributions.
+
+Contact The Office of Technology Licensing, UC Berkeley, 2150 Shattuck Avenue,
+Suite 510, Berkeley, CA 94720-1620, (510) 643-7201, otl@berkeley.edu,
+http://ipira.berkeley.edu/industry-info for commercial licensing opportunities.
+
+IN NO EVENT SHALL REGENTS BE LIABLE TO ANY PARTY FOR DIRECT, INDIRECT, SPECIAL,
+INCIDENTAL, OR CONSEQUENTIAL DAMAGES, INCLUDING LOST PROFITS, ARISING OUT OF
+THE USE OF THIS SOFTWARE AND ITS DOCUMENTATION, EVEN IF REGENTS HAS BEEN ADVISED
+OF THE POSSIBILITY OF SUCH DAMAGE.
+
+REGENTS SPECIFICALLY DISCLAIMS ANY WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE. THE
+SOFTWARE AND ACCOMPANYING DOCUMENTATION, IF ANY, PROVIDED HEREUNDER IS PROVIDED
+"AS IS". REGENTS HAS NO OBLIGATION TO PROVIDE MAINTENANCE, SUPPORT, UPDATES,
+ENHANCEMENTS, OR MODIFICATIONS.
+"""
+
+import numpy
+
+
+class SortedColumn:
+    """A column of numbers, sorted once, answering percentile and quantile queries by binary search.
+
+    Results match scipy.stats.percentileofscore and pandas Series.quantile, which re-sort the column on every call. Values
+    must not include NaN.
+    """
+
+    def __init__(self, values):
+        self.values = numpy.sort(numpy.asarray(values, dtype=float))
+
+    def __len__(self):
+        return len(self.values)
+
+    def percentile_of_score(self, scores, kind='weak'):
+        """Return the percentile rank of a score or array of scores, as scipy.stats.percentileofscore would.
+
+        A 'weak' percentile counts values less than or equal to the score; a 'strict' percentile counts only lesser values.
+        """
+        if kind == 'weak':
+            side = 'right'
+        elif kind == 'strict':
+            side = 'left'
+        else:
+            raise ValueError(f'Unsupported percentile kind: {kind}')
+        if not len(self.values):
+            return numpy.full(numpy.shape(scores), numpy.nan)[()]
+        return numpy.searchsorted(self.values, scores, side=side) * (100.0 / len(self.values))
+
+    def quantiles(self, count):
+        """Return count + 1 evenly spaced quantiles, as pandas Series.quantile would with linear interpolation."""
+        # Pandas hands quantiles to NumPy as percentages; the same float arithmetic keeps results identical.
+        return numpy.percentile(self.values, [n / count * 100.0 for n in range(0, count + 1)])
+
+    def rank_pct(self, scores):
+        """Return the share of values less than or equal to each score, as pandas rank(pct=True, method='max') would."""
+        return numpy.searchsorted(self.values, scores, side='right') / len(self.values)
@@ -23,9 +23,13 @@ SOFTWARE AND ACCOMPANYING DOCUMENTATION, IF ANY, PROVIDED HEREUNDER IS PROVIDED
 ENHANCEMENTS, OR MODIFICATIONS.
 """
 
+from concurrent.futures import ProcessPoolExecutor
 from datetime import date, datetime, timedelta
+from functools import lru_cache
 import hashlib
 import inspect
+import json
+import multiprocessing
 import re
 
 from dateutil.rrule import DAILY, rrule
@@ -33,16 +37,35 @@ from flask import current_app as app
 from nessie.lib.berkeley import earliest_term_id
 import pytz
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 """Generic utilities."""
 
+# App object inherited by forked worker processes; see process_pool_executor.
+_forked_app = None
+
 
 def encoded_tsv_row(elements):
-    def _to_tsv_string(e):
+    def _to_tsv_bytes(e):
         if e is None:
-            return ''
+            return b''
+        elif isinstance(e, bytes):
+            return e
         else:
-            return str(e)
-    return '\t'.join([_to_tsv_string(e) for e in elements]).encode()
+            return str(e).encode()
+    return b'\t'.join([_to_tsv_bytes(e) for e in elements])
+
+
+def json_dumpb(obj):
+    """Serialize to JSON bytes with the configured backend, for inclusion in TSV feed rows."""
+    if orjson and app.config['JSON_SERIALIZER'] == 'orjson':
+        # Analytics feeds carry NumPy floats, which the standard library serializes as plain floats.
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+    else:
+        return json.dumps(obj).encode()
 
 
 def write_to_tsv_file(f, elements):
@@ -193,6 +216,21 @@ def get_s3_ycbm_daily_path(cutoff=None):
     return app.config['LOCH_S3_YCBM_DATA_PATH'] + '/daily/' + hashed_datestamp(cutoff)
 
 
+def process_pool_executor(max_workers):
+    """Return a pool of forked worker processes, each running inside a copy of the current app context."""
+    global _forked_app
+    _forked_app = app._get_current_object()
+    return ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=multiprocessing.get_context('fork'),
+        initializer=_push_forked_app_context,
+    )
+
+
+def _push_forked_app_context():
+    _forked_app.app_context().push()
+
+
 def resolve_sql_template_string(template_string, **kwargs):
     """Our DDL template files are simple enough to use standard Python string formatting."""
     s3_prefix = 's3://' + app.config['LOCH_S3_BUCKET'] + '/'
@@ -293,6 +331,38 @@ def resolve_sql_template(sql_filename, **kwargs):
     return resolve_sql_template_string(template_string, **kwargs)
 
 
+@lru_cache(maxsize=None)
+def row_type(columns):
+    """Return a tuple subclass for rows with the given column names, supporting lookup by name like a dict row."""
+    column_index = {column: i for i, column in enumerate(columns)}
+
+    class Row(tuple):
+        """A row tuple that also supports lookup by column name."""
+
+        __slots__ = ()
+
+        def __getitem__(self, key):
+            if isinstance(key, str):
+                key = column_index[key]
+            return tuple.__getitem__(self, key)
+
+        def __reduce__(self):
+            # Row classes are built on the fly, so pickle by column names rather than by class.
+            return _make_row, (columns, tuple(self))
+
+        def get(self, key, default=None):
+            return self[key] if key in column_index else default
+
+        def keys(self):
+            return columns
+
+    return Row
+
+
+def _make_row(columns, values):
+    return row_type(columns)(values)
+
+
 def to_boolean(s):
     try:
         if isinstance(s, str):
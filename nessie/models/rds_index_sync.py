@@ -0,0 +1,98 @@
+"""
+Copyright ©2024. The Regents of the University of California (Regents). All Rights Reserved.
+
+Permission to use, copy, modify, and distribute this software and its documentation
+for educational, research, and not-for-profit purposes, without fee and without a
+signed licensing agreement, is hereby granted, provided that the above copyright
+notice, this paragraph and the following two paragraphs appear in all copies,
+modifications, and distributions.
+
+Contact The Office of Technology Licensing, UC Berkeley, 2150 Shattuck Avenue,
+Suite 510, Berkeley, CA 94720-1620, (510) 643-7201, otl@berkeley.edu,
+http://ipira.berkeley.edu/industry-info for commercial licensing opportunities.
+
+IN NO EVENT SHALL REGENTS BE LIABLE TO ANY PARTY FOR DIRECT, INDIRECT, SPECIAL,
+INCIDENTAL, OR CONSEQUENTIAL DAMAGES, INCLUDING LOST PROFITS, ARISING OUT OF
+THE USE OF THIS SOFTWARE AND ITS DOCUMENTATION, EVEN IF REGENTS HAS BEEN ADVISED
+OF THE POSSIBILITY OF SUCH DAMAGE.
+
+REGENTS SPECIFICALLY DISCLAIMS ANY WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE. THE
+SOFTWARE AND ACCOMPANYING DOCUMENTATION, IF ANY, PROVIDED HEREUNDER IS PROVIDED
+"AS IS". REGENTS HAS NO OBLIGATION TO PROVIDE MAINTENANCE, SUPPORT, UPDATES,
+ENHANCEMENTS, OR MODIFICATIONS.
+"""
+
+import re
+import time
+
+from flask import current_app as app
+from nessie.externals import rds
+from nessie.jobs.background_job import BackgroundJobError
+
+"""Differential refresh of RDS index tables keyed by SID."""
+
+
+def differential_sync_enabled():
+    return app.config['RDS_INDEX_SYNC_MODE'] == 'differential'
+
+
+def strip_transaction_control(sql):
+    # Staging and sync run in a single transaction of their own; a template's BEGIN and COMMIT would end it early.
+    return re.sub(r'^\s*(BEGIN|COMMIT) TRANSACTION;\s*$', '', sql, flags=re.MULTILINE)
+
+
+def sync_rds_tables(schema, tables, stage_rows):
+    """Refresh RDS tables keyed by SID, rewriting only the rows of SIDs whose content has changed.
+
+    The stage_rows function is passed the open transaction and must fill temporary tables, shaped and named like the target
+    tables, with their complete refreshed contents, returning a falsy value on failure. Per-SID digests of staged and
+    current rows are then compared, and rows are deleted and reinserted for changed SIDs only. Target tables are locked
+    only from the first of those writes until commit; that lock window is logged and returned in a summary.
+    """
+    with rds.transaction() as transaction:
+        def _rollback(message):
+            transaction.rollback()
+            raise BackgroundJobError(message)
+
+        for table in tables:
+            if not transaction.execute(f'CREATE TEMPORARY TABLE {table} (LIKE {schema}.{table} INCLUDING ALL) ON COMMIT DROP'):
+                _rollback(f'Failed to create staging table for {schema}.{table}.')
+        if not stage_rows(transaction):
+            _rollback(f'Failed to stage rows for RDS tables in {schema}.')
+
+        changed_sids = {}
+        for table in tables:
+            rows = transaction.fetch(_changed_sids_sql(schema, table))
+            if rows is None:
+                _rollback(f'Failed to compare staged rows with {schema}.{table}.')
+            changed_sids[table] = [r['sid'] for r in rows]
+
+        lock_start = time.monotonic()
+        for table, sids in changed_sids.items():
+            if not sids:
+                continue
+            if not transaction.execute(f'DELETE FROM {schema}.{table} WHERE sid = ANY(%s)', params=(sids,)):
+                _rollback(f'Failed to delete changed rows from {schema}.{table}.')
+            if not transaction.execute(f'INSERT INTO {schema}.{table} SELECT * FROM pg_temp.{table} WHERE sid = ANY(%s)', params=(sids,)):
+                _rollback(f'Failed to insert changed rows into {schema}.{table}.')
+        if not transaction.commit():
+            raise BackgroundJobError(f'Failed to commit RDS sync of {schema}.')
+        lock_window = time.monotonic() - lock_start
+
+    table_summaries = [f'{table} {len(sids)}' for table, sids in changed_sids.items()]
+    summary = f"Synced RDS tables in {schema} with a {lock_window:.2f}s lock window; changed SIDs per table: {', '.join(table_summaries)}."
+    app.logger.info(summary)
+    return summary
+
+
+def _changed_sids_sql(schema, table):
+    # Digest each SID's rows, in a stable order, on both sides. SIDs present on one side only count as changed.
+    def _digests(source):
+        return f"""SELECT sid, md5(string_agg(r::text, E'\\n' ORDER BY r::text)) AS digest
+            FROM {source} r GROUP BY sid"""
+    return f"""SELECT COALESCE(staged.sid, existing.sid) AS sid
+        FROM ({_digests(f'pg_temp.{table}')}) staged
+        FULL OUTER JOIN ({_digests(f'{schema}.{table}')}) existing
+        ON staged.sid = existing.sid
+        WHERE staged.digest IS DISTINCT FROM existing.digest"""
@@ -37,20 +37,36 @@ def staging_schema():
     return f'{student_schema()}_staging'
 
 
-def refresh_all_from_staging(tables):
+def refresh_all_from_staging(tables, sids_table=None):
     with redshift.transaction() as transaction:
         for table in tables:
-            refresh_from_staging(table, None, transaction)
+            refresh_from_staging(table, None, transaction, sids_table=sids_table)
+        if sids_table:
+            transaction.execute(
+                'TRUNCATE {schema}.{table}',
+                schema=psycopg2.sql.Identifier(staging_schema()),
+                table=psycopg2.sql.Identifier(sids_table),
+            )
         if not transaction.commit():
             raise BackgroundJobError(f'Final transaction commit failed for {student_schema()}.')
 
 
-def refresh_from_staging(table, term_id, transaction):
+def refresh_from_staging(table, term_id, transaction, sids_table=None, course_ids_table=None):
     # If our job is restricted to a particular term id, delete rows from the destination table for that term only.
     refresh_conditions = []
     refresh_params = []
+    # If a staging table of SIDs is specified, replace destination rows for exactly those SIDs, including any whose
+    # refreshed rows are now absent from staging.
+    if sids_table:
+        refresh_conditions.append('sid IN (SELECT sid FROM {staging_schema}.{sids_table})')
+    # Likewise, a staging table of Canvas course ids selects the Canvas site membership rows to be replaced, by the course
+    # id in each row's feed.
+    elif course_ids_table:
+        refresh_conditions.append(
+            "JSON_EXTRACT_PATH_TEXT(feed, 'canvasCourseId') IN (SELECT canvas_course_id FROM {staging_schema}.{course_ids_table})",
+        )
     # Rows in these tables need to be aggressively cleared from the destination schema so that obsolete entries don't linger.
-    if table in (
+    elif table in (
         'intended_majors',
         'minors',
         'student_canvas_site_memberships',
@@ -80,6 +96,8 @@ def refresh_from_staging(table, term_id, transaction):
         schema=psycopg2.sql.Identifier(student_schema()),
         staging_schema=psycopg2.sql.Identifier(staging_schema()),
         table=psycopg2.sql.Identifier(table),
+        sids_table=psycopg2.sql.Identifier(sids_table or ''),
+        course_ids_table=psycopg2.sql.Identifier(course_ids_table or ''),
         params=tuple(refresh_params),
     )
     app.logger.info(f"Deleted existing rows from destination table {student_schema()}.{table} term_id={term_id or 'all'}.")
@@ -90,6 +108,8 @@ def refresh_from_staging(table, term_id, transaction):
         schema=psycopg2.sql.Identifier(student_schema()),
         staging_schema=psycopg2.sql.Identifier(staging_schema()),
         table=psycopg2.sql.Identifier(table),
+        sids_table=psycopg2.sql.Identifier(sids_table or ''),
+        course_ids_table=psycopg2.sql.Identifier(course_ids_table or ''),
         params=tuple(refresh_params),
     ) else _rollback()
 
@@ -134,6 +154,34 @@ def upload_file_to_staging(table, term_file, row_count, term_id):
         raise BackgroundJobError('Error on Redshift copy: aborting job.')
 
 
+def upload_gzip_parts_to_staging(table, term_file, row_count, term_id, part_count):
+    tsv_filename = f'staging_{table}_{term_id}.tsv' if term_id else f'staging_{table}.tsv'
+    s3_key_prefix = f'{get_s3_sis_api_daily_path()}/{tsv_filename}'
+    app.logger.info(f'Will stash {row_count} feeds in S3 as {part_count} gzipped parts: {s3_key_prefix}')
+    s3_keys = s3.upload_gzip_parts(term_file, s3_key_prefix, part_count)
+    manifest_key = f'{s3_key_prefix}.manifest'
+    if not s3_keys or not s3.upload_manifest(s3_keys, manifest_key):
+        raise BackgroundJobError(f'Failed upload {row_count} records to s3:{s3_key_prefix}. Aborting job.')
+
+    app.logger.info(f'Will copy {len(s3_keys)} S3 feed files into Redshift...')
+    if not redshift.copy_tsv_from_s3_manifest(f'{staging_schema()}.{table}', manifest_key, gzip=True):
+        raise BackgroundJobError('Error on Redshift copy: aborting job.')
+
+
+def upload_gzip_files_to_staging(table, term_files, row_count, term_id):
+    tsv_filename = f'staging_{table}_{term_id}.tsv' if term_id else f'staging_{table}.tsv'
+    s3_key_prefix = f'{get_s3_sis_api_daily_path()}/{tsv_filename}'
+    app.logger.info(f'Will stash {row_count} feeds in S3 as {len(term_files)} gzipped parts: {s3_key_prefix}')
+    s3_keys = s3.upload_gzip_files(term_files, s3_key_prefix)
+    manifest_key = f'{s3_key_prefix}.manifest'
+    if not s3_keys or not s3.upload_manifest(s3_keys, manifest_key):
+        raise BackgroundJobError(f'Failed upload {row_count} records to s3:{s3_key_prefix}. Aborting job.')
+
+    app.logger.info(f'Will copy {len(s3_keys)} S3 feed files into Redshift...')
+    if not redshift.copy_tsv_from_s3_manifest(f'{staging_schema()}.{table}', manifest_key, gzip=True):
+        raise BackgroundJobError('Error on Redshift copy: aborting job.')
+
+
 def verify_table(table):
     result = redshift.fetch(
         'SELECT COUNT(*) FROM {schema}.{table}',
@@ -148,6 +196,17 @@ def verify_table(table):
 
 
 def write_file_to_staging(table, term_file, row_count, term_id=None):
-    upload_file_to_staging(table, term_file, row_count, term_id)
+    part_count = app.config['REDSHIFT_COPY_GZIP_PARTS']
+    if part_count:
+        upload_gzip_parts_to_staging(table, term_file, row_count, term_id, part_count)
+    else:
+        upload_file_to_staging(table, term_file, row_count, term_id)
+    verify_table(table)
+    return True
+
+
+def write_files_to_staging(table, term_files, row_count, term_id=None):
+    # Feed files written in parallel are each uploaded as a gzipped part and loaded with a single manifest COPY.
+    upload_gzip_files_to_staging(table, term_files, row_count, term_id)
     verify_table(table)
     return True
@@ -121,3 +121,20 @@ CREATE TABLE IF NOT EXISTS {rds_schema_metadata}.photo_import_status
     updated_at TIMESTAMP NOT NULL
 );
 
+CREATE TABLE IF NOT EXISTS {rds_schema_metadata}.canvas_analytics_fingerprints
+(
+    term_id VARCHAR(4) NOT NULL,
+    canvas_course_id VARCHAR NOT NULL,
+    -- MD5 digest of the enrollments, scores, activity and submissions from which the course's analytics were last generated.
+    fingerprint VARCHAR NOT NULL,
+    updated_at TIMESTAMP NOT NULL,
+    PRIMARY KEY (term_id, canvas_course_id)
+);
+
+CREATE TABLE IF NOT EXISTS {rds_schema_metadata}.merged_profile_digests
+(
+    sid VARCHAR NOT NULL PRIMARY KEY,
+    -- MD5 digest of the source feed elements from which the student's merged profile was last generated.
+    digest VARCHAR NOT NULL,
+    updated_at TIMESTAMP NOT NULL
+);
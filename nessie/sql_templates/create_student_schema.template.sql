@@ -108,6 +108,14 @@ CREATE TABLE IF NOT EXISTS {redshift_schema_student}.student_canvas_site_members
 DISTKEY (sid)
 SORTKEY (term_id, sid);
 
+-- Populated only in the staging schema, listing Canvas course sites whose membership rows are replaced by an incremental refresh.
+CREATE TABLE IF NOT EXISTS {redshift_schema_student}.student_canvas_site_refreshed_courses
+(
+    canvas_course_id VARCHAR NOT NULL
+)
+DISTKEY (canvas_course_id)
+SORTKEY (canvas_course_id);
+
 CREATE TABLE IF NOT EXISTS {redshift_schema_student}.student_enrollment_terms
 (
     sid VARCHAR NOT NULL,
@@ -163,6 +171,14 @@ CREATE TABLE IF NOT EXISTS {redshift_schema_student}.student_profile_index
 DISTKEY (units)
 INTERLEAVED SORTKEY (sid, last_name, level, gpa, units, uid, first_name);
 
+-- Populated only in the staging schema, listing SIDs whose profile rows are replaced by an incremental refresh.
+CREATE TABLE IF NOT EXISTS {redshift_schema_student}.student_profile_refreshed_sids
+(
+    sid VARCHAR NOT NULL
+)
+DISTKEY (sid)
+SORTKEY (sid);
+
 CREATE TABLE IF NOT EXISTS {redshift_schema_student}.student_profiles
 (
     sid VARCHAR NOT NULL,
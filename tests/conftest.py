@@ -34,14 +34,16 @@ if os.environ.get('NESSIE_ENV') != 'testext':
     os.environ['NESSIE_ENV'] = 'test'
 
 
-# When NESSIE_ENV is 'testext', only tests marked @pytest.mark.testext will run. Otherwise,
-# all other tests will run.
+# When NESSIE_ENV is 'testext', only tests marked @pytest.mark.testext will run. When NESSIE_BENCHMARK is set,
+# only timing comparisons marked @pytest.mark.benchmark will run. Otherwise, all other tests will run.
 
 def pytest_cmdline_preparse(args):
     if os.environ['NESSIE_ENV'] == 'testext':
         args[:] = ['-m', 'testext'] + args
+    elif os.environ.get('NESSIE_BENCHMARK'):
+        args[:] = ['-m', 'benchmark'] + args
     else:
-        args[:] = ['-m', 'not testext'] + args
+        args[:] = ['-m', 'not testext and not benchmark'] + args
 
 
 # Because app and db fixtures are only created once per pytest run, individual tests
@@ -51,3 +51,11 @@ class TestAdminController:
         job = next((job for job in response.json if job.get('name') == 'Generate merged student feeds'), None)
         assert job.get('path') == '/api/job/generate_merged_student_feeds'
         assert 'POST' in job.get('methods')
+
+    def test_connection_pools(self, app, client):
+        """Returns metrics for each database connection pool."""
+        response = get_basic_auth(client=client, path='/api/admin/connection_pools', credentials=credentials(app))
+        assert response.status_code == 200
+        for metrics in response.json.values():
+            assert 'checked_out' in metrics
+            assert 'idle' in metrics
@@ -0,0 +1,152 @@
+"""
+Copyright ©2024. The Regents of the University of California (Regents). All Rights Reserved.
+
+Permission to use, copy, modify, and distribute this software and its documentation
+for educational, research, and not-for-profit purposes, without fee and without a
+signed licensing agreement, is hereby granted, provided that the above copyright
+notice, this paragraph and the following two paragraphs appear in all copies,
+modifications, and distributions.
+
+Contact The Office of Technology Licensing, UC Berkeley, 2150 Shattuck Avenue,
+Suite 510, Berkeley, CA 94720-1620, (510) 643-7201, otl@berkeley.edu,
+http://ipira.berkeley.edu/industry-info for commercial licensing opportunities.
+
+IN NO EVENT SHALL REGENTS BE LIABLE TO ANY PARTY FOR DIRECT, INDIRECT, SPECIAL,
+INCIDENTAL, OR CONSEQUENTIAL DAMAGES, INCLUDING LOST PROFITS, ARISING OUT OF
+THE USE OF THIS SOFTWARE AND ITS DOCUMENTATION, EVEN IF REGENTS HAS BEEN ADVISED
+OF THE POSSIBILITY OF SUCH DAMAGE.
+
+REGENTS SPECIFICALLY DISCLAIMS ANY WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE. THE
+SOFTWARE AND ACCOMPANYING DOCUMENTATION, IF ANY, PROVIDED HEREUNDER IS PROVIDED
+"AS IS". REGENTS HAS NO OBLIGATION TO PROVIDE MAINTENANCE, SUPPORT, UPDATES,
+ENHANCEMENTS, OR MODIFICATIONS.
+"""
+
+from datetime import date
+import time
+from unittest import mock
+
+from nessie.externals import rds
+import psycopg2.extras
+import pytest
+from tests.util import capture_app_logs, override_config
+
+schema = 'rds_copy_test'
+
+
+@pytest.fixture()
+def copy_table(app):
+    rds.execute(f"""DROP SCHEMA IF EXISTS {schema} CASCADE;
+        CREATE SCHEMA {schema};
+        CREATE TABLE {schema}.rows (id INTEGER NOT NULL, name VARCHAR, active BOOLEAN, since DATE, details JSON, tags VARCHAR[], data BYTEA);""")
+    yield f'{schema}.rows'
+    rds.execute(f'DROP SCHEMA {schema} CASCADE')
+
+
+class TestCopyRows:
+    """COPY FROM STDIN into RDS."""
+
+    def test_copy_rows(self, app, copy_table):
+        rows = [
+            (1, 'Tab\tand\nnewline \\ backslash', True, date(2024, 8, 21), {'a': 1}),
+            (2, None, False, None, None),
+            (3, 'Three', None, '2024-01-01', None),
+        ]
+        with rds.transaction() as transaction:
+            assert transaction.copy_rows(copy_table, ['id', 'name', 'active', 'since', 'details'], rows) == 'COPY 3'
+            transaction.commit()
+        results = rds.fetch(f'SELECT id, name, active, since, details FROM {copy_table} ORDER BY id')
+        assert [tuple(r.values()) for r in results] == [
+            (1, 'Tab\tand\nnewline \\ backslash', True, date(2024, 8, 21), {'a': 1}),
+            (2, None, False, None, None),
+            (3, 'Three', None, date(2024, 1, 1), None),
+        ]
+
+    def test_streams_rows(self, app, copy_table):
+        consumed = []
+
+        def _rows():
+            for i in range(50000):
+                consumed.append(i)
+                yield (i, f'row {i}')
+            assert len(consumed) == 50000
+
+        with rds.transaction() as transaction:
+            assert transaction.copy_rows(copy_table, ['id', 'name'], _rows()) == 'COPY 50000'
+            transaction.commit()
+        assert rds.fetch(f'SELECT COUNT(*) FROM {copy_table}')[0]['count'] == 50000
+
+    def test_copy_error(self, app, copy_table, caplog):
+        with capture_app_logs(app):
+            with rds.transaction() as transaction:
+                assert transaction.copy_rows(copy_table, ['id', 'name'], [(1, 'ok'), ('not an id', 'bad')]) is None
+                transaction.rollback()
+            assert 'invalid input syntax for type integer' in caplog.text
+        assert rds.fetch(f'SELECT COUNT(*) FROM {copy_table}')[0]['count'] == 0
+
+    def test_unsupported_value(self, app, copy_table, caplog):
+        with capture_app_logs(app):
+            with rds.transaction() as transaction:
+                assert transaction.copy_rows(copy_table, ['id', 'tags'], [(1, ['x', 'y'])]) is None
+                transaction.rollback()
+            assert 'Cannot write list value in COPY text format' in caplog.text
+        assert rds.fetch(f'SELECT COUNT(*) FROM {copy_table}')[0]['count'] == 0
+
+
+class TestInsertBulk:
+    """Bulk inserts switch to COPY above a size threshold."""
+
+    def _insert(self, copy_table, rows, sql=None):
+        with rds.transaction() as transaction:
+            result = transaction.insert_bulk(sql or f'INSERT INTO {copy_table} (id, name)\n VALUES %s', rows)
+            transaction.commit()
+        return result
+
+    def test_small_insert(self, app, copy_table):
+        with override_config(app, 'RDS_COPY_ROWS_THRESHOLD', 3):
+            assert self._insert(copy_table, [(1, 'a'), (2, 'b')]) == 'INSERT 0 2'
+        assert rds.fetch(f'SELECT COUNT(*) FROM {copy_table}')[0]['count'] == 2
+
+    def test_large_insert_copies(self, app, copy_table):
+        with override_config(app, 'RDS_COPY_ROWS_THRESHOLD', 3):
+            assert self._insert(copy_table, [(1, 'a'), (2, 'b'), (3, 'c')]) == 'COPY 3'
+        results = rds.fetch(f'SELECT id, name FROM {copy_table} ORDER BY id')
+        assert [tuple(r.values()) for r in results] == [(1, 'a'), (2, 'b'), (3, 'c')]
+
+    def test_insert_with_extra_clauses(self, app, copy_table):
+        sql = f'INSERT INTO {copy_table} (id, name) VALUES %s ON CONFLICT DO NOTHING'
+        with override_config(app, 'RDS_COPY_ROWS_THRESHOLD', 1):
+            with mock.patch.object(psycopg2.extras, 'execute_values', wraps=psycopg2.extras.execute_values) as execute_values:
+                self._insert(copy_table, [(1, 'a'), (2, 'b')], sql=sql)
+                assert execute_values.call_count == 1
+
+    @pytest.mark.benchmark
+    def test_large_insert_with_adapted_values(self, app, copy_table):
+        rows = [(1, 'a', ['x', 'y'], b'\x00\x01'), (2, 'b', [], None), (3, 'c', None, b'')]
+        sql = f'INSERT INTO {copy_table} (id, name, tags, data) VALUES %s'
+        with override_config(app, 'RDS_COPY_ROWS_THRESHOLD', 1):
+            assert self._insert(copy_table, rows, sql=sql) == 'INSERT 0 3'
+        results = rds.fetch(f'SELECT id, name, tags, data FROM {copy_table} ORDER BY id')
+        assert [(r['id'], r['name'], r['tags'], r['data'] and bytes(r['data'])) for r in results] == [
+            (1, 'a', ['x', 'y'], b'\x00\x01'),
+            (2, 'b', [], None),
+            (3, 'c', None, b''),
+        ]
+
+    def test_copy_insert_benchmark(self, app, copy_table):
+        """Compare COPY FROM STDIN with multi-row INSERT for a large batch."""
+        rows = [(i, f'row {i}', i % 2 == 0, date(2024, 1, 1 + i % 28)) for i in range(100000)]
+        sql = f'INSERT INTO {copy_table} (id, name, active, since) VALUES %s'
+
+        def _timed(threshold):
+            rds.execute(f'TRUNCATE {copy_table}')
+            with override_config(app, 'RDS_COPY_ROWS_THRESHOLD', threshold):
+                start = time.monotonic()
+                self._insert(copy_table, rows, sql=sql)
+                return time.monotonic() - start
+
+        insert_time = _timed(len(rows) + 1)
+        copy_time = _timed(1)
+        app.logger.info(f'Wrote {len(rows)} rows: insert {insert_time:.2f}s, copy {copy_time:.2f}s')
+        assert rds.fetch(f'SELECT COUNT(*) FROM {copy_table}')[0]['count'] == 100000
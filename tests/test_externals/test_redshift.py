@@ -23,11 +23,21 @@ SOFTWARE AND ACCOMPANYING DOCUMENTATION, IF ANY, PROVIDED HEREUNDER IS PROVIDED
 ENHANCEMENTS, OR MODIFICATIONS.
 """
 
-from nessie.externals import redshift
+import logging
+import pickle
+from threading import Barrier
+import time
+import tracemalloc
+from unittest import mock
+
+from nessie.externals import redshift, s3
+from nessie.lib.db import connection_pool_metrics
+from nessie.lib.instrumentation import query_instrumentation
 from nessie.lib.util import resolve_sql_template
+import psycopg2
 import psycopg2.sql
 import pytest
-from tests.util import capture_app_logs, override_config
+from tests.util import capture_app_logs, mock_s3, override_config
 
 
 @pytest.fixture()
@@ -55,6 +65,151 @@ class TestRedshift:
                 redshift.execute('SELECT 1')
                 assert 'could not translate host name "H.C. Earwicker" to address' in caplog.text
 
+    def test_copy_tsv_from_s3_manifest(self, app, schema):
+        """Copies every file listed in a COPY manifest."""
+        table = f"{app.config['REDSHIFT_SCHEMA_BOAC']}.manifest_copies"
+        redshift.execute(f'CREATE TABLE {table} (sid VARCHAR NOT NULL, feed VARCHAR)')
+        with mock_s3(app):
+            for i in range(3):
+                s3.upload_data(f'{i}1\tfeed\n{i}2\tfeed\n'.encode(), f'staging/batch_{i}.tsv')
+            entries = [{'url': s3.build_s3_url(f'staging/batch_{i}.tsv'), 'mandatory': True} for i in range(3)]
+            s3.upload_json({'entries': entries}, 'staging/batches.manifest')
+            assert redshift.copy_tsv_from_s3_manifest(table, 'staging/batches.manifest')
+        rows = redshift.fetch(f'SELECT sid FROM {table} ORDER BY sid')
+        assert [r['sid'] for r in rows] == ['01', '02', '11', '12', '21', '22']
+
+    def test_fetch_iter(self, app):
+        """Yields rows in chunks as tuples that support lookup by column name."""
+        rows = redshift.fetch_iter(
+            "SELECT n AS id, 'row ' || n AS name, (n * 10)::VARCHAR AS canvas_user_id FROM generate_series(1, 7) n ORDER BY n",
+            chunk_size=3,
+        )
+        rows = list(rows)
+        assert len(rows) == 7
+        assert rows[0] == (1, 'row 1', '10')
+        assert rows[6]['name'] == 'row 7'
+        assert rows[6].get('missing') is None
+        assert list(rows[6].keys()) == ['id', 'name', 'canvas_user_id']
+        assert dict(rows[6]) == {'id': 7, 'name': 'row 7', 'canvas_user_id': '70'}
+        assert pickle.loads(pickle.dumps(rows[6]))['name'] == 'row 7'
+        assert all(metrics['checked_out'] == 0 for metrics in connection_pool_metrics().values())
+
+    def test_fetch_iter_coercion(self, app):
+        """Coerces numeric columns as copy_for_pandas does, if asked."""
+        sql = "SELECT '10' AS canvas_user_id, 'nope' AS current_score, '3' AS other"
+        assert next(redshift.fetch_iter(sql)) == ('10', 'nope', '3')
+        assert next(redshift.fetch_iter(sql, coerce=True)) == (10, None, '3')
+        assert next(redshift.fetch_iter(sql, coerce=True))['canvas_user_id'] == redshift.fetch(sql)[0]['canvas_user_id']
+
+    def test_fetch_iter_error(self, app, caplog):
+        """Logs and raises query errors."""
+        with capture_app_logs(app):
+            with pytest.raises(psycopg2.Error):
+                list(redshift.fetch_iter('SELECT * FROM no_such_table'))
+            assert 'relation "no_such_table" does not exist' in caplog.text
+        assert redshift.fetch('SELECT 1 AS one')[0]['one'] == 1
+
+    def test_fetch_iter_memory(self, app):
+        """Holds less in memory than fetch while iterating over a large result set."""
+        sql = "SELECT n AS sid, 'term ' || (n % 10) AS term_name, n * 1.5 AS gpa FROM generate_series(1, 20000) n"
+        peaks = {}
+        for method in ('fetch', 'fetch_iter'):
+            tracemalloc.start()
+            try:
+                assert sum(1 for row in getattr(redshift, method)(sql) if row['sid']) == 20000
+                peaks[method] = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+        app.logger.info(f"Peak memory: {peaks['fetch']} bytes fetch, {peaks['fetch_iter']} bytes fetch_iter")
+        assert peaks['fetch_iter'] * 2 < peaks['fetch']
+
+    def test_stream_redshift(self, app):
+        """Streams rows as tuples that support lookup by column name, and closes the connection when done."""
+        stream = redshift.fetch("SELECT n AS canvas_course_id, 'row ' || n AS name FROM generate_series(1, 5) n ORDER BY n", stream_redshift=True)
+        rows = list(stream)
+        assert rows[0] == (1, 'row 1')
+        assert rows[4]['name'] == 'row 5'
+        assert redshift.copy_for_pandas(rows)[4] == {'canvas_course_id': 5, 'name': 'row 5'}
+        stream.close()
+        assert stream.cursor.connection.closed
+
+    def test_stream_redshift_adaptive_fetch_size(self, app):
+        """Sizes fetches to the byte budget, making fewer round trips for narrow rows and more for wide ones."""
+        def _round_trips(sql):
+            stream = redshift.fetch(sql, stream_redshift=True)
+            try:
+                assert sum(1 for row in stream) == 50000
+                return stream.round_trips, stream.fetch_size
+            finally:
+                stream.close()
+
+        with override_config(app, 'REDSHIFT_STREAM_FETCH_BYTES', 0):
+            fixed_round_trips, fixed_fetch_size = _round_trips('SELECT n FROM generate_series(1, 50000) n')
+        assert fixed_fetch_size == redshift.CURSOR_ITERSIZE
+        assert fixed_round_trips == 51
+
+        with override_config(app, 'REDSHIFT_STREAM_FETCH_BYTES', 200000):
+            narrow_round_trips, narrow_fetch_size = _round_trips('SELECT n FROM generate_series(1, 50000) n')
+            wide_round_trips, wide_fetch_size = _round_trips("SELECT n, REPEAT('x', 1000) AS padding FROM generate_series(1, 50000) n")
+        assert narrow_fetch_size > 10 * redshift.CURSOR_ITERSIZE
+        assert narrow_round_trips < 10
+        assert 100 <= wide_fetch_size < redshift.CURSOR_ITERSIZE
+        assert wide_round_trips > fixed_round_trips
+
+    def test_parallel_unload_resume(self, app):
+        """Reuses a parallel unload of the same query completed earlier in the same job run."""
+        cursor = mock.MagicMock()
+        sql = 'SELECT sid FROM students ORDER BY sid'
+        with mock_s3(app):
+            with query_instrumentation(job_id='GenerateMergedStudentFeeds_1700000000'):
+                manifest_key = redshift._execute_unload(sql, cursor, parallel=True, unload_path='students')
+                assert manifest_key.endswith('/manifest')
+                assert '/unloads/students/GenerateMergedStudentFeeds_1700000000/' in manifest_key
+                assert 'PARALLEL ON MANIFEST' in cursor.execute.call_args[0][0]
+
+                s3.upload_manifest([], manifest_key)
+                cursor.reset_mock()
+                assert redshift._execute_unload(sql, cursor, parallel=True, unload_path='students') == manifest_key
+                cursor.execute.assert_not_called()
+
+                # A different query, or a disabled resume, means a fresh unload.
+                assert redshift._execute_unload(sql, cursor, parallel=True, unload_path='students', params=(['123'],)) != manifest_key
+                assert cursor.execute.call_count == 1
+                with override_config(app, 'REDSHIFT_UNLOAD_RESUME', False):
+                    assert redshift._execute_unload(sql, cursor, parallel=True, unload_path='students') == manifest_key
+                assert cursor.execute.call_count == 2
+
+            # A later job run, perhaps after upstream data was refreshed, unloads afresh.
+            with query_instrumentation(job_id='GenerateMergedStudentFeeds_1700003600'):
+                assert redshift._execute_unload(sql, cursor, parallel=True, unload_path='students') != manifest_key
+                assert cursor.execute.call_count == 3
+
+            # So does a query run outside any job, even if an earlier unload is in place.
+            no_job_manifest_key = redshift._execute_unload(sql, cursor, parallel=True, unload_path='students')
+            s3.upload_manifest([], no_job_manifest_key)
+            assert redshift._execute_unload(sql, cursor, parallel=True, unload_path='students') == no_job_manifest_key
+            assert cursor.execute.call_count == 5
+
+    def test_unload_sort_key(self, app):
+        """Sorts unloaded rows as Redshift would sort them."""
+        sort_key = redshift.unload_sort_key(
+            redshift.SortColumn('term_id', descending=True),
+            'sid',
+            redshift.SortColumn('career', convert=lambda c: {'UGRD': 1, 'GRAD': 2}.get(c, 3)),
+            redshift.SortColumn('units', convert=float),
+            redshift.SortColumn('primary', descending=True),
+        )
+        rows = [
+            {'term_id': '2178', 'sid': '1', 'career': 'UGRD', 'units': '10', 'primary': 'f'},
+            {'term_id': '2182', 'sid': '2', 'career': '', 'units': '4', 'primary': 't'},
+            {'term_id': '2182', 'sid': '2', 'career': 'GRAD', 'units': '4', 'primary': 'f'},
+            {'term_id': '2182', 'sid': '2', 'career': 'GRAD', 'units': '4', 'primary': ''},
+            {'term_id': '2182', 'sid': '2', 'career': 'GRAD', 'units': '10', 'primary': 't'},
+            {'term_id': '2182', 'sid': '10', 'career': 'UGRD', 'units': '4', 'primary': 't'},
+            {'term_id': '', 'sid': '1', 'career': 'UGRD', 'units': '4', 'primary': 't'},
+        ]
+        assert [rows.index(r) for r in sorted(rows, key=sort_key)] == [6, 5, 3, 2, 4, 1, 0]
+
     @pytest.mark.testext
     def test_schema_creation_drop(self, app, caplog, ensure_drop_schema):
         """Can create and drop schemata on a real Redshift instance."""
@@ -82,3 +237,65 @@ class TestRedshift:
         result = redshift.fetch('SELECT COUNT(*) FROM {schema}.students', schema=schema)
         assert len(result) == 1
         assert result[0]['count'] == 7
+
+
+class TestExecuteDdlScript:
+    """Concurrent DDL script execution."""
+
+    def _script(self, app, first_sql='SELECT 1'):
+        schema = app.config['REDSHIFT_SCHEMA_BOAC']
+        return f"""CREATE SCHEMA {schema};
+            CREATE TABLE {schema}.first AS ({first_sql} AS n FROM (SELECT pg_sleep(0.5)) s);
+            CREATE TABLE {schema}.second AS (SELECT 2 AS n FROM (SELECT pg_sleep(0.5)) s);
+            CREATE TABLE {schema}.third AS (SELECT 3 AS n FROM (SELECT pg_sleep(0.5)) s);
+            CREATE TABLE {schema}.totals AS (
+                SELECT SUM(n) AS total FROM (
+                    SELECT n FROM {schema}.first UNION ALL SELECT n FROM {schema}.second UNION ALL SELECT n FROM {schema}.third
+                ) t
+            );"""
+
+    def _total(self, app):
+        return redshift.fetch(f"SELECT total FROM {app.config['REDSHIFT_SCHEMA_BOAC']}.totals")[0]['total']
+
+    def test_concurrent(self, app, ensure_drop_schema, caplog):
+        # Each independent statement waits until all three are in flight, so running them one at a time would break the barrier.
+        barrier = Barrier(3, timeout=10)
+        execute = redshift._execute
+
+        def _execute(sql, **kwargs):
+            if 'pg_sleep' in sql:
+                barrier.wait()
+            return execute(sql, **kwargs)
+
+        caplog.set_level(logging.INFO)
+        with capture_app_logs(app), override_config(app, 'REDSHIFT_DDL_MAX_THREADS', 4),\
+                mock.patch.object(redshift, '_execute', side_effect=_execute):
+            assert redshift.execute_ddl_script(self._script(app)) is True
+            assert 'Executed 5 DDL statements' in caplog.text
+        assert not barrier.broken
+        assert self._total(app) == 6
+
+    def test_serial(self, app, ensure_drop_schema):
+        with override_config(app, 'REDSHIFT_DDL_MAX_THREADS', 1):
+            start = time.monotonic()
+            assert redshift.execute_ddl_script(self._script(app)) is True
+            assert time.monotonic() - start >= 1.5
+        assert self._total(app) == 6
+
+    def test_session_bound_script_runs_serially(self, app, ensure_drop_schema):
+        script = 'SET statement_timeout = 98765;' + self._script(app)
+        with override_config(app, 'REDSHIFT_DDL_MAX_THREADS', 4):
+            start = time.monotonic()
+            assert redshift.execute_ddl_script(script) is True
+            assert time.monotonic() - start >= 1.5
+        # The session state set by the script is not handed back to the connection pool.
+        for _ in range(app.config['DB_CONNECTION_POOL_MAX_SIZE'] + 1):
+            assert redshift.fetch('SHOW statement_timeout')[0]['statement_timeout'] == '0'
+
+    def test_failure_skips_dependents(self, app, ensure_drop_schema, caplog):
+        schema = app.config['REDSHIFT_SCHEMA_BOAC']
+        with capture_app_logs(app), override_config(app, 'REDSHIFT_DDL_MAX_THREADS', 4):
+            assert redshift.execute_ddl_script(self._script(app, first_sql='SELECT 1 / 0')) is False
+            assert 'Aborting DDL script' in caplog.text
+        sql = f"SELECT COUNT(*) FROM information_schema.tables WHERE table_schema = '{schema}' AND table_name = 'totals'"
+        assert redshift.fetch(sql)[0]['count'] == 0
@@ -23,8 +23,14 @@ SOFTWARE AND ACCOMPANYING DOCUMENTATION, IF ANY, PROVIDED HEREUNDER IS PROVIDED
 ENHANCEMENTS, OR MODIFICATIONS.
 """
 
+import gzip
+import io
+import random
+import tempfile
+from unittest import mock
+
 from botocore.exceptions import ConnectionError as BotoConnectionError
-from nessie.externals import s3
+from nessie.externals import redshift, s3
 import pytest
 import responses
 from tests.util import capture_app_logs, mock_s3
@@ -58,6 +64,73 @@ class TestS3:
             assert f'{prefix}/requests-bbb.gz' in response
             assert f'{prefix}/requests-ccc.gz' in response
 
+    def test_upload_gzip_parts(self, app):
+        """Splits a file by lines across gzipped parts."""
+        with mock_s3(app), tempfile.TemporaryFile() as f:
+            f.write(b''.join(f'{i}\tfeed\n'.encode() for i in range(10)))
+            s3_keys = s3.upload_gzip_parts(f, 'staging/feeds.tsv', 4)
+            assert s3_keys == [f'staging/feeds.tsv.part{i}.gz' for i in range(4)]
+            parts = [s3.get_unzipped_object_text(s3_key).splitlines() for s3_key in s3_keys]
+            assert [len(part) for part in parts] == [3, 3, 2, 2]
+            assert sorted(line for part in parts for line in part) == sorted(f'{i}\tfeed' for i in range(10))
+
+            # Parts are not created for want of lines.
+            f.seek(0)
+            f.truncate()
+            f.write(b'0\tfeed\n')
+            assert s3.upload_gzip_parts(f, 'staging/feed.tsv', 4) == ['staging/feed.tsv.part0.gz']
+
+    def test_get_merged_tsv_stream(self, app):
+        """Merges sorted TSV parts, listed in an unload manifest, back into a single ordering."""
+        rows = [(term_id, f'{sid:03}', dropped) for term_id in ('2178', '2182') for sid in range(40) for dropped in ('', 't')]
+        parts = [[], [], []]
+        random.seed(3)
+        for row in rows:
+            random.choice(parts).append(row)
+        sort_key = redshift.unload_sort_key(redshift.SortColumn('term_id', descending=True), 'sid', redshift.SortColumn('dropped', nulls_first=True))
+        expected = sorted(rows, key=lambda r: (-int(r[0]), r[1], r[2]))
+        with mock_s3(app), _moto_text_reader():
+            for index, part in enumerate(parts):
+                part.sort(key=lambda r: (-int(r[0]), r[1], r[2]))
+                tsv = 'term_id\tsid\tdropped\n' + ''.join('\t'.join(row) + '\n' for row in part)
+                s3.upload_data(gzip.compress(tsv.encode()), f'unloads/enrollments/000{index}_part_00.gz')
+            s3.upload_manifest([f'unloads/enrollments/000{i}_part_00.gz' for i in range(3)], 'unloads/enrollments/manifest')
+            part_keys = s3.get_manifest_keys('unloads/enrollments/manifest')
+            assert part_keys == [f'unloads/enrollments/000{i}_part_00.gz' for i in range(3)]
+            merged = list(s3.get_merged_tsv_stream(part_keys, sort_key, prefetch_chunks=1, chunk_size=7))
+            assert [(r['term_id'], r['sid'], r['dropped']) for r in merged] == expected
+
+            # A stream closed early releases its prefetch threads.
+            stream = s3.get_merged_tsv_stream(part_keys, sort_key, prefetch_chunks=1, chunk_size=2)
+            assert next(stream)['term_id'] == '2182'
+            stream.close()
+
+    def test_get_merged_tsv_stream_unsorted_part(self, app):
+        """Raises an error if any part is out of order, rather than merging it into a broken ordering."""
+        sort_key = redshift.unload_sort_key('sid')
+        with mock_s3(app), _moto_text_reader():
+            s3.upload_data(gzip.compress(b'sid\n1\n3\n'), 'unloads/part_0.gz')
+            s3.upload_data(gzip.compress(b'sid\n2\n5\n4\n'), 'unloads/part_1.gz')
+            with pytest.raises(ValueError) as e:
+                list(s3.get_merged_tsv_stream(['unloads/part_0.gz', 'unloads/part_1.gz'], sort_key))
+            assert 'key=unloads/part_1.gz' in str(e.value)
+
+    def test_get_merged_tsv_stream_error(self, app):
+        """Raises an error reading any part."""
+        sort_key = redshift.unload_sort_key('sid')
+        with mock_s3(app), _moto_text_reader():
+            s3.upload_data(gzip.compress(b'sid\n"1"\n'), 'unloads/part_0.gz')
+            with pytest.raises(IOError):
+                list(s3.get_merged_tsv_stream(['unloads/part_0.gz', 'unloads/missing.gz'], sort_key))
+
+
+def _moto_text_reader():
+    # Mocked S3 response bodies do not support socket timeouts.
+    def _get_unzipped_text_reader(key):
+        text = s3.get_unzipped_object_text(key)
+        return io.StringIO(text) if text is not None else None
+    return mock.patch.object(s3, 'get_unzipped_text_reader', side_effect=_get_unzipped_text_reader)
+
 
 @pytest.mark.testext
 class TestS3Testext:
@@ -0,0 +1,112 @@
+"""
+Copyright ©2024. The Regents of the University of California (Regents). All Rights Reserved.
+
+Permission to use, copy, modify, and distribute this software and its documentation
+for educational, research, and not-for-profit purposes, without fee and without a
+signed licensing agreement, is hereby granted, provided that the above copyright
+notice, this paragraph and the following two paragraphs appear in all copies,
+modifications, and distributions.
+
+Contact The Office of Technology Licensing, UC Berkeley, 2150 Shattuck Avenue,
+Suite 510, Berkeley, CA 94720-1620, (510) 643-7201, otl@berkeley.edu,
+http://ipira.berkeley.edu/industry-info for commercial licensing opportunities.
+
+IN NO EVENT SHALL REGENTS BE LIABLE TO ANY PARTY FOR DIRECT, INDIRECT, SPECIAL,
+INCIDENTAL, OR CONSEQUENTIAL DAMAGES, INCLUDING LOST PROFITS, ARISING OUT OF
+THE USE OF THIS SOFTWARE AND ITS DOCUMENTATION, EVEN IF REGENTS HAS BEEN ADVISED
+OF THE POSSIBILITY OF SUCH DAMAGE.
+
+REGENTS SPECIFICALLY DISCLAIMS ANY WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE. THE
+SOFTWARE AND ACCOMPANYING DOCUMENTATION, IF ANY, PROVIDED HEREUNDER IS PROVIDED
+"AS IS". REGENTS HAS NO OBLIGATION TO PROVIDE MAINTENANCE, SUPPORT, UPDATES,
+ENHANCEMENTS, OR MODIFICATIONS.
+"""
+
+from threading import Barrier
+from unittest import mock
+
+from nessie.externals import redshift
+from nessie.jobs.background_job import BackgroundJob, BackgroundJobError, verify_external_schema, verify_external_tables
+from nessie.lib.instrumentation import current_job_id
+from nessie.lib.metadata import most_recent_background_job_status
+import pytest
+
+
+@pytest.fixture()
+def external_tables(app):
+    redshift.execute('DROP SCHEMA IF EXISTS verification_test CASCADE')
+    redshift.execute('CREATE SCHEMA verification_test')
+    redshift.execute('CREATE TABLE verification_test.full_table AS SELECT generate_series(1, 3) AS id')
+    redshift.execute('CREATE TABLE verification_test.other_table AS SELECT generate_series(1, 5) AS id')
+    redshift.execute('CREATE TABLE verification_test.empty_table (id INTEGER)')
+    yield
+    redshift.execute('DROP SCHEMA verification_test CASCADE')
+
+
+def _ddl(*tables):
+    return '\n'.join(f'CREATE EXTERNAL TABLE verification_test.{table} (id INTEGER);' for table in tables)
+
+
+class TestVerifyExternalSchema:
+
+    def test_reports_counts(self, app, external_tables):
+        summary = verify_external_schema('verification_test', _ddl('other_table', 'full_table'))
+        assert summary.startswith('Verified 2 external tables in ')
+        assert 'verification_test.full_table 3 rows (' in summary
+        assert 'verification_test.other_table 5 rows (' in summary
+        assert summary.index('full_table') < summary.index('other_table')
+
+    def test_zero_count(self, app, external_tables):
+        with pytest.raises(BackgroundJobError) as e:
+            verify_external_schema('verification_test', _ddl('full_table', 'empty_table'))
+        assert 'external table verification_test.empty_table with 0 rows' in str(e.value)
+        summary = verify_external_schema('verification_test', _ddl('full_table', 'empty_table'), is_zero_count_acceptable=True)
+        assert 'verification_test.empty_table 0 rows (' in summary
+
+    def test_failed_count(self, app, external_tables):
+        with pytest.raises(BackgroundJobError) as e:
+            verify_external_schema('verification_test', _ddl('full_table', 'missing_table'))
+        assert 'external table verification_test.missing_table with None rows' in str(e.value)
+
+    def test_skips_historical_requests(self, app, external_tables):
+        summary = verify_external_schema('verification_test', _ddl('full_table', 'historical_requests'))
+        assert summary.startswith('Verified 1 external tables')
+
+    def test_counts_concurrently(self, app):
+        # Each count waits until all eight are in flight, so counts run one at a time would break the barrier.
+        barrier = Barrier(8, timeout=10)
+
+        def _concurrent_count(sql):
+            barrier.wait()
+            return [{'count': 1}]
+
+        tables = [f'verification_test.table_{i}' for i in range(8)]
+        with mock.patch.object(redshift, 'fetch', side_effect=_concurrent_count):
+            with mock.patch.dict(app.config, {'EXTERNAL_TABLE_VERIFICATION_MAX_THREADS': 8}):
+                summary = verify_external_tables(tables)
+        assert summary.startswith('Verified 8 external tables')
+        assert not barrier.broken
+
+
+class TestQueryStatistics:
+
+    def test_job_id_in_context(self, app, clear_metadata_db):
+        class IdentifyingJob(BackgroundJob):
+            def run(self):
+                return current_job_id()
+
+        job = IdentifyingJob()
+        assert job.run_wrapped() == job.job_id
+
+    def test_job_status_details(self, app, clear_metadata_db):
+        class QueryingJob(BackgroundJob):
+            def run(self):
+                redshift.fetch('SELECT generate_series(1, 4) AS n')
+                return 'Queried.'
+
+        assert QueryingJob().run_wrapped() == 'Queried.'
+        details = most_recent_background_job_status('QueryingJob')['details']
+        assert details.startswith('Queried.\n\n1 queries in ')
+        assert '[redshift] 1 calls' in details
+        assert '4 rows: SELECT generate_series(?) AS n' in details
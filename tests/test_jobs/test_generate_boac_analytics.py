@@ -0,0 +1,166 @@
+"""
+Copyright ©2024. The Regents of the University of California (Regents). All Rights Reserved.
+
+Permission to use, copy, modify, and distribute this software and its documentation
+for educational, research, and not-for-profit purposes, without fee and without a
+signed licensing agreement, is hereby granted, provided that the above copyright
+notice, this paragraph and the following two paragraphs appear in all copies,
+modifications, and distributions.
+
+Contact The Office of Technology Licensing, UC Berkeley, 2150 Shattuck Avenue,
+Suite 510, Berkeley, CA 94720-1620, (510) 643-7201, otl@berkeley.edu,
+http://ipira.berkeley.edu/industry-info for commercial licensing opportunities.
+
+IN NO EVENT SHALL REGENTS BE LIABLE TO ANY PARTY FOR DIRECT, INDIRECT, SPECIAL,
+INCIDENTAL, OR CONSEQUENTIAL DAMAGES, INCLUDING LOST PROFITS, ARISING OUT OF
+THE USE OF THIS SOFTWARE AND ITS DOCUMENTATION, EVEN IF REGENTS HAS BEEN ADVISED
+OF THE POSSIBILITY OF SUCH DAMAGE.
+
+REGENTS SPECIFICALLY DISCLAIMS ANY WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE. THE
+SOFTWARE AND ACCOMPANYING DOCUMENTATION, IF ANY, PROVIDED HEREUNDER IS PROVIDED
+"AS IS". REGENTS HAS NO OBLIGATION TO PROVIDE MAINTENANCE, SUPPORT, UPDATES,
+ENHANCEMENTS, OR MODIFICATIONS.
+"""
+
+import json
+import tempfile
+from unittest import mock
+
+from nessie.externals import redshift
+from nessie.lib.analytics import generate_analytics_feeds_for_course
+from tests.test_lib.test_analytics import golden_course_inputs
+from tests.util import mock_s3, override_config
+
+
+class TestGenerateBoacAnalytics:
+    """BOAC analytics generation."""
+
+    def test_parallel_analytics_feeds(self, app):
+        """Generates the same feeds across worker processes as serially, with the same membership count."""
+        from nessie.jobs.generate_boac_analytics import GenerateBoacAnalytics
+        courses = golden_course_inputs()
+
+        class _Stream(list):
+            def close(self):
+                pass
+
+        def _stream(index):
+            return lambda term_id: _Stream(row for course in courses for row in ([course[0]] if index == 0 else course[index]))
+
+        def _generate(max_processes):
+            staged = []
+
+            def _write_to_staging(table, feed_files, row_count, term_id=None):
+                lines = []
+                for feed_file in (feed_files if isinstance(feed_files, list) else [feed_files]):
+                    feed_file.seek(0)
+                    lines.extend(feed_file.read().splitlines())
+                staged.append((table, term_id, row_count, len(feed_files) if isinstance(feed_files, list) else 1, sorted(lines)))
+
+            transaction = mock.MagicMock()
+            transaction.commit.return_value = True
+            module = 'nessie.jobs.generate_boac_analytics'
+            with override_config(app, 'BOAC_ANALYTICS_MAX_PROCESSES', max_processes),\
+                    override_config(app, 'BOAC_ANALYTICS_BATCH_ROWS', 50),\
+                    mock.patch(f'{module}.write_file_to_staging', side_effect=_write_to_staging),\
+                    mock.patch(f'{module}.write_files_to_staging', side_effect=_write_to_staging),\
+                    mock.patch(f'{module}.truncate_staging_table'),\
+                    mock.patch(f'{module}.refresh_from_staging') as refresh_from_staging,\
+                    mock.patch(f'{module}.redshift.transaction') as redshift_transaction,\
+                    mock.patch(f'{module}.queries.stream_canvas_sites', side_effect=_stream(0)),\
+                    mock.patch(f'{module}.queries.stream_canvas_enrollments', side_effect=_stream(1)),\
+                    mock.patch(f'{module}.queries.stream_canvas_assignment_submissions', side_effect=_stream(2)):
+                redshift_transaction.return_value.__enter__.return_value = transaction
+                GenerateBoacAnalytics().generate_analytics_feeds('2178')
+            assert refresh_from_staging.call_args.args == ('student_canvas_site_memberships', '2178', transaction)
+            assert len(staged) == 1
+            return staged[0]
+
+        serial_table, serial_term_id, serial_count, serial_parts, serial_lines = _generate(1)
+        assert serial_count == len(serial_lines) == 91
+        assert serial_parts == 1
+        parallel_table, parallel_term_id, parallel_count, parallel_parts, parallel_lines = _generate(3)
+        assert (parallel_table, parallel_term_id, parallel_count) == ('student_canvas_site_memberships', '2178', serial_count)
+        assert 1 <= parallel_parts <= 3
+        assert parallel_lines == serial_lines
+
+    def test_write_files_to_staging(self, app, student_tables):
+        """Stages feed files written by separate workers as gzipped parts, with a single manifest COPY."""
+        from nessie.externals import s3
+        from nessie.models.student_schema_manager import staging_schema, truncate_staging_table, write_files_to_staging
+        truncate_staging_table('student_holds')
+        with mock_s3(app), tempfile.TemporaryFile() as part_0, tempfile.TemporaryFile() as part_1:
+            for i in range(10):
+                (part_0 if i % 3 else part_1).write(f'{i}\t{json.dumps({"reason": {"code": i}})}\n'.encode())
+            with mock.patch.object(redshift, 'copy_tsv_from_s3_manifest', wraps=redshift.copy_tsv_from_s3_manifest) as copy:
+                assert write_files_to_staging('student_holds', [part_0, part_1], 10)
+            assert copy.call_count == 1
+            assert len(s3.get_object_json(copy.call_args.args[1])['entries']) == 2
+        rows = redshift.fetch(f'SELECT sid, feed FROM {staging_schema()}.student_holds ORDER BY sid')
+        assert [r['sid'] for r in rows] == [str(i) for i in range(10)]
+        assert json.loads(rows[9]['feed']) == {'reason': {'code': 9}}
+        truncate_staging_table('student_holds')
+
+    def test_incremental_analytics_feeds(self, app, student_tables):
+        """Regenerates and replaces memberships only for course sites whose inputs have changed since the previous run."""
+        from nessie.externals import rds
+        from nessie.jobs.generate_boac_analytics import GenerateBoacAnalytics
+        from nessie.lib.queries import student_schema
+        rds.execute(f"DELETE FROM {app.config['RDS_SCHEMA_METADATA']}.canvas_analytics_fingerprints")
+        courses = golden_course_inputs()
+
+        class _Stream(list):
+            def close(self):
+                pass
+
+        def _generate():
+            module = 'nessie.jobs.generate_boac_analytics'
+            job = GenerateBoacAnalytics()
+
+            def stream_submissions(term_id):
+                return _Stream(r for c in courses for r in c[2])
+
+            with override_config(app, 'BOAC_ANALYTICS_INCREMENTAL', True),\
+                    mock_s3(app),\
+                    mock.patch(f'{module}.generate_analytics_feeds_for_course', wraps=generate_analytics_feeds_for_course) as generate,\
+                    mock.patch(f'{module}.queries.stream_canvas_sites', side_effect=lambda t: _Stream(c[0] for c in courses)),\
+                    mock.patch(f'{module}.queries.stream_canvas_enrollments', side_effect=lambda t: _Stream(r for c in courses for r in c[1])),\
+                    mock.patch(f'{module}.queries.stream_canvas_assignment_submissions', side_effect=stream_submissions):
+                job.generate_analytics_feeds('2178')
+            generated = [call.args[2]['canvas_course_id'] for call in generate.call_args_list]
+            return generated, (len(job.course_fingerprints), job.skipped_count, job.deleted_course_ids)
+
+        def _memberships():
+            rows = redshift.fetch(f'SELECT sid, feed FROM {student_schema()}.student_canvas_site_memberships ORDER BY sid')
+            return {r['sid']: json.loads(r['feed']) for r in rows}
+
+        generated, counts = _generate()
+        assert len(generated) == 6
+        assert counts == (6, 0, [])
+        memberships = _memberships()
+        assert len(memberships) == 90
+
+        generated, counts = _generate()
+        assert generated == []
+        assert counts == (0, 6, [])
+        assert _memberships() == memberships
+
+        # One score changes and one course site drops out of the term.
+        courses[1][1][0]['current_score'] = 99.0
+        del courses[4]
+        generated, counts = _generate()
+        assert generated == [7654322]
+        assert counts == (1, 4, ['7654325'])
+        refreshed_memberships = _memberships()
+        assert set(memberships) - set(refreshed_memberships) == {'3000005000'}
+        assert refreshed_memberships['3000002000']['analytics']['currentScore']['student']['raw'] == 99
+        for sid, feed in refreshed_memberships.items():
+            if feed['canvasCourseId'] != 7654322:
+                assert feed == memberships[sid]
+
+        # A change to analytics logic regenerates every course site.
+        with mock.patch('nessie.lib.analytics.ANALYTICS_FEED_VERSION', 'next'):
+            generated, counts = _generate()
+        assert len(generated) == 5
+        assert counts == (5, 0, [])
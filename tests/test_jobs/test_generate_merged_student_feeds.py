@@ -0,0 +1,301 @@
+"""
+Copyright ©2024. The Regents of the University of California (Regents). All Rights Reserved.
+
+Permission to use, copy, modify, and distribute this software and its documentation
+for educational, research, and not-for-profit purposes, without fee and without a
+signed licensing agreement, is hereby granted, provided that the above copyright
+notice, this paragraph and the following two paragraphs appear in all copies,
+modifications, and distributions.
+
+Contact The Office of Technology Licensing, UC Berkeley, 2150 Shattuck Avenue,
+Suite 510, Berkeley, CA 94720-1620, (510) 643-7201, otl@berkeley.edu,
+http://ipira.berkeley.edu/industry-info for commercial licensing opportunities.
+
+IN NO EVENT SHALL REGENTS BE LIABLE TO ANY PARTY FOR DIRECT, INDIRECT, SPECIAL,
+INCIDENTAL, OR CONSEQUENTIAL DAMAGES, INCLUDING LOST PROFITS, ARISING OUT OF
+THE USE OF THIS SOFTWARE AND ITS DOCUMENTATION, EVEN IF REGENTS HAS BEEN ADVISED
+OF THE POSSIBILITY OF SUCH DAMAGE.
+
+REGENTS SPECIFICALLY DISCLAIMS ANY WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE. THE
+SOFTWARE AND ACCOMPANYING DOCUMENTATION, IF ANY, PROVIDED HEREUNDER IS PROVIDED
+"AS IS". REGENTS HAS NO OBLIGATION TO PROVIDE MAINTENANCE, SUPPORT, UPDATES,
+ENHANCEMENTS, OR MODIFICATIONS.
+"""
+
+from contextlib import ExitStack
+import json
+import tempfile
+import tracemalloc
+from unittest import mock
+
+from nessie.externals import redshift
+from nessie.lib.queries import edl_schema
+import pytest
+from tests.util import mock_s3, override_config
+
+
+@pytest.fixture()
+def profile_elements(app, student_tables):
+    rows = redshift.fetch(f"""SELECT p.sid, a.ldap_uid, a.first_name, a.last_name,
+        p.feed AS sis_profile_feed, d.feed AS degree_progress_feed, r.feed AS last_registration_feed
+        FROM {edl_schema()}.student_profiles p
+        JOIN {edl_schema()}.basic_attributes a ON a.sid = p.sid
+        LEFT JOIN {edl_schema()}.student_degree_progress d ON d.sid = p.sid
+        LEFT JOIN {edl_schema()}.student_last_registrations r ON r.sid = p.sid
+        ORDER BY p.sid""")
+    for row in rows:
+        row['demographics_feed'] = json.dumps({'gender': 'F', 'ethnicities': ['White'], 'visa': {'status': 'A', 'type': 'F1'}})
+        row['intended_majors'] = '25345U :: English BA'
+    # Students without a UID are counted as failures.
+    rows.append({'sid': '9999999999', 'ldap_uid': None})
+    return rows
+
+
+class TestGenerateMergedStudentFeeds:
+    """Merged student feed generation."""
+
+    tables = [
+        'student_profiles', 'student_profile_index', 'student_majors', 'student_holds',
+        'demographics', 'ethnicities', 'intended_majors', 'minors', 'visas',
+    ]
+
+    def _generate(self, profile_elements, max_processes):
+        from nessie.jobs.generate_merged_student_feeds import GenerateMergedStudentFeeds
+        job = GenerateMergedStudentFeeds()
+        job.successes = []
+        job.failures = []
+        advisor_mappings = {profile_elements[0]['sid']: [{
+            'advisor_uid': '1133399',
+            'advisor_sid': '800700600',
+            'advisor_first_name': 'Sheila',
+            'advisor_last_name': 'Nickerson',
+            'advisor_campus_email': 'sheila@berkeley.edu',
+            'advisor_email': None,
+            'advisor_role': 'College Advisor',
+            'advisor_title': 'Advisor',
+            'program': 'Undergrad Letters & Science',
+            'plan': 'English BA',
+        }]}
+        with ExitStack() as stack:
+            feed_files = {table: stack.enter_context(tempfile.TemporaryFile()) for table in self.tables}
+            feed_counts = {table: 0 for table in self.tables}
+            args = [profile_elements, advisor_mappings, feed_files, feed_counts, {'English BA': 'L&S Arts & Humanities'}]
+            if max_processes > 1:
+                job.generate_sharded_student_profile_feeds(*args, max_processes)
+            else:
+                job.generate_student_profile_feeds(*args)
+            contents = {}
+            for table, feed_file in feed_files.items():
+                feed_file.seek(0)
+                contents[table] = feed_file.read()
+        return job.successes, job.failures, contents, feed_counts
+
+    def test_sharded_profile_generation(self, app, profile_elements):
+        """Sharded profile generation matches serial output."""
+        serial_successes, serial_failures, serial_contents, serial_counts = self._generate(profile_elements, 1)
+        assert len(serial_successes) == len(profile_elements) - 1 > 2
+        assert serial_failures == ['9999999999']
+        assert serial_counts['student_profiles'] == len(serial_successes)
+        assert serial_counts['visas'] == len(serial_successes)
+
+        with override_config(app, 'MERGED_PROFILE_SHARD_SIZE', 2):
+            sharded_successes, sharded_failures, sharded_contents, sharded_counts = self._generate(profile_elements, 3)
+        assert sharded_successes == serial_successes
+        assert sharded_failures == serial_failures
+        assert sharded_counts == serial_counts
+        assert sharded_contents == serial_contents
+
+    def test_normalize_unloaded_profile_elements(self, app):
+        """Converts empty strings from unloaded rows to nulls."""
+        from nessie.jobs.generate_merged_student_feeds import GenerateMergedStudentFeeds
+        normalized = GenerateMergedStudentFeeds.normalize_profile_elements({
+            'sid': '11667051',
+            'ldap_uid': '61889',
+            'canvas_user_id': '9000100',
+            'canvas_user_name': '',
+            'degree_progress_feed': '',
+        })
+        assert normalized == {
+            'sid': '11667051',
+            'ldap_uid': '61889',
+            'canvas_user_id': 9000100,
+            'canvas_user_name': None,
+            'degree_progress_feed': None,
+        }
+
+    def test_profile_elements_streamed(self, app):
+        """Consumes profile elements as a stream, without holding the student population in memory."""
+        from nessie.jobs.generate_merged_student_feeds import GenerateMergedStudentFeeds
+        row_count = 500000
+        raw_feed = json.dumps({'names': [{'type': {'code': 'PRI'}, 'familyName': 'x' * 2000}]})
+
+        def _synthetic_rows():
+            for i in range(row_count):
+                # Rows without a UID are skipped after normalization, which keeps this test fast.
+                yield {'sid': str(i), 'ldap_uid': '', 'sis_profile_feed': raw_feed + ' ' * (i % 2)}
+
+        job = GenerateMergedStudentFeeds()
+        job.successes = []
+        job.failures = []
+        module = 'nessie.jobs.generate_merged_student_feeds'
+        with mock.patch(f'{module}.truncate_staging_table'), mock.patch(f'{module}.write_file_to_staging'),\
+                mock.patch.object(job, 'map_advisors_to_students', return_value={}),\
+                mock.patch.object(job, 'get_majors_divisions', return_value={}):
+            tracemalloc.start()
+            assert job.generate_student_profile_tables(_synthetic_rows())
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        assert len(job.failures) == row_count
+        # Holding every raw row in memory at once would take over a gigabyte.
+        assert peak < 100 * 1024 * 1024
+
+    def test_failed_profile_element_stream(self, app):
+        """Fails the job with a BackgroundJobError if profile elements cannot be streamed."""
+        from nessie.jobs.background_job import BackgroundJobError
+        from nessie.jobs.generate_merged_student_feeds import GenerateMergedStudentFeeds
+        job = GenerateMergedStudentFeeds()
+        module = 'nessie.jobs.generate_merged_student_feeds'
+        with mock.patch(f'{module}.queries.stream_all_student_profile_elements', return_value=None),\
+                mock.patch(f'{module}.truncate_staging_table'),\
+                mock.patch.object(job, 'map_advisors_to_students', return_value={}):
+            with pytest.raises(BackgroundJobError) as e:
+                job.generate_feeds()
+        assert str(e.value) == 'Failed to generate student profile tables.'
+
+    def test_incremental_profile_generation(self, app, clear_metadata_db, profile_elements):
+        """Regenerates only the profiles whose source rows changed since the previous run."""
+        from nessie.jobs.generate_merged_student_feeds import GenerateMergedStudentFeeds
+        from nessie.lib.metadata import get_merged_profile_digests, update_merged_profile_digests
+        module = 'nessie.jobs.generate_merged_student_feeds'
+
+        def _run(elements):
+            job = GenerateMergedStudentFeeds()
+            job.successes = []
+            job.failures = []
+            with override_config(app, 'MERGED_PROFILE_INCREMENTAL', True),\
+                    mock.patch(f'{module}.truncate_staging_table'),\
+                    mock.patch(f'{module}.write_file_to_staging') as write_file_to_staging,\
+                    mock.patch.object(job, 'map_advisors_to_students', return_value={}),\
+                    mock.patch.object(job, 'get_majors_divisions', return_value={}):
+                assert job.generate_student_profile_tables(elements)
+            update_merged_profile_digests(job.profile_digests, job.deleted_sids)
+            staged_tables = [c.args[0] for c in write_file_to_staging.call_args_list]
+            return job, staged_tables
+
+        job, staged_tables = _run(profile_elements)
+        assert len(job.successes) + len(job.failures) == len(profile_elements)
+        assert job.skipped_count == 0
+        assert 'student_profile_refreshed_sids' in staged_tables
+        assert set(get_merged_profile_digests().keys()) == {row['sid'] for row in profile_elements}
+
+        changed_elements = [dict(row) for row in profile_elements[:-1]]
+        changed_elements[0]['last_name'] = 'Changed'
+        job, staged_tables = _run(changed_elements)
+        assert job.successes == [changed_elements[0]['sid']]
+        assert job.failures == []
+        assert job.skipped_count == len(changed_elements) - 1
+        assert job.deleted_sids == ['9999999999']
+        assert 'student_profile_refreshed_sids' in staged_tables
+        assert set(get_merged_profile_digests().keys()) == {row['sid'] for row in changed_elements}
+
+        job, staged_tables = _run(changed_elements)
+        assert job.successes == []
+        assert job.skipped_count == len(changed_elements)
+        assert staged_tables == []
+
+        # A change to feed logic regenerates every profile.
+        with mock.patch(f'{module}.MERGED_PROFILE_DIGEST_VERSION', 'next'):
+            job, staged_tables = _run(changed_elements)
+        assert len(job.successes) + len(job.failures) == len(changed_elements)
+        assert job.skipped_count == 0
+        assert 'student_profile_refreshed_sids' in staged_tables
+
+    def test_parallel_term_feed_generation(self, app):
+        """Term-partitioned parallel generation stages the same enrollment feeds as serial generation."""
+        from nessie.jobs.generate_merged_student_feeds import GenerateMergedStudentFeeds
+        term_ids = ['2178', '2175', '2172']
+        sids = ['11667051', '2345678901', '3456789012']
+
+        def _enrollment(term_id, sid, section_id, **kwargs):
+            enrollment = {
+                'grade': 'B+', 'grade_midterm': None, 'units': 4, 'grading_basis': 'GRD', 'sis_enrollment_status': 'E',
+                'sis_term_id': int(term_id), 'ldap_uid': '61889', 'sid': sid, 'academic_career': 'UGRD',
+                'sis_course_title': 'Introduction', 'sis_course_name': f'COURSE {section_id}', 'sis_section_id': section_id,
+                'sis_primary': True, 'sis_instruction_mode': 'P', 'sis_instruction_format': 'LEC', 'sis_section_num': '001',
+                'course_requirements': None, 'drop_date': None, 'dropped': None, 'max_term_units_allowed': 20.5,
+                'min_term_units_allowed': 0.5, 'incomplete_comments': None, 'incomplete_frozen_flag': None,
+                'incomplete_lapse_grade_date': None, 'incomplete_lapse_to_grade': None, 'incomplete_status_code': None,
+                'incomplete_status_description': None,
+            }
+            enrollment.update(kwargs)
+            return enrollment
+
+        enrollments = []
+        for term_id in term_ids:
+            for i, sid in enumerate(sids):
+                enrollments.append(_enrollment(term_id, sid, 1000 + i))
+                if i == 1:
+                    enrollments.append(_enrollment(term_id, sid, 2000, incomplete_status_code='I', incomplete_frozen_flag='N'))
+                if i == 2:
+                    enrollments.append(_enrollment(term_id, sid, 3000, dropped=True, grade='W', sis_primary=None, units=None))
+        term_gpas = [
+            {'term_id': term_id, 'sid': sid, 'gpa': 3.5, 'units_taken_for_gpa': 4}
+            for term_id in term_ids for sid in sids[:2]
+        ]
+        canvas_memberships = [{
+            'term_id': term_id,
+            'sid': sids[0],
+            'sis_section_ids': '1000',
+            'feed': json.dumps({'canvasCourseId': 7654321}),
+        } for term_id in term_ids]
+
+        class _Stream(list):
+            def close(self):
+                pass
+
+        def _stream(rows, term_key):
+            return lambda term_id=None: _Stream(r for r in rows if term_id is None or str(r[term_key]) == term_id)
+
+        def _generate(max_processes):
+            staged = []
+
+            def _write_file_to_staging(table, feed_file, row_count, term_id=None):
+                feed_file.seek(0)
+                staged.append((table, term_id, row_count, sorted(feed_file.read().splitlines())))
+
+            job = GenerateMergedStudentFeeds()
+            module = 'nessie.jobs.generate_merged_student_feeds'
+            with override_config(app, 'MERGED_TERM_FEED_MAX_PROCESSES', max_processes),\
+                    mock.patch(f'{module}.write_file_to_staging', side_effect=_write_file_to_staging),\
+                    mock.patch(f'{module}.queries.get_enrollment_term_ids', return_value=term_ids),\
+                    mock.patch(f'{module}.queries.stream_sis_enrollments', side_effect=_stream(enrollments, 'sis_term_id')),\
+                    mock.patch(f'{module}.queries.stream_term_gpas', side_effect=_stream(term_gpas, 'term_id')),\
+                    mock.patch(f'{module}.queries.stream_canvas_memberships', side_effect=_stream(canvas_memberships, 'term_id')):
+                row_count = job.generate_term_feeds('student_enrollment_terms', 'student_incompletes')
+            return row_count, sorted(staged)
+
+        serial_row_count, serial_staged = _generate(1)
+        assert len(serial_staged) == 2 * len(term_ids)
+        assert b'7654321' in serial_staged[0][3][0]
+        assert b'"termGpa"' in serial_staged[0][3][0]
+        parallel_row_count, parallel_staged = _generate(3)
+        assert parallel_row_count == serial_row_count
+        assert parallel_staged == serial_staged
+
+    def test_write_file_to_staging_in_gzip_parts(self, app, student_tables):
+        """Stages feeds from gzipped parts with a single manifest COPY."""
+        from nessie.externals import s3
+        from nessie.models.student_schema_manager import staging_schema, truncate_staging_table, write_file_to_staging
+        truncate_staging_table('student_holds')
+        with mock_s3(app), tempfile.TemporaryFile() as feed_file:
+            for i in range(10):
+                feed_file.write(f'{i}\t{json.dumps({"reason": {"code": i}})}\n'.encode())
+            with mock.patch.object(redshift, 'copy_tsv_from_s3_manifest', wraps=redshift.copy_tsv_from_s3_manifest) as copy:
+                assert write_file_to_staging('student_holds', feed_file, 10)
+            assert copy.call_count == 1
+            assert len(s3.get_object_json(copy.call_args.args[1])['entries']) == app.config['REDSHIFT_COPY_GZIP_PARTS']
+        rows = redshift.fetch(f'SELECT sid, feed FROM {staging_schema()}.student_holds ORDER BY sid')
+        assert [r['sid'] for r in rows] == [str(i) for i in range(10)]
+        assert json.loads(rows[9]['feed']) == {'reason': {'code': 9}}
+        truncate_staging_table('student_holds')
@@ -63,6 +63,7 @@ class TestResyncCanvasSnapshots:
         mock_metadata(latest_sync_job, stalled, 'streaming', None)
         mock_metadata(latest_sync_job, errored, 'error', None)
         mock_metadata(latest_sync_job, size_discrepancy, 'complete', 65536)
+        metadata.flush_metadata_writes()
 
         schema = app.config['RDS_SCHEMA_METADATA']
 
@@ -71,6 +71,7 @@ class TestSyncFileToS3:
             result = SyncFileToS3().run(url=url, key=key, canvas_sync_job_id='job_2')
             assert result is False
 
+            # Each run writes its buffered events before returning.
             schema = app.config['RDS_SCHEMA_METADATA']
             sync_metadata = rds.fetch(f'SELECT * FROM {schema}.canvas_sync_job_status')
             snapshot_metadata = rds.fetch(f'SELECT * FROM {schema}.canvas_synced_snapshots')
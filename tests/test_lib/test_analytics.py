@@ -25,11 +25,16 @@ ENHANCEMENTS, OR MODIFICATIONS.
 
 import io
 from itertools import groupby
+import json
 import operator
+import random
+import time
+from unittest import mock
 
 from nessie.lib import analytics, queries
 from nessie.lib.mockingdata import MockRows, register_mock
 import pytest
+from tests.util import capture_app_logs
 
 
 # TODO fix integration with legacy GenerateMergedStudentFeeds structure
@@ -52,6 +57,158 @@ class TestAnalytics:
         assert analytics.ordinal(23) == '23rd'
 
 
+def golden_course_inputs():
+    """Return deterministic canvas site rows, enrollments and submissions exercising the corners of course analytics."""
+    rng = random.Random(2178)
+    courses = []
+
+    def _course(course_id, user_ids, score, activity, submitted=None, missing_self=(), missing_reference=()):
+        site = {
+            'canvas_course_id': course_id,
+            'canvas_course_name': f'Course {course_id}',
+            'canvas_course_code': f'CODE {course_id}',
+            'canvas_course_term': 'Fall 2017',
+            'sis_section_ids': '90100,90101',
+        }
+        enrollments = [
+            {
+                'canvas_course_id': course_id,
+                'canvas_user_id': user_id,
+                'sid': str(3000000000 + user_id),
+                'current_score': score(user_id),
+                'last_activity_at': activity(user_id),
+                'sis_section_ids': '90101,90200' if user_id % 2 else '90100',
+            } for user_id in user_ids
+        ]
+        submissions = []
+        if submitted:
+            for reference_user_id in sorted(set(user_ids)):
+                if reference_user_id in missing_reference:
+                    continue
+                for user_id in sorted(set(user_ids)):
+                    if user_id == reference_user_id and reference_user_id in missing_self:
+                        continue
+                    submissions.append({
+                        'canvas_course_id': course_id,
+                        'reference_user_id': reference_user_id,
+                        'canvas_user_id': user_id,
+                        'submissions_turned_in': submitted(reference_user_id, user_id),
+                    })
+        courses.append((site, enrollments, submissions))
+
+    # A large course with ties, missing scores, missing activity and students missing from submission comparisons.
+    scores = {u: rng.choice([None, round(rng.uniform(40, 104), 2), float(rng.randint(60, 95))]) for u in range(1000, 1060)}
+    activity = {u: rng.choice([0, None, 1535000000 + rng.randint(0, 600000), 1535340480]) for u in range(1000, 1060)}
+    _course(
+        7654321,
+        list(range(1000, 1060)),
+        scores.get,
+        activity.get,
+        submitted=lambda r, u: float((u * 7 + r) % 13 if r % 3 else u % 11),
+        missing_self=(1003, 1017),
+        missing_reference=(1005, 1041),
+    )
+    # A sparse course, with no more than ten distinct values of any metric.
+    _course(7654322, list(range(2000, 2015)), lambda u: float(u % 4 * 10), lambda u: 1535340480 + u % 3, submitted=lambda r, u: float(u % 2))
+    # A course with no scores or activity at all.
+    _course(7654323, list(range(3000, 3004)), lambda u: None, lambda u: 0, submitted=lambda r, u: 0.0)
+    # A course in which everyone has the same score and activity.
+    _course(7654324, list(range(4000, 4006)), lambda u: 88.0, lambda u: 1535340480, submitted=lambda r, u: 5.0)
+    # A course with a single student and no submissions.
+    _course(7654325, [5000], lambda u: 91.5, lambda u: 1535340480)
+    # A course listing one student twice, as for enrollment in two sections; both listings get the same analytics.
+    _course(7654326, [6000, 6001, 6001, 6002, 6003], lambda u: float(u % 5 * 11), lambda u: 1535240480 + u, submitted=lambda r, u: float(u % 3))
+    return courses
+
+
+def generate_golden_feeds():
+    output_file = io.BytesIO()
+    count = 0
+    for site, enrollments, submissions in golden_course_inputs():
+        count += analytics.generate_analytics_feeds_for_course(output_file, '2178', site, enrollments, submissions)
+    rows = [line.split(b'\t') for line in output_file.getvalue().splitlines()]
+    return count, [[sid.decode(), term_id.decode(), sections.decode(), json.loads(feed)] for sid, term_id, sections, feed in rows]
+
+
+class TestGenerateAnalyticsFeedsForCourse:
+    """Analytics feeds for all students in a course site."""
+
+    def test_golden_feeds(self, app):
+        """Generates feeds identical to those of the original per-student implementation."""
+        with open(f"{app.config['BASE_DIR']}/fixtures/analytics_feeds_golden.json") as f:
+            golden = json.load(f)
+        count, feeds = generate_golden_feeds()
+        assert count == len(golden) == 91
+        for feed, golden_feed in zip(feeds, golden):
+            assert feed == golden_feed
+
+    def test_submission_distributions_computed_once(self, app, caplog):
+        """Computes analytics once for each distinct distribution of submissions, assuming 0 for students not found."""
+        submissions = []
+        for reference_user_id in range(1, 7):
+            for canvas_user_id in range(1, 7):
+                if canvas_user_id % 2 == reference_user_id % 2 and (canvas_user_id, reference_user_id) != (5, 5):
+                    submissions.append({
+                        'reference_user_id': reference_user_id,
+                        'canvas_user_id': canvas_user_id,
+                        'submissions_turned_in': canvas_user_id,
+                    })
+        with mock.patch.object(analytics, 'analytics_for_course', wraps=analytics.analytics_for_course) as analytics_for_course:
+            with capture_app_logs(app):
+                submission_analytics = analytics.analytics_for_submissions(7654321, iter(submissions))
+        assert analytics_for_course.call_count == 3
+        assert 'Canvas user id 5, course id 7654321 not found in Data Loch assignments' in caplog.text
+        assert sorted(submission_analytics) == [1, 2, 3, 4, 5, 6]
+        assert [submission_analytics[user_id]['student']['raw'] for user_id in range(1, 7)] == [1, 2, 3, 4, 0, 6]
+        assert [submission_analytics[user_id]['displayPercentile'] for user_id in (2, 4, 6)] == ['33rd', '66th', '100th']
+        assert submission_analytics[5]['courseMean']['raw'] == 4 / 3
+
+    @pytest.mark.benchmark
+    def test_large_course_benchmark(self, app):
+        """Time feed generation for a synthetic 1,500-student course, with submissions compared within sections of 300."""
+        rng = random.Random(1500)
+        user_ids = list(range(10000, 11500))
+        site = {
+            'canvas_course_id': 7654330,
+            'canvas_course_name': 'Course 7654330',
+            'canvas_course_code': 'CODE 7654330',
+            'canvas_course_term': 'Fall 2017',
+            'sis_section_ids': '90100',
+        }
+        enrollments = [
+            {
+                'canvas_course_id': 7654330,
+                'canvas_user_id': user_id,
+                'sid': str(3000000000 + user_id),
+                'current_score': rng.choice([None, round(rng.uniform(40, 104), 2)]),
+                'last_activity_at': rng.choice([0, 1535000000 + rng.randint(0, 600000)]),
+                'sis_section_ids': '90100',
+            } for user_id in user_ids
+        ]
+        # Students in the same section share assignments, and so share a distribution of submission counts.
+        submitted = {user_id: float(rng.randint(0, 20)) for user_id in user_ids}
+        submissions = [
+            {
+                'canvas_course_id': 7654330,
+                'reference_user_id': reference_user_id,
+                'canvas_user_id': user_id,
+                'submissions_turned_in': submitted[user_id],
+            } for reference_user_id in user_ids for user_id in user_ids if (user_id - 10000) // 300 == (reference_user_id - 10000) // 300
+        ]
+
+        start = time.perf_counter()
+        submission_analytics = analytics.analytics_for_submissions(7654330, iter(submissions))
+        submissions_elapsed = time.perf_counter() - start
+        start = time.perf_counter()
+        count = analytics.generate_analytics_feeds_for_course(io.BytesIO(), '2178', site, enrollments, submissions)
+        elapsed = time.perf_counter() - start
+        assert len(submission_analytics) == count == 1500
+        app.logger.info(
+            f'Generated {count} analytics feeds from {len(submissions)} submission comparisons in {elapsed:.2f}s '
+            f'(submission analytics alone {submissions_elapsed:.2f}s)',
+        )
+
+
 def get_relative_submission_counts():
     all_counts = queries.get_advisee_submissions_sorted('2178')
     for canvas_user_id, sites_grp in groupby(all_counts, key=operator.itemgetter('reference_user_id')):
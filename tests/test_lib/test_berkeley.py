@@ -23,12 +23,30 @@ SOFTWARE AND ACCOMPANYING DOCUMENTATION, IF ANY, PROVIDED HEREUNDER IS PROVIDED
 ENHANCEMENTS, OR MODIFICATIONS.
 """
 
+import re
+import time
+
 from nessie.externals import rds
 from nessie.lib import berkeley
 from nessie.lib.util import resolve_sql_template
 import pytest
 
 
+def _distinct_plans():
+    plans = []
+    for plan in berkeley.ACADEMIC_PLAN_TO_DEGREE_PROGRAM_PAGE.keys():
+        plans += [f'{plan} BA', f'{plan} BS', f'{plan} UG', f'{plan} MS', f'{plan} UG BA', f'{plan}', f'Pre-{plan} BA', f'{plan} BAH']
+    return list(dict.fromkeys(plans))
+
+
+def _regex_scan(plan_description):
+    matched = next(
+        (k for k in berkeley.ACADEMIC_PLAN_TO_DEGREE_PROGRAM_PAGE.keys() if re.match(r'^' + re.escape(k) + r' (BA|BS|UG)', plan_description)),
+        None,
+    )
+    return matched and f'http://guide.berkeley.edu/undergraduate/degree-programs/{berkeley.ACADEMIC_PLAN_TO_DEGREE_PROGRAM_PAGE[matched]}/'
+
+
 @pytest.fixture
 def current_term_index(app):
     current_term_name = app.config['CURRENT_TERM']
@@ -94,6 +112,35 @@ class TestBerkeleyDegreeProgramUrl:
         assert berkeley.degree_program_url_for_major('Altaic Language BA') is None
         assert berkeley.degree_program_url_for_major('Entomology BS') is None
 
+    def test_matches_regex_scan(self):
+        """Single-pass matching agrees with a regex scan over every mapped plan, with or without cached results."""
+        plans = _distinct_plans()
+        berkeley.degree_program_url_for_major.cache_clear()
+        assert [berkeley.degree_program_url_for_major(plan) for plan in plans] == [_regex_scan(plan) for plan in plans]
+        assert [berkeley.degree_program_url_for_major(plan) for plan in plans] == [_regex_scan(plan) for plan in plans]
+
+    @pytest.mark.benchmark
+    def test_matching_benchmark(self, app):
+        """Compare single-pass matching, uncached and cached, with a regex scan over every mapped plan."""
+        plans = _distinct_plans()
+        start = time.perf_counter()
+        for plan in plans:
+            _regex_scan(plan)
+        regex_scan_elapsed = time.perf_counter() - start
+        berkeley.degree_program_url_for_major.cache_clear()
+        start = time.perf_counter()
+        for plan in plans:
+            berkeley.degree_program_url_for_major(plan)
+        uncached_elapsed = time.perf_counter() - start
+        start = time.perf_counter()
+        for plan in plans:
+            berkeley.degree_program_url_for_major(plan)
+        cached_elapsed = time.perf_counter() - start
+        app.logger.info(
+            f'Matched {len(plans)} distinct plans: regex scan {regex_scan_elapsed:.4f}s, '
+            f'uncached {uncached_elapsed:.4f}s, cached {cached_elapsed:.4f}s',
+        )
+
 
 class TestBerkeley:
 
@@ -0,0 +1,120 @@
+"""
+Copyright ©2024. The Regents of the University of California (Regents). All Rights Reserved.
+
+Permission to use, copy, modify, and distribute this software and its documentation
+for educational, research, and not-for-profit purposes, without fee and without a
+signed licensing agreement, is hereby granted, provided that the above copyright
+notice, this paragraph and the following two paragraphs appear in all copies,
+modifications, and distributions.
+
+Contact The Office of Technology Licensing, UC Berkeley, 2150 Shattuck Avenue,
+Suite 510, Berkeley, CA 94720-1620, (510) 643-7201, otl@berkeley.edu,
+http://ipira.berkeley.edu/industry-info for commercial licensing opportunities.
+
+IN NO EVENT SHALL REGENTS BE LIABLE TO ANY PARTY FOR DIRECT, INDIRECT, SPECIAL,
+INCIDENTAL, OR CONSEQUENTIAL DAMAGES, INCLUDING LOST PROFITS, ARISING OUT OF
+THE USE OF THIS SOFTWARE AND ITS DOCUMENTATION, EVEN IF REGENTS HAS BEEN ADVISED
+OF THE POSSIBILITY OF SUCH DAMAGE.
+
+REGENTS SPECIFICALLY DISCLAIMS ANY WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE. THE
+SOFTWARE AND ACCOMPANYING DOCUMENTATION, IF ANY, PROVIDED HEREUNDER IS PROVIDED
+"AS IS". REGENTS HAS NO OBLIGATION TO PROVIDE MAINTENANCE, SUPPORT, UPDATES,
+ENHANCEMENTS, OR MODIFICATIONS.
+"""
+
+from nessie.externals import rds
+from nessie.lib.db import connection_pool_metrics, ConnectionPool
+import psycopg2.extensions
+
+
+def _pool(app, **kwargs):
+    args = {
+        'max_size': 2,
+        'max_idle_seconds': 300,
+        'health_check_seconds': 30,
+        **kwargs,
+    }
+    return ConnectionPool(name='test', connect_args={'uri': app.config['SQLALCHEMY_DATABASE_URI']}, **args)
+
+
+class TestConnectionPool:
+    """Pooled database connections."""
+
+    def test_reuses_connection(self, app):
+        pool = _pool(app)
+        connection = pool.checkout(autocommit=True)
+        pool.release(connection)
+        assert pool.checkout(autocommit=True) is connection
+        pool.release(connection)
+        metrics = pool.metrics()
+        assert metrics['created'] == 1
+        assert metrics['reused'] == 1
+        assert metrics['checked_out'] == 0
+        assert metrics['idle'] == 1
+        pool.close_all()
+
+    def test_rolls_back_on_release(self, app):
+        pool = _pool(app)
+        connection = pool.checkout(autocommit=False)
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+        assert connection.info.transaction_status == psycopg2.extensions.TRANSACTION_STATUS_INTRANS
+        pool.release(connection)
+        assert connection.info.transaction_status == psycopg2.extensions.TRANSACTION_STATUS_IDLE
+        assert pool.checkout(autocommit=True) is connection
+        assert connection.autocommit is True
+        pool.release(connection)
+        pool.close_all()
+
+    def test_overflow_connections_closed_on_release(self, app):
+        pool = _pool(app, max_size=1)
+        first = pool.checkout(autocommit=True)
+        second = pool.checkout(autocommit=True)
+        assert pool.metrics()['checked_out'] == 2
+        pool.release(first)
+        pool.release(second)
+        assert second.closed
+        metrics = pool.metrics()
+        assert metrics['idle'] == 1
+        assert metrics['discarded'] == 1
+        pool.close_all()
+
+    def test_evicts_idle_connections(self, app):
+        pool = _pool(app, max_idle_seconds=0)
+        connection = pool.checkout(autocommit=True)
+        pool.release(connection)
+        assert pool.checkout(autocommit=True) is not connection
+        assert connection.closed
+        assert pool.metrics()['evicted'] == 1
+        pool.close_all()
+
+    def test_health_check_replaces_dead_connection(self, app):
+        pool = _pool(app, health_check_seconds=0)
+        connection = pool.checkout(autocommit=True)
+        pid = connection.info.backend_pid
+        pool.release(connection)
+        rds.execute('SELECT pg_terminate_backend(%s)', params=(pid,))
+        replacement = pool.checkout(autocommit=True)
+        assert replacement is not connection
+        with replacement.cursor() as cursor:
+            cursor.execute('SELECT 1')
+            assert cursor.fetchone()[0] == 1
+        pool.release(replacement)
+        metrics = pool.metrics()
+        assert metrics['failed_health_checks'] == 1
+        assert metrics['created'] == 2
+        pool.close_all()
+
+    def test_clients_share_pool(self, app):
+        assert rds.fetch('SELECT 1 AS one')[0]['one'] == 1
+        assert rds.fetch('SELECT 2 AS two')[0]['two'] == 2
+        metrics = next(m for name, m in connection_pool_metrics().items() if name.endswith('/nessie_test'))
+        assert metrics['reused'] >= 1
+        assert metrics['checked_out'] == 0
+
+    def test_transaction_committed_with_sql(self, app):
+        with rds.transaction() as transaction:
+            transaction.execute('SELECT 1')
+            transaction.commit()
+        assert rds.fetch('SELECT 1 AS one')[0]['one'] == 1
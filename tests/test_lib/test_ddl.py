@@ -0,0 +1,94 @@
+"""
+Copyright ©2024. The Regents of the University of California (Regents). All Rights Reserved.
+
+Permission to use, copy, modify, and distribute this software and its documentation
+for educational, research, and not-for-profit purposes, without fee and without a
+signed licensing agreement, is hereby granted, provided that the above copyright
+notice, this paragraph and the following two paragraphs appear in all copies,
+modifications, and distributions.
+
+Contact The Office of Technology Licensing, UC Berkeley, 2150 Shattuck Avenue,
+Suite 510, Berkeley, CA 94720-1620, (510) 643-7201, otl@berkeley.edu,
+http://ipira.berkeley.edu/industry-info for commercial licensing opportunities.
+
+IN NO EVENT SHALL REGENTS BE LIABLE TO ANY PARTY FOR DIRECT, INDIRECT, SPECIAL,
+INCIDENTAL, OR CONSEQUENTIAL DAMAGES, INCLUDING LOST PROFITS, ARISING OUT OF
+THE USE OF THIS SOFTWARE AND ITS DOCUMENTATION, EVEN IF REGENTS HAS BEEN ADVISED
+OF THE POSSIBILITY OF SUCH DAMAGE.
+
+REGENTS SPECIFICALLY DISCLAIMS ANY WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE. THE
+SOFTWARE AND ACCOMPANYING DOCUMENTATION, IF ANY, PROVIDED HEREUNDER IS PROVIDED
+"AS IS". REGENTS HAS NO OBLIGATION TO PROVIDE MAINTENANCE, SUPPORT, UPDATES,
+ENHANCEMENTS, OR MODIFICATIONS.
+"""
+
+from nessie.lib.ddl import ddl_dependencies, parse_ddl_statement, split_ddl_script
+
+
+def _parse(sql):
+    return [parse_ddl_statement(s) for s in split_ddl_script(sql)]
+
+
+class TestParseDdlStatement:
+
+    def test_create_table_as(self):
+        statement = parse_ddl_statement("""
+            /* Comments mentioning other.tables are ignored. */
+            CREATE TABLE boac.enrollments
+            SORTKEY (sid)
+            AS (SELECT e.sid, c.title FROM edl.enrollments e JOIN "edl"."Courses" c ON e.section_id = c.section_id)""")
+        assert statement.writes == {'boac.enrollments'}
+        assert {'edl.enrollments', 'edl.courses'} <= statement.reads
+        assert not statement.session_bound
+
+    def test_external_table(self):
+        statement = parse_ddl_statement("""CREATE EXTERNAL TABLE "canvas"."accounts" (id BIGINT)
+            LOCATION 's3://bucket/canvas.accounts/'
+            TABLE PROPERTIES ('skip.header.line.count'='1')""")
+        assert statement.writes == {'canvas.accounts'}
+        assert statement.reads == set()
+
+    def test_drop_writes_all_tables(self):
+        assert parse_ddl_statement('DROP TABLE IF EXISTS boac.one, boac.two').writes == {'boac.one', 'boac.two'}
+
+    def test_barriers(self):
+        for sql in [
+            'CREATE SCHEMA boac',
+            'DROP SCHEMA IF EXISTS boac CASCADE',
+            'GRANT SELECT ON ALL TABLES IN SCHEMA boac TO GROUP readers',
+            'ALTER TABLE boac.staging RENAME TO students',
+            'INSERT INTO students SELECT * FROM boac.staging',
+        ]:
+            assert parse_ddl_statement(sql).writes is None
+
+    def test_session_bound(self):
+        for sql in ['BEGIN TRANSACTION', 'COMMIT', 'SET search_path TO boac', 'CREATE TEMP TABLE staging AS (SELECT 1)']:
+            statement = parse_ddl_statement(sql)
+            assert statement.writes is None
+            assert statement.session_bound
+        assert not parse_ddl_statement('UPDATE boac.courses SET is_primary = TRUE').session_bound
+
+
+class TestDdlDependencies:
+
+    def test_independent_statements(self):
+        statements = _parse("""
+            CREATE SCHEMA boac;
+            CREATE TABLE boac.one AS (SELECT * FROM edl.courses);
+            CREATE TABLE boac.two AS (SELECT * FROM edl.courses);
+            CREATE TABLE boac.three AS (SELECT * FROM boac.one JOIN boac.two USING (id));
+            UPDATE boac.one SET title = NULL;
+            GRANT SELECT ON ALL TABLES IN SCHEMA boac TO GROUP readers;
+            CREATE TABLE boac.four AS (SELECT 1);
+        """)
+        assert ddl_dependencies(statements) == [set(), {0}, {0}, {0, 1, 2}, {0, 1, 3}, {0, 1, 2, 3, 4}, {5}]
+
+    def test_drop_and_recreate(self):
+        statements = _parse("""
+            CREATE TABLE boac.one AS (SELECT 1);
+            CREATE TABLE boac.two AS (SELECT * FROM boac.one);
+            DROP TABLE boac.one;
+            CREATE TABLE boac.one AS (SELECT 2);
+        """)
+        assert ddl_dependencies(statements) == [set(), {0}, {0, 1}, {2}]
@@ -0,0 +1,93 @@
+"""
+Copyright ©2024. The Regents of the University of California (Regents). All Rights Reserved.
+
+Permission to use, copy, modify, and distribute this software and its documentation
+for educational, research, and not-for-profit purposes, without fee and without a
+signed licensing agreement, is hereby granted, provided that the above copyright
+notice, this paragraph and the following two paragraphs appear in all copies,
+modifications, and distributions.
+
+Contact The Office of Technology Licensing, UC Berkeley, 2150 Shattuck Avenue,
+Suite 510, Berkeley, CA 94720-1620, (510) 643-7201, otl@berkeley.edu,
+http://ipira.berkeley.edu/industry-info for commercial licensing opportunities.
+
+IN NO EVENT SHALL REGENTS BE LIABLE TO ANY PARTY FOR DIRECT, INDIRECT, SPECIAL,
+INCIDENTAL, OR CONSEQUENTIAL DAMAGES, INCLUDING LOST PROFITS, ARISING OUT OF
+THE USE OF THIS SOFTWARE AND ITS DOCUMENTATION, EVEN IF REGENTS HAS BEEN ADVISED
+OF THE POSSIBILITY OF SUCH DAMAGE.
+
+REGENTS SPECIFICALLY DISCLAIMS ANY WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE. THE
+SOFTWARE AND ACCOMPANYING DOCUMENTATION, IF ANY, PROVIDED HEREUNDER IS PROVIDED
+"AS IS". REGENTS HAS NO OBLIGATION TO PROVIDE MAINTENANCE, SUPPORT, UPDATES,
+ENHANCEMENTS, OR MODIFICATIONS.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+from nessie.externals import rds, redshift
+from nessie.lib.instrumentation import current_job_id, query_fingerprint, query_instrumentation, submit_in_context
+
+
+class TestQueryFingerprint:
+
+    def test_normalizes_literals_comments_and_whitespace(self):
+        first = query_fingerprint("""SELECT * FROM boac.students -- current term only
+            WHERE term_id = '2178' AND units > 12.5 AND sid IN ('1', '2', '3')""")
+        second = query_fingerprint("SELECT * FROM boac.students WHERE term_id = '2182' AND units > 4 AND sid IN ('9')")
+        assert first == second == 'SELECT * FROM boac.students WHERE term_id = ? AND units > ? AND sid IN (?)'
+
+    def test_keeps_digits_in_identifiers(self):
+        assert query_fingerprint('SELECT * FROM term_2178.sections') == 'SELECT * FROM term_2178.sections'
+
+
+class TestQueryInstrumentation:
+
+    def test_records_queries(self, app):
+        with query_instrumentation() as queries:
+            for sid in ['1', '2']:
+                rds.fetch(f"SELECT '{sid}' AS sid")
+            redshift.fetch('SELECT generate_series(1, 10) AS n')
+            assert len(list(redshift.fetch_iter('SELECT generate_series(1, 25) AS n', chunk_size=10))) == 25
+        stats = {(s.client, s.fingerprint): s for s in queries.top()}
+        assert stats[('rds', 'SELECT ? AS sid')].calls == 2
+        assert stats[('rds', 'SELECT ? AS sid')].rows == 2
+        assert stats[('redshift', 'SELECT generate_series(?) AS n')].calls == 2
+        assert stats[('redshift', 'SELECT generate_series(?) AS n')].rows == 35
+        assert all(s.max_seconds <= s.total_seconds for s in stats.values())
+
+        summary = queries.summary()
+        assert summary.startswith('4 queries in ')
+        assert '[redshift] 2 calls' in summary
+        assert '[rds] 2 calls' in summary
+
+    def test_outside_instrumentation(self, app):
+        with query_instrumentation() as queries:
+            pass
+        rds.fetch('SELECT 1')
+        assert queries.summary() is None
+
+    def test_nested_and_threaded(self, app):
+        with query_instrumentation() as outer:
+            with query_instrumentation() as inner:
+                with ThreadPoolExecutor(max_workers=2) as executor:
+
+                    def _query(n):
+                        with app.app_context():
+                            return redshift.fetch(f'SELECT {n} AS n')
+                    futures = [submit_in_context(executor, _query, n) for n in range(3)]
+                    assert [f.result()[0]['n'] for f in futures] == [0, 1, 2]
+            rds.fetch('SELECT 1')
+        assert [(s.client, s.calls) for s in inner.top()] == [('redshift', 3)]
+        assert sorted((s.client, s.calls) for s in outer.top()) == [('rds', 1), ('redshift', 3)]
+
+    def test_current_job_id(self, app):
+        assert current_job_id() is None
+        with query_instrumentation(job_id='ChainedBackgroundJob_1'):
+            assert current_job_id() == 'ChainedBackgroundJob_1'
+            with query_instrumentation(job_id='GenerateMergedStudentFeeds_2'):
+                with ThreadPoolExecutor(max_workers=1) as executor:
+                    assert submit_in_context(executor, current_job_id).result() == 'GenerateMergedStudentFeeds_2'
+            with query_instrumentation():
+                assert current_job_id() == 'ChainedBackgroundJob_1'
+        assert current_job_id() is None
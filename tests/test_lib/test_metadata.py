@@ -0,0 +1,111 @@
+"""
+Copyright ©2024. The Regents of the University of California (Regents). All Rights Reserved.
+
+Permission to use, copy, modify, and distribute this software and its documentation
+for educational, research, and not-for-profit purposes, without fee and without a
+signed licensing agreement, is hereby granted, provided that the above copyright
+notice, this paragraph and the following two paragraphs appear in all copies,
+modifications, and distributions.
+
+Contact The Office of Technology Licensing, UC Berkeley, 2150 Shattuck Avenue,
+Suite 510, Berkeley, CA 94720-1620, (510) 643-7201, otl@berkeley.edu,
+http://ipira.berkeley.edu/industry-info for commercial licensing opportunities.
+
+IN NO EVENT SHALL REGENTS BE LIABLE TO ANY PARTY FOR DIRECT, INDIRECT, SPECIAL,
+INCIDENTAL, OR CONSEQUENTIAL DAMAGES, INCLUDING LOST PROFITS, ARISING OUT OF
+THE USE OF THIS SOFTWARE AND ITS DOCUMENTATION, EVEN IF REGENTS HAS BEEN ADVISED
+OF THE POSSIBILITY OF SUCH DAMAGE.
+
+REGENTS SPECIFICALLY DISCLAIMS ANY WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE. THE
+SOFTWARE AND ACCOMPANYING DOCUMENTATION, IF ANY, PROVIDED HEREUNDER IS PROVIDED
+"AS IS". REGENTS HAS NO OBLIGATION TO PROVIDE MAINTENANCE, SUPPORT, UPDATES,
+ENHANCEMENTS, OR MODIFICATIONS.
+"""
+
+import time
+from unittest import mock
+
+from nessie.externals import rds
+from nessie.lib import metadata
+from tests.util import mock_s3, override_config
+
+
+def _sync_statuses(app):
+    return rds.fetch(f"SELECT * FROM {app.config['RDS_SCHEMA_METADATA']}.canvas_sync_job_status ORDER BY filename")
+
+
+class TestMetadataWriter:
+    """Batched metadata writes."""
+
+    def test_merges_events_into_one_write(self, app, clear_metadata_db):
+        with mock_s3(app), override_config(app, 'METADATA_WRITER_BATCH_SIZE', 100):
+            for i in range(3):
+                key = f'canvas/quiz_dim/quiz_dim-{i}.gz'
+                metadata.create_canvas_sync_status('sync_1', f'quiz_dim-{i}.gz', 'quiz_dim', f'https://canvas/quiz_dim-{i}.gz')
+                metadata.update_canvas_sync_status('sync_1', key, 'streaming', source_size='1024')
+                metadata.update_canvas_sync_status('sync_1', key, 'complete', destination_size=1024)
+                metadata.create_canvas_snapshot(key, 1024)
+            assert _sync_statuses(app) == []
+            assert metadata.flush_metadata_writes()
+
+        rows = _sync_statuses(app)
+        assert len(rows) == 3
+        for i, row in enumerate(rows):
+            assert row['filename'] == f'quiz_dim-{i}.gz'
+            assert row['canvas_table'] == 'quiz_dim'
+            assert row['status'] == 'complete'
+            assert row['source_size'] == 1024
+            assert row['destination_size'] == 1024
+            assert row['destination_url'] == f's3://mock-bucket/canvas/quiz_dim/quiz_dim-{i}.gz'
+        snapshots = rds.fetch(f"SELECT * FROM {app.config['RDS_SCHEMA_METADATA']}.canvas_synced_snapshots")
+        assert len(snapshots) == 3
+
+    def test_updates_existing_rows(self, app, clear_metadata_db):
+        with mock_s3(app), override_config(app, 'METADATA_WRITER_BATCH_SIZE', 100):
+            metadata.create_canvas_sync_status('sync_1', 'quiz_dim-0.gz', 'quiz_dim', 'https://canvas/quiz_dim-0.gz')
+            metadata.update_canvas_sync_status('sync_1', 'canvas/quiz_dim/quiz_dim-0.gz', 'streaming', source_size=2048)
+            metadata.create_canvas_sync_status('sync_1', 'quiz_dim-1.gz', 'quiz_dim', 'https://canvas/quiz_dim-1.gz')
+            metadata.flush_metadata_writes()
+            metadata.update_canvas_sync_status('sync_1', 'canvas/quiz_dim/quiz_dim-0.gz', 'error', details='Connection reset')
+            metadata.update_canvas_sync_status('sync_1', 'canvas/quiz_dim/quiz_dim-1.gz', 'duplicate')
+            metadata.flush_metadata_writes()
+
+        rows = _sync_statuses(app)
+        assert [r['status'] for r in rows] == ['error', 'duplicate']
+        assert rows[0]['details'] == 'Connection reset'
+        assert rows[0]['source_size'] == 2048
+        assert rows[1]['details'] is None
+        assert rows[1]['source_size'] is None
+        assert all(r['updated_at'] > r['created_at'] for r in rows)
+
+    def test_keeps_events_after_failed_write(self, app, clear_metadata_db):
+        with mock_s3(app), override_config(app, 'METADATA_WRITER_BATCH_SIZE', 100):
+            metadata.create_canvas_sync_status('sync_1', 'quiz_dim-0.gz', 'quiz_dim', 'https://canvas/quiz_dim-0.gz')
+            metadata.create_canvas_snapshot('canvas/quiz_dim/quiz_dim-0.gz', 1024)
+            with mock.patch('nessie.lib.metadata._write_canvas_snapshots', return_value=False):
+                assert metadata.flush_metadata_writes() is None
+            assert _sync_statuses(app) == []
+            assert metadata.flush_metadata_writes()
+
+        assert len(_sync_statuses(app)) == 1
+        snapshots = rds.fetch(f"SELECT * FROM {app.config['RDS_SCHEMA_METADATA']}.canvas_synced_snapshots")
+        assert len(snapshots) == 1
+
+    def test_flushes_at_batch_size(self, app, clear_metadata_db):
+        with override_config(app, 'METADATA_WRITER_BATCH_SIZE', 2):
+            metadata.create_canvas_sync_status('sync_1', 'quiz_dim-0.gz', 'quiz_dim', 'https://canvas/quiz_dim-0.gz')
+            assert _sync_statuses(app) == []
+            metadata.create_canvas_sync_status('sync_1', 'quiz_dim-1.gz', 'quiz_dim', 'https://canvas/quiz_dim-1.gz')
+            assert len(_sync_statuses(app)) == 2
+
+    def test_flushes_after_interval(self, app, clear_metadata_db):
+        with override_config(app, 'METADATA_WRITER_FLUSH_SECONDS', 0.1):
+            metadata.create_canvas_sync_status('sync_1', 'quiz_dim-0.gz', 'quiz_dim', 'https://canvas/quiz_dim-0.gz')
+            time.sleep(0.5)
+        assert len(_sync_statuses(app)) == 1
+
+    def test_job_status_flushes_pending_events(self, app, clear_metadata_db):
+        metadata.create_canvas_sync_status('sync_1', 'quiz_dim-0.gz', 'quiz_dim', 'https://canvas/quiz_dim-0.gz')
+        metadata.update_background_job_status('sync_1', 'succeeded')
+        assert len(_sync_statuses(app)) == 1
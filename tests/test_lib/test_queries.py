@@ -140,7 +140,7 @@ class TestQueries:
         } == data[0]
 
     def test_user_for_uid(self, app):
-        data = queries.get_all_student_profile_elements()
+        data = queries.stream_all_student_profile_elements()
         oliver = next(r for r in data if r['ldap_uid'] == '2040')
         assert oliver['canvas_user_id'] == 10001
         assert oliver['canvas_user_name'] == 'Oliver Heyer'
@@ -0,0 +1,75 @@
+"""
+Copyright ©2024. The Regents of the University of California (Regents). All Rights Reserved.
+
+Permission to use, copy, modify, and distribute this software and its documentation
+for educational, research, and not-for-profit purposes, without fee and without a
+signed licensing agreement, is hereby granted, provided that the above copyright
+notice, this paragraph and the following two paragraphs appear in all copies,
+modifications, and distributions.
+
+Contact The Office of Technology Licensing, UC Berkeley, 2150 Shattuck Avenue,
+Suite 510, Berkeley, CA 94720-1620, (510) 643-7201, otl@berkeley.edu,
+http://ipira.berkeley.edu/industry-info for commercial licensing opportunities.
+
+IN NO EVENT SHALL REGENTS BE LIABLE TO ANY PARTY FOR DIRECT, INDIRECT, SPECIAL,
+INCIDENTAL, OR CONSEQUENTIAL DAMAGES, INCLUDING LOST PROFITS, ARISING OUT OF
+THE USE OF THIS SOFTWARE AND ITS DOCUMENTATION, EVEN IF REGENTS HAS BEEN ADVISED
+OF THE POSSIBILITY OF SUCH DAMAGE.
+
+REGENTS SPECIFICALLY DISCLAIMS ANY WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE. THE
+SOFTWARE AND ACCOMPANYING DOCUMENTATION, IF ANY, PROVIDED HEREUNDER IS PROVIDED
+"AS IS". REGENTS HAS NO OBLIGATION TO PROVIDE MAINTENANCE, SUPPORT, UPDATES,
+ENHANCEMENTS, OR MODIFICATIONS.
+"""
+
+import random
+
+from nessie.lib.stats import SortedColumn
+import numpy
+import pandas
+import pytest
+from scipy.stats import percentileofscore
+
+
+def sample_columns():
+    rng = random.Random(2178)
+    return [
+        [rng.randint(0, 20) for _ in range(rng.randint(1, 300))] for _ in range(20)
+    ] + [
+        [rng.uniform(0, 100) for _ in range(rng.randint(1, 300))] for _ in range(20)
+    ] + [
+        [0.0],
+        [5.0] * 7,
+        [1538000000.0, 0.0, 1538100000.0, 1538100000.0],
+    ]
+
+
+class TestSortedColumn:
+
+    def test_percentile_of_score_matches_scipy(self):
+        for values in sample_columns():
+            column = SortedColumn(values)
+            scores = sorted(set(values)) + [min(values) - 1, max(values) + 1, numpy.mean(values)]
+            for kind in ['weak', 'strict']:
+                expected = [percentileofscore(values, score, kind=kind) for score in scores]
+                assert column.percentile_of_score(numpy.array(scores), kind=kind).tolist() == expected
+                assert [column.percentile_of_score(score, kind=kind) for score in scores] == expected
+
+    def test_quantiles_match_pandas(self):
+        for values in sample_columns():
+            series = pandas.Series(values, dtype=float)
+            expected = [series.quantile(n / 10) for n in range(0, 11)]
+            assert SortedColumn(values).quantiles(10).tolist() == expected
+
+    def test_rank_pct_matches_pandas(self):
+        for values in sample_columns():
+            expected = pandas.Series(values, dtype=float).rank(pct=True, method='max').tolist()
+            assert SortedColumn(values).rank_pct(numpy.array(values)).tolist() == expected
+
+    def test_empty_column(self):
+        assert numpy.isnan(SortedColumn([]).percentile_of_score(1.0))
+
+    def test_unsupported_kind(self):
+        with pytest.raises(ValueError):
+            SortedColumn([1.0]).percentile_of_score(1.0, kind='mean')
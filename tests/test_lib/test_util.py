@@ -24,9 +24,74 @@ ENHANCEMENTS, OR MODIFICATIONS.
 """
 
 from datetime import datetime
+import json
+import tempfile
+import time
 from unittest import mock
 
-from nessie.lib import util
+from nessie.lib import analytics, util
+import pandas
+import pytest
+from tests.util import override_config
+
+
+def _profile_feed(i):
+    return {
+        'sid': str(11667051 + i),
+        'uid': str(61889 + i),
+        'firstName': 'Deborah',
+        'lastName': 'Hernández',
+        'name': 'Deborah Hernández',
+        'canvasUserId': 9000100 + i,
+        'advisors': [{'uid': '1133399', 'firstName': 'Sheila', 'lastName': 'Nickerson', 'role': 'College Advisor', 'plan': 'English BA'}],
+        'sisProfile': {
+            'academicCareer': 'UGRD',
+            'cumulativeGPA': 3.8,
+            'cumulativeUnits': 101.3,
+            'level': {'code': '30', 'description': 'Junior'},
+            'plans': [{'description': 'English BA', 'program': 'Undergrad Letters & Science', 'status': 'Active'}] * 3,
+            'termsInAttendance': 5,
+            'transfer': False,
+            'withdrawalCancel': None,
+        },
+        'demographics': {'gender': 'F', 'ethnicities': ['White', 'Mexican / Mexican-American / Chicano'], 'visa': None},
+    }
+
+
+def _term_feed(i):
+    return {
+        'termId': '2178',
+        'termName': 'Fall 2017',
+        'enrolledUnits': 12.5,
+        'enrollments': [{
+            'displayName': f'COURSE {n}',
+            'title': 'Gilgamesh: King, Hero, and God',
+            'canvasSites': [],
+            'grade': 'A-',
+            'gradingBasis': 'Letter',
+            'midtermGrade': None,
+            'units': 4,
+            'sections': [{'ccn': 90100 + n, 'component': 'LEC', 'enrollmentStatus': 'E', 'primary': True, 'sectionNumber': '001', 'units': 4.0}],
+        } for n in range(4)],
+        'termGpa': {'gpa': 3.5, 'unitsTakenForGpa': 16.0},
+    }
+
+
+def _analytics_feed(i):
+    df = pandas.DataFrame({
+        'current_score': [40.0 + (i + n) % 17 * 3.5 for n in range(30)],
+        'last_activity_at': [1535000000 + (i + n) % 11 * 3600 for n in range(30)],
+    })
+    distributions = analytics.get_distributions_for_metric(df, ['current_score', 'last_activity_at'])
+    return {
+        'canvasCourseId': 7654320 + i,
+        'courseName': 'Introduction to Economics',
+        'analytics': {
+            'currentScore': analytics.analytics_for_course(distributions, 'current_score'),
+            'lastActivity': analytics.analytics_for_course(distributions, 'last_activity_at'),
+            'courseEnrollmentCount': 30,
+        },
+    }
 
 
 class TestUtil:
@@ -83,3 +148,41 @@ class TestUtil:
         assert len(paths) == 2
         assert paths[0] == f'{prefix}/2019/09/20'
         assert paths[1] == f'{prefix}/2019/09/21'
+
+    def test_encoded_tsv_row(self):
+        """Encodes strings, bytes and nulls into a TSV row."""
+        assert util.encoded_tsv_row(['11667051', None, 2178, b'{"a":1}', 'Hernández']) == '11667051\t\t2178\t{"a":1}\tHernández'.encode()
+
+    def test_json_serializer_byte_compatibility(self, app):
+        """The stdlib serializer reproduces json.dumps output byte for byte; orjson output, NumPy values included, parses alike."""
+        feeds = [_profile_feed(i) for i in range(10)] + [_term_feed(i) for i in range(10)] + [_analytics_feed(i) for i in range(10)]
+        feeds.append({2178: [None, True, 1e16, -0.5]})
+        with override_config(app, 'JSON_SERIALIZER', 'stdlib'):
+            for feed in feeds:
+                assert util.json_dumpb(feed) == json.dumps(feed).encode()
+                assert util.encoded_tsv_row(['11667051', util.json_dumpb(feed)]) == '\t'.join(['11667051', json.dumps(feed)]).encode()
+        if util.orjson:
+            for feed in feeds:
+                assert json.loads(util.json_dumpb(feed)) == json.loads(json.dumps(feed))
+
+    def test_json_serializer_fallback(self, app):
+        """Falls back to the standard library if orjson is not installed."""
+        with mock.patch('nessie.lib.util.orjson', None):
+            assert util.json_dumpb({'termName': 'Fall 2017'}) == b'{"termName": "Fall 2017"}'
+
+    @pytest.mark.benchmark
+    @pytest.mark.skipif(not util.orjson, reason='orjson is not installed')
+    def test_json_serializer_benchmark(self, app):
+        """Compare profile and term feed rows/sec written with orjson and with the standard library."""
+        row_count = 5000
+        feeds = {'profile': [_profile_feed(i) for i in range(row_count)], 'term': [_term_feed(i) for i in range(row_count)]}
+        rates = {}
+        for serializer in ('stdlib', 'orjson'):
+            with override_config(app, 'JSON_SERIALIZER', serializer), tempfile.TemporaryFile() as f:
+                for writer, writer_feeds in feeds.items():
+                    start = time.perf_counter()
+                    for feed in writer_feeds:
+                        util.write_to_tsv_file(f, [feed['termId'] if writer == 'term' else feed['sid'], util.json_dumpb(feed)])
+                    rates[(writer, serializer)] = int(row_count / (time.perf_counter() - start))
+        for writer in feeds.keys():
+            app.logger.info(f"{writer} feed rows/sec: {rates[(writer, 'stdlib')]} stdlib, {rates[(writer, 'orjson')]} orjson")
@@ -0,0 +1,84 @@
+"""
+Copyright ©2024. The Regents of the University of California (Regents). All Rights Reserved.
+
+Permission to use, copy, modify, and distribute this software and its documentation
+for educational, research, and not-for-profit purposes, without fee and without a
+signed licensing agreement, is hereby granted, provided that the above copyright
+notice, this paragraph and the following two paragraphs appear in all copies,
+modifications, and distributions.
+
+Contact The Office of Technology Licensing, UC Berkeley, 2150 Shattuck Avenue,
+Suite 510, Berkeley, CA 94720-1620, (510) 643-7201, otl@berkeley.edu,
+http://ipira.berkeley.edu/industry-info for commercial licensing opportunities.
+
+IN NO EVENT SHALL REGENTS BE LIABLE TO ANY PARTY FOR DIRECT, INDIRECT, SPECIAL,
+INCIDENTAL, OR CONSEQUENTIAL DAMAGES, INCLUDING LOST PROFITS, ARISING OUT OF
+THE USE OF THIS SOFTWARE AND ITS DOCUMENTATION, EVEN IF REGENTS HAS BEEN ADVISED
+OF THE POSSIBILITY OF SUCH DAMAGE.
+
+REGENTS SPECIFICALLY DISCLAIMS ANY WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE. THE
+SOFTWARE AND ACCOMPANYING DOCUMENTATION, IF ANY, PROVIDED HEREUNDER IS PROVIDED
+"AS IS". REGENTS HAS NO OBLIGATION TO PROVIDE MAINTENANCE, SUPPORT, UPDATES,
+ENHANCEMENTS, OR MODIFICATIONS.
+"""
+
+from nessie.externals import rds
+from nessie.jobs.background_job import BackgroundJobError
+from nessie.models.rds_index_sync import strip_transaction_control, sync_rds_tables
+import pytest
+
+schema = 'rds_index_sync_test'
+
+
+@pytest.fixture()
+def sync_schema(app):
+    rds.execute(f"""DROP SCHEMA IF EXISTS {schema} CASCADE;
+        CREATE SCHEMA {schema};
+        CREATE TABLE {schema}.students (sid VARCHAR NOT NULL, team_code VARCHAR);
+        INSERT INTO {schema}.students VALUES ('1', 'FBM'), ('2', 'WBK'), ('2', 'WSW'), ('3', 'MBB');""")
+    yield
+    rds.execute(f'DROP SCHEMA {schema} CASCADE')
+
+
+def _rows():
+    return rds.fetch(f'SELECT ctid::text, sid, team_code FROM {schema}.students ORDER BY sid, team_code')
+
+
+def _stage(rows):
+    return lambda transaction: transaction.insert_bulk('INSERT INTO pg_temp.students (sid, team_code) VALUES %s', rows)
+
+
+class TestSyncRdsTables:
+    """Differential refresh of RDS index tables."""
+
+    def test_rewrites_changed_sids_only(self, app, sync_schema):
+        before = {(r['sid'], r['team_code']): r['ctid'] for r in _rows()}
+        summary = sync_rds_tables(schema, ['students'], _stage([('1', 'FBM'), ('2', 'WBK'), ('3', 'MBK'), ('4', 'WVB')]))
+        assert 'changed SIDs per table: students 3' in summary
+        after = {(r['sid'], r['team_code']): r['ctid'] for r in _rows()}
+        assert list(after.keys()) == [('1', 'FBM'), ('2', 'WBK'), ('3', 'MBK'), ('4', 'WVB')]
+        # The unchanged SID keeps its physical row.
+        assert after[('1', 'FBM')] == before[('1', 'FBM')]
+        assert after[('2', 'WBK')] != before[('2', 'WBK')]
+
+    def test_removes_missing_sids(self, app, sync_schema):
+        sync_rds_tables(schema, ['students'], _stage([('1', 'FBM')]))
+        assert [r['sid'] for r in _rows()] == ['1']
+
+    def test_no_changes(self, app, sync_schema):
+        before = _rows()
+        summary = sync_rds_tables(schema, ['students'], _stage([('3', 'MBB'), ('2', 'WSW'), ('2', 'WBK'), ('1', 'FBM')]))
+        assert 'changed SIDs per table: students 0' in summary
+        assert _rows() == before
+
+    def test_staging_failure_leaves_table_untouched(self, app, sync_schema):
+        before = _rows()
+        with pytest.raises(BackgroundJobError, match='Failed to stage rows'):
+            sync_rds_tables(schema, ['students'], lambda transaction: False)
+        assert _rows() == before
+
+
+def test_strip_transaction_control():
+    sql = 'BEGIN TRANSACTION;\nTRUNCATE pg_temp.students;\n  COMMIT TRANSACTION;\n'
+    assert strip_transaction_control(sql).split() == ['TRUNCATE', 'pg_temp.students;']